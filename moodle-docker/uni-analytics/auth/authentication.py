@@ -1,13 +1,13 @@
-import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
-from db.moodleConnection import connect_to_moodle_db
+from db.moodleConnection import moodle_connection
+from db.uniAnalytics import connect_to_uni_analytics_db
 from utils.logger import logger 
 
 # Função para obter toda a informação relevante do utilizador a partir do Moodle
 def get_user_info_from_moodle(email):
     try:
-        conn = connect_to_moodle_db()
-        with conn.cursor(dictionary=True) as cursor:
+        # Uma só tentativa: no login não se fica à espera do Moodle (o circuit breaker falha logo se estiver em baixo)
+        with moodle_connection(retries=1) as conn, conn.cursor(dictionary=True) as cursor:
             query = """
                 SELECT
                     u.id AS moodle_user_id,
@@ -25,7 +25,6 @@ def get_user_info_from_moodle(email):
             cursor.execute(query, (email,))
             result = cursor.fetchone()
             logger.debug(f"Resultado da query para {email}: {result}")
-        conn.close()
 
         if result:
             # Se o utilizador não tiver role atribuída no Moodle
@@ -52,7 +51,7 @@ def get_user_info_from_moodle(email):
 def register_user(email, password):
     try:
         # Verifica se já existe localmente
-        conn = sqlite3.connect('db/uniAnalytics.db')
+        conn = connect_to_uni_analytics_db()
         cursor = conn.cursor()
         cursor.execute("SELECT id FROM users WHERE email = ?", (email,))
         if cursor.fetchone():
@@ -97,7 +96,7 @@ def register_user(email, password):
 # Função para autenticar um utilizador local (login)
 def authenticate_user(email, password):
     try:
-        conn = sqlite3.connect('db/uniAnalytics.db')
+        conn = connect_to_uni_analytics_db()
         cursor = conn.cursor()
 
         # Vai buscar o hash da password, id do utilizador e role
@@ -6,6 +6,7 @@ import queries.queriesComuns as qg
 import traceback
 import re
 from utils.logger import logger
+from queries.categorias import contem
 import pandas as pd
 import unicodedata
 
@@ -15,84 +16,62 @@ import unicodedata
 def calcular_pct_completions(dados, user_id, course_id, tipos, grupo_aluno=None, apenas_ids=None):
     logger.debug("[PCT_COMPLETIONS] Início do cálculo de percentagem de completions")
 
-    dados_filtrados = [
-        d for d in dados
-        if d['course_id'] == course_id
-        and d['module_type'] in tipos
-        and (apenas_ids is None or d['course_module_id'] in apenas_ids)
-    ]
+    dados_filtrados = dados[(dados['course_id'] == course_id) & dados['module_type'].isin(tipos)]
+    if apenas_ids is not None:
+        dados_filtrados = dados_filtrados[dados_filtrados['course_module_id'].isin(apenas_ids)]
 
     if grupo_aluno:
         grupo_aluno = grupo_aluno.lower()
-        dados_filtrados = [
-            d for d in dados_filtrados
-            if not (
-                d['module_type'] == 'assign' and (
-                    ("aval" in grupo_aluno and "exame" in normalizar_itemname(d.get('item_name') or "")) or
-                    ("exam" in grupo_aluno and any(e in normalizar_itemname(d.get('item_name') or "") for e in ['efolio', 'global']))
-                )
-            )
-        ]
-
-    ids_unicos = set(d['course_module_id'] for d in dados_filtrados)
-    completados = set(
-        d['course_module_id']
-        for d in dados_filtrados
-        if d.get('user_id') == user_id and d.get('completion_state') == 1
-    )
-
-    total = len(ids_unicos)
-    concluidos = len(completados)
+        nomes = dados_filtrados['item_name'].fillna("").map(normalizar_itemname)
+        excluir = pd.Series(False, index=dados_filtrados.index)
+        if "aval" in grupo_aluno:
+            excluir |= nomes.str.contains("exame")
+        if "exam" in grupo_aluno:
+            excluir |= nomes.str.contains("efolio|global")
+        dados_filtrados = dados_filtrados[~((dados_filtrados['module_type'] == 'assign') & excluir)]
+
+    total = dados_filtrados['course_module_id'].nunique()
+    concluidos = dados_filtrados.loc[
+        (dados_filtrados['user_id'] == user_id) & (dados_filtrados['completion_state'] == 1), 'course_module_id'
+    ].nunique()
 
     logger.debug(f"[PCT_COMPLETIONS] Total: {total}, Concluídos: {concluidos}")
     return round(concluidos / total * 100) if total > 0 else 0
 
 def obter_grupo_aluno(dados, user_id, course_id):
-    for d in dados:
-        if d['user_id'] == user_id and d['course_id'] == course_id and d.get("group_name"):
-            return d["group_name"].lower()
-    return None
+    grupos = dados.loc[(dados['user_id'] == user_id) & (dados['course_id'] == course_id), 'group_name'].dropna()
+    grupos = grupos[grupos != ""]
+    return grupos.iloc[0].lower() if not grupos.empty else None
 
 def obter_assigns_validos(dados, course_id, grupo_aluno):
     assigns_validos = []
-    for d in dados:
-        if d["course_id"] == course_id and d["module_type"] == "assign":
-            nome = normalizar_itemname(d.get("item_name") or "")
-            grupo = (d.get("group_name") or "").lower()
-
-            if grupo_aluno and grupo_aluno in grupo:
-                if "aval" in grupo_aluno and "efolio" in nome and "global" not in nome:
-                    assigns_validos.append(d["course_module_id"])
-                elif "exam" in grupo_aluno and "exame" in nome:
-                    assigns_validos.append(d["course_module_id"])
+    if grupo_aluno:
+        assigns = dados[
+            (dados["course_id"] == course_id) & (dados["module_type"] == "assign") & contem(dados["group_name"], grupo_aluno)
+        ]
+        nomes = assigns["item_name"].fillna("").map(normalizar_itemname)
+        validos = pd.Series(False, index=assigns.index)
+        if "aval" in grupo_aluno:
+            validos |= nomes.str.contains("efolio") & ~nomes.str.contains("global")
+        if "exam" in grupo_aluno:
+            validos |= nomes.str.contains("exame")
+        assigns_validos = assigns.loc[validos, "course_module_id"].tolist()
     logger.debug(f"[ASSIGNS_VALIDOS] Total: {len(assigns_validos)}")
     return assigns_validos
 
 def calcular_desempenho_etl(dados, user_id, course_id):
+    do_aluno = dados[(dados["user_id"] == user_id) & (dados["course_id"] == course_id)]
     grupo_aluno = None
-    for d in dados:
-        if d.get("user_id") == user_id and d.get("course_id") == course_id:
-            grupo_aluno = (d.get("group_name") or "").strip().lower()
-            break
+    if not do_aluno.empty:
+        grupo_aluno = do_aluno["group_name"].iloc[0]
+        grupo_aluno = grupo_aluno.strip().lower() if isinstance(grupo_aluno, str) else ""
 
     if not grupo_aluno or "aval" not in grupo_aluno:
         return "Não Aplicável"
 
-    soma = 0.0
-    for d in dados:
-        if (
-            d.get("course_id") == course_id and
-            d.get("user_id") == user_id and
-            d.get("module_type") == "assign" and
-            d.get("final_grade") is not None
-        ):
-            nome = normalizar_itemname(d.get("item_name") or "")
-            if any(e in nome for e in ['efolio', 'global']):
-                try:
-                    soma += float(d['final_grade'])
-                except (ValueError, TypeError):
-                    logger.warning(f"[DESEMPENHO] Nota inválida ignorada: {d['final_grade']}")
-                    continue
+    notas = do_aluno[(do_aluno["module_type"] == "assign") & do_aluno["final_grade"].notna()]
+    nomes = notas["item_name"].fillna("").map(normalizar_itemname)
+    soma = float(sum(notas.loc[nomes.str.contains("efolio|global"), "final_grade"].tolist()))
 
     logger.debug(f"[DESEMPENHO] Soma final: {soma}")
     if soma < 3.5:
@@ -103,22 +82,16 @@ def calcular_desempenho_etl(dados, user_id, course_id):
         return "Expectável"
 
 def contar_topicos_criados(dados, user_id, course_id):
-    total = sum(
-        1 for d in dados
-        if d['user_id'] == user_id
-        and d['course_id'] == course_id
-        and d['post_type'] == 'topic'
-    )
+    total = int((
+        (dados['user_id'] == user_id) & (dados['course_id'] == course_id) & (dados['post_type'] == 'topic')
+    ).sum())
     logger.debug(f"[TOPICOS] Criados: {total}")
     return total
 
 def contar_respostas(dados, user_id, course_id):
-    total = sum(
-        1 for d in dados
-        if d['user_id'] == user_id
-        and d['course_id'] == course_id
-        and d['post_type'] == 'reply'
-    )
+    total = int((
+        (dados['user_id'] == user_id) & (dados['course_id'] == course_id) & (dados['post_type'] == 'reply')
+    ).sum())
     logger.debug(f"[RESPOSTAS] Total: {total}")
     return total
 
@@ -129,11 +102,11 @@ def contar_interacoes_aluno(dados, user_id, course_id):
     ]
     contagem = {tipo: 0 for tipo in tipos}
 
+    # dados já vem filtrado para o aluno e curso, com o total de cada tipo de interação
     for d in dados:
-        if d['user_id'] == user_id and d['course_id'] == course_id:
-            tipo = d.get('tipo_interacao')
-            if tipo in contagem:
-                contagem[tipo] += 1
+        tipo = d.get('tipo_interacao')
+        if tipo in contagem:
+            contagem[tipo] += d['total']
 
     logger.debug(f"[INTERAÇÕES] Contagem: {contagem}")
     return contagem
@@ -266,7 +239,7 @@ def layout(user_id):
         cursos_unicos = cursos_ordenados.drop_duplicates(subset=["uc_id"])
         cursos_ano_atual = cursos_unicos[cursos_unicos['ano_letivo'] == ano_atual]
 
-        course_id_inicial = cursos_ano_atual['course_id'].values[0] if not cursos_ano_atual.empty else None
+        course_id_inicial = int(cursos_ano_atual['course_id'].values[0]) if not cursos_ano_atual.empty else None
 
         return html.Div(children=[
             dcc.Store(id="store_user_id_aluno", data=user_id),
@@ -279,9 +252,9 @@ def layout(user_id):
     
 def gerar_dashboard_conteudo(user_id, course_id):
     try:
-        dados_completions = qg.fetch_all_grade_progress_local()
-        dados_forum = qg.fetch_all_forum_posts_local()
-        dados_interacoes = qa.fetch_all_interacoes_local()
+        dados_completions = qg.fetch_all_grade_progress_local(course_id)
+        dados_forum = qg.fetch_all_forum_posts_local(course_id)
+        dados_interacoes = qa.fetch_interacoes_aluno_local(user_id, course_id)
 
         grupo_aluno = obter_grupo_aluno(dados_completions, user_id, course_id)
         assigns_validos = obter_assigns_validos(dados_completions, course_id, grupo_aluno)
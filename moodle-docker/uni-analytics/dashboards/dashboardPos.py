@@ -5,6 +5,8 @@ import pandas as pd
 from datetime import datetime
 import queries.queriesComuns as qg
 from utils.logger import logger
+from utils.tempo import epochs_para_datetime
+from queries.categorias import contem, mascara_categorias
 import queries.formsPos as qpos
 import queries.formsComuns as qfcomuns
 from db.uniAnalytics import connect_to_uni_analytics_db
@@ -61,8 +63,8 @@ def obter_opcoes_dropdown_pos():
         logger.debug(f"[DASHBOARD_POS] Resultados fetch_all_efolios: {resultados}")
 
         df = pd.DataFrame(resultados)
-        df['start_date'] = pd.to_datetime(df['start_date'])
-        df['end_date'] = pd.to_datetime(df['end_date'])
+        df['start_date'] = epochs_para_datetime(df['start_date'])
+        df['end_date'] = epochs_para_datetime(df['end_date'])
         df['ano_letivo'] = df['start_date'].dt.year
         hoje = pd.Timestamp.now()
 
@@ -111,9 +113,9 @@ def get_total_respostas_info_reais(item_id):
         df_utilizadores = pd.DataFrame(qg.fetch_all_user_course_data_local())
 
         df_filtrado = df_utilizadores[
-            (df_utilizadores["role"].str.lower() == "student") &
+            mascara_categorias(df_utilizadores["role"], lambda role: role.lower() == "student") &
             (df_utilizadores["course_id"] == course_id) &
-            (df_utilizadores["group_name"].fillna("").str.strip().str.lower().str.contains("aval"))
+            contem(df_utilizadores["group_name"], "aval")
         ]
 
         total_alunos = len(df_filtrado)
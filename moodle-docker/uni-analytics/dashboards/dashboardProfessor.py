@@ -8,9 +8,9 @@ import traceback
 import pandas as pd
 import re
 import unicodedata
-from datetime import datetime
-from collections import defaultdict 
 from utils.logger import logger
+from utils.tempo import formatar_epoch
+from queries.categorias import contem
 
 import warnings
 warnings.simplefilter("always", pd.errors.SettingWithCopyWarning)
@@ -48,9 +48,8 @@ def filtrar_alunos_avaliacao_continua(cursos, course_id):
     estudantes = cursos_df[
         (cursos_df['course_id'] == course_id) &
         (cursos_df['role'] == 'student')
-    ].copy()
-    estudantes['grupo'] = estudantes['group_name'].fillna('').str.lower()
-    return estudantes[estudantes['grupo'].str.contains('aval')]['user_id'].unique()
+    ]
+    return estudantes[contem(estudantes['group_name'], 'aval')]['user_id'].unique()
 
 def contar_conteudos_publicados(dados, user_id, course_id):
     logger.debug("contar_conteudos_publicados: professor %s, course_id %s", user_id, course_id)
@@ -58,34 +57,27 @@ def contar_conteudos_publicados(dados, user_id, course_id):
         'resource': 'Ficheiros', 'page': 'Páginas', 'url': 'Links',
         'book': 'Livros', 'folder': 'Pastas', 'quiz': 'Quizzes', 'lesson': 'Lições', 'forum': 'Fóruns' , 'scorm': 'Conteudos Publicados'
     }
-    contagem = {nome: 0 for nome in tipos.values()}
-    for d in dados:
-        if d['course_id'] == course_id:
-            tipo_raw = d.get('module_type')
-            if tipo_raw in tipos:
-                contagem[tipos[tipo_raw]] += 1
+    contagens = dados.loc[dados['course_id'] == course_id, 'module_type'].value_counts()
+    contagem = {nome: int(contagens.get(tipo, 0)) for tipo, nome in tipos.items()}
     logger.debug("contagem de conteúdos publicada: %r", contagem)
     return contagem
 
 def contar_topicos_respostas_professor(dados, user_id, course_id):
     logger.debug("contar_topicos_respostas_professor: professor %s, course_id %s", user_id, course_id)
-    criados = sum(1 for d in dados if d['user_id'] == user_id and d['course_id'] == course_id and d['post_type'] == 'topic')
-    respondidos = sum(1 for d in dados if d['user_id'] == user_id and d['course_id'] == course_id and d['post_type'] == 'reply')
+    do_professor = dados[(dados['user_id'] == user_id) & (dados['course_id'] == course_id)]
+    criados = int((do_professor['post_type'] == 'topic').sum())
+    respondidos = int((do_professor['post_type'] == 'reply').sum())
     logger.debug("tópicos criados=%d, respondidos=%d", criados, respondidos)
     return criados, respondidos
 
 def calcular_velocidade_resposta(posts, user_id, course_id):
     logger.debug("calcular_velocidade_resposta: professor %s, course_id %s", user_id, course_id)
-    posts_curso = [p for p in posts if p["course_id"] == course_id]
-    posts_aluno = [p for p in posts_curso if "student" in (p.get("role") or "").lower()]
-    tempos_resposta = []
-    for post_aluno in posts_aluno:
-        tempo_post = datetime.fromtimestamp(post_aluno["time_created"])
-        respostas_professor = [p for p in posts_curso if p.get("parent") == post_aluno["post_id"] and p["user_id"] == user_id]
-        if respostas_professor:
-            tempo_resposta = datetime.fromtimestamp(min(respostas_professor, key=lambda p: p["time_created"])["time_created"])
-            delta = (tempo_resposta - tempo_post).total_seconds() / (3600 * 24)
-            tempos_resposta.append(delta)
+    posts_curso = posts[posts["course_id"] == course_id]
+    posts_aluno = posts_curso[contem(posts_curso["role"], "student")]
+    # Primeira resposta do professor a cada post
+    primeira_resposta = posts_curso[posts_curso["user_id"] == user_id].groupby("parent")["time_created"].min()
+    tempo_resposta = posts_aluno["post_id"].map(primeira_resposta)
+    tempos_resposta = ((tempo_resposta - posts_aluno["time_created"]) / (3600 * 24)).dropna().tolist()
     if tempos_resposta:
         media = sum(tempos_resposta) / len(tempos_resposta)
         dias = int(media); horas = round((media - dias) * 24)
@@ -95,16 +87,10 @@ def calcular_velocidade_resposta(posts, user_id, course_id):
     logger.debug("nenhuma resposta encontrada para cálculo de velocidade")
     return None
 
-def calcular_media_acessos_semanal(acessos, user_id, course_id):
+def calcular_media_acessos_semanal(user_id, course_id):
     logger.debug("calcular_media_acessos_semanal: professor %s, course_id %s", user_id, course_id)
-    acessos_prof = [a for a in acessos if a["user_id"] == user_id and a["course_id"] == course_id]
-    semanas = defaultdict(int)
-    for a in acessos_prof:
-        dt = a["access_time"]
-        if isinstance(dt, str):
-            dt = datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
-        semanas[dt.strftime("%Y-%W")] += 1
-    media = round(sum(semanas.values()) / len(semanas), 1) if semanas else 0
+    semanas = qp.fetch_acessos_semanais_local(user_id, course_id)
+    media = round(sum(s["total"] for s in semanas) / len(semanas), 1) if semanas else 0
     logger.debug("média semanal de acessos: %s", media)
     return media
 
@@ -113,9 +99,8 @@ def calcular_distribuicao_desempenho_global_professor(completions, cursos, cours
     completions_df = pd.DataFrame(completions)
     cursos_df = pd.DataFrame(cursos)
     distribuicao = {"Crítico": 0, "Em Risco": 0, "Expectável": 0}
-    estudantes = cursos_df[(cursos_df['course_id'] == course_id) & (cursos_df['role'] == 'student')].copy()
-    estudantes['grupo'] = estudantes['group_name'].fillna('').str.lower()
-    alunos_ids = estudantes[estudantes['grupo'].str.contains('aval')]['user_id'].unique()
+    estudantes = cursos_df[(cursos_df['course_id'] == course_id) & (cursos_df['role'] == 'student')]
+    alunos_ids = estudantes[contem(estudantes['group_name'], 'aval')]['user_id'].unique()
     for aluno_id in alunos_ids:
         soma = 0.0
         notas_aluno = completions_df[
@@ -159,17 +144,13 @@ def extrair_ano_letivo(course_name):
     logger.debug("ano letivo não encontrado em course_name")
     return None
 
-def obter_ultimo_acesso_uc(acessos, user_id, course_id):
+def obter_ultimo_acesso_uc(user_id, course_id):
     logger.debug("obter_ultimo_acesso_uc: professor %s, course_id %s", user_id, course_id)
-    acessos_prof = [a for a in acessos if a["user_id"] == user_id and a["course_id"] == course_id]
-    if not acessos_prof:
+    ultimo = qp.fetch_ultimo_acesso_local(user_id, course_id)
+    if ultimo is None:
         logger.debug("nenhum acesso encontrado")
         return "—"
-    mais_recente = max(acessos_prof, key=lambda a: a["access_time"])
-    dt = mais_recente["access_time"]
-    if isinstance(dt, str):
-        dt = datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
-    res = dt.strftime("%d/%m/%Y")
+    res = formatar_epoch(ultimo, "%d/%m/%Y")
     logger.debug("último acesso: %s", res)
     return res
 
@@ -315,17 +296,13 @@ def calcular_taxa_conclusao_formativas(completions, cursos, course_id):
 
 def calcular_ultima_participacao_forum(posts, user_id, course_id):
     logger.debug("calcular_ultima_participacao_forum: início para user_id=%s, course_id=%s", user_id, course_id)
-    posts_professor = [
-        p for p in posts
-        if p["user_id"] == user_id and p["course_id"] == course_id
-    ]
-    if not posts_professor:
+    posts_professor = posts[(posts["user_id"] == user_id) & (posts["course_id"] == course_id)]
+    if posts_professor.empty:
         logger.debug("calcular_ultima_participacao_forum: sem participações")
         return "—"
 
-    mais_recente = max(posts_professor, key=lambda p: p["time_created"])
-    dt = datetime.fromtimestamp(mais_recente["time_created"])
-    resultado = dt.strftime("%d/%m/%Y %H:%M")
+    mais_recente = int(posts_professor["time_created"].max())
+    resultado = formatar_epoch(mais_recente, "%d/%m/%Y %H:%M")
     logger.debug("calcular_ultima_participacao_forum: última participação=%s", resultado)
     return resultado
 
@@ -441,22 +418,21 @@ def atualizar_topo_info_professor(novo_course_id, user_id):
     return f"[{papel}] {nome}", nome_curso
 
 def contar_foruns_disponibilizados(dados, course_id):
-    return sum(1 for d in dados if d["course_id"] == course_id and d["module_type"] == "forum")
+    return int(((dados["course_id"] == course_id) & (dados["module_type"] == "forum")).sum())
 
 def atualizar_dashboard_professor(course_id, user_id):
     try:
-        dados_conteudos = qp.fetch_conteudos_disponibilizados_local()
+        dados_conteudos = qp.fetch_conteudos_disponibilizados_local(course_id)
         contagem = contar_conteudos_publicados(dados_conteudos, user_id, course_id)
 
-        dados_forum = qg.fetch_all_forum_posts_local()
+        dados_forum = qg.fetch_all_forum_posts_local(course_id)
         dados_cursos = qg.fetch_all_user_course_data_local()
         topicos_criados, topicos_respondidos = contar_topicos_respostas_professor(dados_forum, user_id, course_id)
         velocidade = calcular_velocidade_resposta(dados_forum, user_id, course_id)
         ultima_participacao = calcular_ultima_participacao_forum(dados_forum, user_id, course_id)
 
-        dados_acessos = qp.fetch_course_access_logs_local()
-        media_acessos = calcular_media_acessos_semanal(dados_acessos, user_id, course_id)
-        ultimo_acesso = obter_ultimo_acesso_uc(dados_acessos, user_id, course_id)
+        media_acessos = calcular_media_acessos_semanal(user_id, course_id)
+        ultimo_acesso = obter_ultimo_acesso_uc(user_id, course_id)
 
         dados_completions = qg.fetch_all_grade_progress_local()
         dados_medias = calcular_medias_efolios(dados_completions, dados_cursos, course_id)
@@ -541,21 +517,20 @@ def layout(user_id):
         cursos_unicos = cursos_ordenados.drop_duplicates(subset=["uc_id"]).copy()
         cursos_ano_atual = cursos_unicos[cursos_unicos['ano_letivo'] == ano_atual]
 
-        course_id = cursos_ano_atual['course_id'].values[0] if not cursos_ano_atual.empty else None
+        course_id = int(cursos_ano_atual['course_id'].values[0]) if not cursos_ano_atual.empty else None
 
-        dados_conteudos = qp.fetch_conteudos_disponibilizados_local()
+        dados_conteudos = qp.fetch_conteudos_disponibilizados_local(course_id)
         contagem = contar_conteudos_publicados(dados_conteudos, user_id, course_id)
 
-        dados_forum = qg.fetch_all_forum_posts_local()
+        dados_forum = qg.fetch_all_forum_posts_local(course_id)
         dados_cursos = qg.fetch_all_user_course_data_local()
 
         topicos_criados, topicos_respondidos = contar_topicos_respostas_professor(dados_forum, user_id, course_id)
         velocidade = calcular_velocidade_resposta(dados_forum, user_id, course_id)
         ultima_participacao = calcular_ultima_participacao_forum(dados_forum, user_id, course_id)
 
-        dados_acessos = qp.fetch_course_access_logs_local()
-        media_acessos = calcular_media_acessos_semanal(dados_acessos, user_id, course_id)
-        ultimo_acesso = obter_ultimo_acesso_uc(dados_acessos, user_id, course_id)
+        media_acessos = calcular_media_acessos_semanal(user_id, course_id)
+        ultimo_acesso = obter_ultimo_acesso_uc(user_id, course_id)
 
         dados_completions = qg.fetch_all_grade_progress_local()
         dados_medias = calcular_medias_efolios(dados_completions, dados_cursos, course_id)
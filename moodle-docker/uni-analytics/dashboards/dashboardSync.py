@@ -0,0 +1,194 @@
+from dash import html, dcc
+import plotly.express as px
+import plotly.graph_objects as go
+import pandas as pd
+from utils.logger import logger
+import queries.syncTelemetry as qtel
+
+
+# =========================
+# Funções de lógica modular
+# ========================
+def carregar_sync_runs():
+    try:
+        df = pd.DataFrame(qtel.fetch_sync_runs_local())
+        if df.empty:
+            return df
+        df["started_at"] = pd.to_datetime(df["started_at"])
+        df["duracao_total"] = df["extract_seconds"].fillna(0) + df["load_seconds"].fillna(0)
+        df["peak_memory_mb"] = df["peak_memory_kb"].fillna(0) / 1024
+        return df
+    except Exception:
+        logger.exception("[DASHBOARD_SYNC] Erro ao carregar o histórico de sincronizações")
+        return pd.DataFrame()
+
+def figura_sem_dados():
+    fig = go.Figure()
+    fig.update_layout(
+        annotations=[
+            dict(
+                text="Sem dados suficientes para gerar o gráfico.",
+                xref="paper", yref="paper",
+                x=0.5, y=0.5,
+                showarrow=False,
+                font=dict(size=14, color="#2c3e50")
+            )
+        ],
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False),
+        paper_bgcolor="#f4faf4",
+        plot_bgcolor="#f4faf4",
+        margin=dict(l=10, r=10, t=20, b=10)
+    )
+    return fig
+
+def aplicar_estilo(fig):
+    fig.update_layout(
+        margin=dict(t=20, b=20, l=20, r=20),
+        paper_bgcolor="#f4faf4",
+        plot_bgcolor="#f4faf4",
+        font=dict(color="#2c3e50"),
+        legend_title_text=""
+    )
+    return fig
+
+# Duração (extração + carga) de cada tabela ao longo do tempo
+def render_grafico_duracao(df_tabelas):
+    if df_tabelas.empty:
+        return figura_sem_dados()
+    fig = px.line(
+        df_tabelas.sort_values("started_at"),
+        x="started_at", y="duracao_total", color="table_name", markers=True,
+        labels={"started_at": "Execução", "duracao_total": "Duração (s)", "table_name": "Tabela"}
+    )
+    return aplicar_estilo(fig)
+
+# Tempo de extração vs tempo de carga na última execução de cada tabela
+def render_grafico_extracao_carga(df_ultima):
+    if df_ultima.empty:
+        return figura_sem_dados()
+    df = df_ultima.melt(
+        id_vars="table_name", value_vars=["extract_seconds", "load_seconds"],
+        var_name="fase", value_name="segundos"
+    )
+    df["fase"] = df["fase"].map({"extract_seconds": "Extração", "load_seconds": "Carga"})
+    fig = px.bar(
+        df, x="table_name", y="segundos", color="fase", barmode="stack",
+        labels={"table_name": "Tabela", "segundos": "Segundos"},
+        color_discrete_sequence=["#87cefa", "#90ee90"]
+    )
+    return aplicar_estilo(fig)
+
+# Linhas lidas, inseridas, atualizadas, apagadas e ignoradas na última execução de cada tabela
+def render_grafico_linhas(df_ultima):
+    if df_ultima.empty:
+        return figura_sem_dados()
+    df = df_ultima.melt(
+        id_vars="table_name",
+        value_vars=["rows_read", "rows_inserted", "rows_updated", "rows_deleted", "rows_ignored"],
+        var_name="tipo", value_name="linhas"
+    )
+    df["tipo"] = df["tipo"].map({
+        "rows_read": "Lidas", "rows_inserted": "Inseridas", "rows_updated": "Atualizadas",
+        "rows_deleted": "Apagadas", "rows_ignored": "Ignoradas"
+    })
+    fig = px.bar(
+        df, x="table_name", y="linhas", color="tipo", barmode="group",
+        labels={"table_name": "Tabela", "linhas": "Linhas"},
+        color_discrete_sequence=["#87cefa", "#90ee90", "#ffd700", "#d3d3d3", "#f08080"]
+    )
+    return aplicar_estilo(fig)
+
+# Pico de memória do processo durante o sync de cada tabela ao longo do tempo
+def render_grafico_memoria(df_tabelas):
+    if df_tabelas.empty:
+        return figura_sem_dados()
+    fig = px.line(
+        df_tabelas.sort_values("started_at"),
+        x="started_at", y="peak_memory_mb", color="table_name", markers=True,
+        labels={"started_at": "Execução", "peak_memory_mb": "Pico de memória (MB)", "table_name": "Tabela"}
+    )
+    return aplicar_estilo(fig)
+
+# Lista das últimas execuções completas
+def render_lista_execucoes(df_execucoes):
+    if df_execucoes.empty:
+        return html.P("Ainda não existem execuções de sincronização registadas.")
+
+    linhas = []
+    for _, row in df_execucoes.head(20).iterrows():
+        texto = (
+            f"{row['started_at']:%Y-%m-%d %H:%M} — {row['status']} — "
+            f"{row['duracao_total']:.1f} s, {int(row['rows_inserted'] or 0)} registos inseridos, "
+            f"{int(row['rows_ignored'] or 0)} ignorados"
+        )
+        if row["error"]:
+            texto += f" ({row['error']})"
+        linhas.append(html.Li(texto))
+    return html.Ul(linhas)
+
+def layout():
+    df = carregar_sync_runs()
+    if df.empty:
+        df_tabelas = df_execucoes = df_ultima = df
+    else:
+        df_tabelas = df[df["table_name"].notna()]
+        df_execucoes = df[df["table_name"].isna()]
+        df_ultima = df_tabelas.sort_values("started_at").groupby("table_name", as_index=False).last()
+
+    return html.Div([
+        html.H2("Saúde da sincronização", className="dashboard-pre-subsecao"),
+
+        html.Div(className="dashboard-pre-row", children=[
+            html.Div(className="dashboard-pre-card", children=[
+                html.Div(className="tooltip-bloco", children=[
+                    html.H4("Duração por tabela", className="tooltip-hover dashboard-pre-card-title"),
+                    html.Span(
+                        "Mostra a duração total (extração do Moodle + carga local) do sync de cada tabela em cada execução.",
+                        className="tooltip-text"
+                    )
+                ]),
+                dcc.Graph(figure=render_grafico_duracao(df_tabelas), config={"displayModeBar": False}, style={"height": "280px"})
+            ]),
+            html.Div(className="dashboard-pre-card", children=[
+                html.Div(className="tooltip-bloco", children=[
+                    html.H4("Extração vs carga", className="tooltip-hover dashboard-pre-card-title"),
+                    html.Span(
+                        "Mostra, para a última execução de cada tabela, o tempo à espera do Moodle (extração) "
+                        "e o tempo de escrita na base de dados local (carga).",
+                        className="tooltip-text"
+                    )
+                ]),
+                dcc.Graph(figure=render_grafico_extracao_carga(df_ultima), config={"displayModeBar": False}, style={"height": "280px"})
+            ])
+        ]),
+
+        html.Div(className="dashboard-pre-row", children=[
+            html.Div(className="dashboard-pre-card", children=[
+                html.Div(className="tooltip-bloco", children=[
+                    html.H4("Linhas sincronizadas", className="tooltip-hover dashboard-pre-card-title"),
+                    html.Span(
+                        "Mostra as linhas lidas do Moodle, inseridas, atualizadas, apagadas e ignoradas (por erro) "
+                        "na última execução de cada tabela.",
+                        className="tooltip-text"
+                    )
+                ]),
+                dcc.Graph(figure=render_grafico_linhas(df_ultima), config={"displayModeBar": False}, style={"height": "280px"})
+            ]),
+            html.Div(className="dashboard-pre-card", children=[
+                html.Div(className="tooltip-bloco", children=[
+                    html.H4("Pico de memória", className="tooltip-hover dashboard-pre-card-title"),
+                    html.Span(
+                        "Mostra o pico de memória residente do processo de sincronização durante o sync de cada tabela.",
+                        className="tooltip-text"
+                    )
+                ]),
+                dcc.Graph(figure=render_grafico_memoria(df_tabelas), config={"displayModeBar": False}, style={"height": "280px"})
+            ])
+        ]),
+
+        html.Div(className="card", children=[
+            html.H3("Últimas execuções", className="home-bloco-titulo"),
+            render_lista_execucoes(df_execucoes)
+        ])
+    ])
@@ -0,0 +1,419 @@
+import os
+import gzip
+import lzma
+import time
+import json
+import shutil
+import sqlite3
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+from db.uniAnalytics import DB_PATH, connect_to_uni_analytics_db
+from utils.logger import logger
+
+# Configuração dos backups da base de dados local (variáveis de ambiente)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "/app/backups/local_db")  # Pasta dos backups
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "1024"))  # Páginas copiadas por passo da API de backup
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.01"))  # Pausa (s) entre passos, para não bloquear os escritores
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "gzip").lower()  # none, gzip, lzma ou zstd (Python >= 3.14)
+BACKUP_RETENTION_DAYS = int(os.getenv("BACKUP_RETENTION_DAYS", "7"))  # Dias durante os quais os backups são mantidos
+BACKUP_MODE = os.getenv("BACKUP_MODE", "snapshot").lower()  # snapshot (blocos deduplicados) ou completo (ficheiro inteiro)
+BACKUP_CHUNK_SIZE = int(os.getenv("BACKUP_CHUNK_SIZE", str(1024 * 1024)))  # Tamanho dos blocos dos snapshots (arredondado a páginas)
+
+# Extensão acrescentada a backup_<timestamp>.db por cada tipo de compressão
+EXTENSOES = {"none": "", "gzip": ".gz", "lzma": ".xz", "zstd": ".zst"}
+
+# Blocos sem referências só são apagados pelo GC se não forem tocados há mais do que este tempo (segundos),
+# para não apagar blocos de um snapshot que está a ser criado ao mesmo tempo
+_GC_MARGEM_SEGUNDOS = 3600
+
+# Tamanho dos blocos lidos/escritos na compressão (a memória usada não depende do tamanho da base de dados)
+_BLOCO_COMPRESSAO = 1024 * 1024
+
+# Devolve a compressão a usar: zstd só existe na biblioteca standard a partir do Python 3.14 (senão usa gzip)
+def resolver_compressao(compressao=None):
+    compressao = (compressao or BACKUP_COMPRESSION).lower()
+    if compressao == "zstd":
+        try:
+            from compression import zstd  # noqa: F401
+        except ImportError:
+            logger.warning("[BACKUP] zstd não está disponível nesta versão de Python; a usar gzip.")
+            return "gzip"
+    if compressao not in EXTENSOES:
+        logger.warning(f"[BACKUP] Compressão '{compressao}' desconhecida; a usar gzip.")
+        return "gzip"
+    return compressao
+
+# Abre um ficheiro para escrita com a compressão indicada
+def abrir_para_escrita(caminho, compressao):
+    if compressao == "gzip":
+        return gzip.open(caminho, "wb", compresslevel=6)
+    if compressao == "lzma":
+        return lzma.open(caminho, "wb", preset=6)
+    if compressao == "zstd":
+        from compression import zstd
+        return zstd.open(caminho, "wb")
+    return open(caminho, "wb")
+
+# Abre um backup para leitura, escolhendo a descompressão pela extensão do ficheiro
+def abrir_para_leitura(caminho):
+    if caminho.endswith(".gz"):
+        return gzip.open(caminho, "rb")
+    if caminho.endswith(".xz"):
+        return lzma.open(caminho, "rb")
+    if caminho.endswith(".zst"):
+        from compression import zstd
+        return zstd.open(caminho, "rb")
+    return open(caminho, "rb")
+
+# Copia a base de dados com a API de backup online do SQLite, em passos de pages páginas.
+# Entre passos os escritores (sync, dashboards) podem continuar; a cópia final é sempre um estado consistente
+# (se a origem for alterada por outra ligação durante a cópia, o SQLite recomeça-a a partir dessa alteração).
+def copiar_online(origem, destino, pages=None, sleep=None):
+    conn_origem = sqlite3.connect(origem)
+    conn_destino = sqlite3.connect(destino)
+    try:
+        conn_origem.backup(
+            conn_destino,
+            pages=pages or BACKUP_PAGES_PER_STEP,
+            sleep=BACKUP_STEP_SLEEP if sleep is None else sleep
+        )
+    finally:
+        conn_destino.close()
+        conn_origem.close()
+
+# Corre PRAGMA integrity_check numa cópia e devolve o resultado ("ok" se estiver íntegra)
+def verificar_integridade(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        linhas = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    return "; ".join(linha[0] for linha in linhas)
+
+# Comprime um ficheiro em streaming, por blocos
+def comprimir_ficheiro(origem, destino, compressao):
+    with open(origem, "rb") as src, abrir_para_escrita(destino, compressao) as dst:
+        shutil.copyfileobj(src, dst, _BLOCO_COMPRESSAO)
+
+# Grava o resultado de um backup em backup_runs
+# (nos snapshots, backup_size é o volume dos blocos novos escritos)
+def registar_backup(ficheiro, db_size, backup_size, duracao, compressao, integridade, status, blocos=None, blocos_novos=None):
+    conn = connect_to_uni_analytics_db()
+    conn.execute("""
+        INSERT INTO backup_runs (file, created_at, db_size_bytes, backup_size_bytes, duration_seconds, compression, integrity, status, chunks_total, chunks_new)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (ficheiro, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), db_size, backup_size, duracao, compressao, integridade, status, blocos, blocos_novos))
+    conn.commit()
+    conn.close()
+
+# Cria um backup da base de dados local: cópia online por páginas para um ficheiro temporário, verificação
+# da integridade da cópia e compressão opcional. Regista o tamanho e a duração em backup_runs.
+# Lança uma exceção (e não deixa o ficheiro) se a cópia não passar na verificação de integridade.
+def criar_backup(origem=None, destino_dir=None, compressao=None):
+    origem = origem or DB_PATH
+    destino_dir = destino_dir or BACKUP_DIR
+    compressao = resolver_compressao(compressao)
+    os.makedirs(destino_dir, exist_ok=True)
+
+    inicio = time.perf_counter()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    destino = os.path.join(destino_dir, f"backup_{timestamp}.db{EXTENSOES[compressao]}")
+    temporario = os.path.join(destino_dir, f"backup_{timestamp}.db.tmp")
+
+    try:
+        db_size, integridade = _copiar_e_verificar(origem, temporario, destino, compressao, inicio)
+
+        if compressao == "none":
+            os.replace(temporario, destino)
+        else:
+            comprimir_ficheiro(temporario, destino, compressao)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+    backup_size = os.path.getsize(destino)
+    duracao = time.perf_counter() - inicio
+    registar_backup(destino, db_size, backup_size, duracao, compressao, integridade, "ok")
+    logger.info(
+        f"[BACKUP] Backup criado: {destino} ({db_size / 1048576:.1f} MB → {backup_size / 1048576:.1f} MB, "
+        f"{compressao}) em {duracao:.1f} s. Integridade: {integridade}."
+    )
+    return destino
+
+# Cria a cópia online verificada num ficheiro temporário e devolve o seu tamanho e o resultado da verificação.
+# Se a cópia não estiver íntegra, regista a falha e lança uma exceção.
+def _copiar_e_verificar(origem, temporario, registo, compressao, inicio):
+    copiar_online(origem, temporario)
+    db_size = os.path.getsize(temporario)
+    integridade = verificar_integridade(temporario)
+    if integridade != "ok":
+        registar_backup(registo, db_size, None, time.perf_counter() - inicio, compressao, integridade, "corrompido")
+        raise RuntimeError(f"Backup falhou a verificação de integridade: {integridade}")
+    return db_size, integridade
+
+################### Snapshots incrementais ###################
+# Os snapshots guardam a base de dados em blocos de tamanho fixo (múltiplo do tamanho de página, pelo que uma
+# página alterada só afeta o bloco que a contém), endereçados pelo SHA-256 do seu conteúdo:
+#   snapshots/blocos/<2 primeiros carateres>/<sha256>[.gz|.xz|.zst]
+#   snapshots/manifestos/snapshot_<timestamp>.json  (lista ordenada dos blocos e metadados)
+# Cada snapshot só escreve os blocos que ainda não existem; os restantes são partilhados com os anteriores.
+
+def _pastas_snapshots(destino_dir):
+    base = os.path.join(destino_dir, "snapshots")
+    return os.path.join(base, "blocos"), os.path.join(base, "manifestos")
+
+def _caminho_bloco(pasta_blocos, digest, compressao):
+    return os.path.join(pasta_blocos, digest[:2], f"{digest}{EXTENSOES[compressao]}")
+
+def comprimir_bytes(dados, compressao):
+    if compressao == "gzip":
+        return gzip.compress(dados, compresslevel=6)
+    if compressao == "lzma":
+        return lzma.compress(dados, preset=6)
+    if compressao == "zstd":
+        from compression import zstd
+        return zstd.compress(dados)
+    return dados
+
+def descomprimir_bytes(dados, compressao):
+    if compressao == "gzip":
+        return gzip.decompress(dados)
+    if compressao == "lzma":
+        return lzma.decompress(dados)
+    if compressao == "zstd":
+        from compression import zstd
+        return zstd.decompress(dados)
+    return dados
+
+# Escreve um ficheiro de forma atómica (temporário + rename), para que um bloco ou manifesto nunca fique a meio
+def _escrever_atomico(caminho, dados):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f"{caminho}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(dados)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+
+# Tamanho dos blocos de um snapshot: BACKUP_CHUNK_SIZE arredondado a um múltiplo do tamanho de página
+def _tamanho_bloco(caminho_bd):
+    conn = sqlite3.connect(caminho_bd)
+    (page_size,) = conn.execute("PRAGMA page_size").fetchone()
+    conn.close()
+    return page_size, max(page_size, BACKUP_CHUNK_SIZE // page_size * page_size)
+
+# Cria um snapshot incremental da base de dados local: cópia online verificada (como em criar_backup),
+# dividida em blocos; só os blocos novos são comprimidos e gravados. Devolve o caminho do manifesto.
+def criar_snapshot(origem=None, destino_dir=None, compressao=None):
+    origem = origem or DB_PATH
+    destino_dir = destino_dir or BACKUP_DIR
+    compressao = resolver_compressao(compressao)
+    pasta_blocos, pasta_manifestos = _pastas_snapshots(destino_dir)
+    os.makedirs(pasta_manifestos, exist_ok=True)
+
+    inicio = time.perf_counter()
+    agora = datetime.now()
+    timestamp = agora.strftime("%Y%m%d_%H%M%S")
+    manifesto = os.path.join(pasta_manifestos, f"snapshot_{timestamp}.json")
+    temporario = os.path.join(destino_dir, f"backup_{timestamp}.db.tmp")
+
+    blocos = []
+    novos = 0
+    bytes_novos = 0
+    try:
+        db_size, integridade = _copiar_e_verificar(origem, temporario, manifesto, compressao, inicio)
+        page_size, tamanho_bloco = _tamanho_bloco(temporario)
+
+        with open(temporario, "rb") as f:
+            while True:
+                bloco = f.read(tamanho_bloco)
+                if not bloco:
+                    break
+                digest = hashlib.sha256(bloco).hexdigest()
+                caminho = _caminho_bloco(pasta_blocos, digest, compressao)
+                if os.path.exists(caminho):
+                    # Atualiza a data do bloco reutilizado, para o GC não o apagar enquanto este snapshot é criado
+                    os.utime(caminho)
+                else:
+                    dados = comprimir_bytes(bloco, compressao)
+                    _escrever_atomico(caminho, dados)
+                    novos += 1
+                    bytes_novos += len(dados)
+                blocos.append(digest)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+    # O manifesto é escrito por último: um snapshot só existe depois de todos os seus blocos estarem gravados
+    _escrever_atomico(manifesto, json.dumps({
+        "created_at": agora.strftime('%Y-%m-%d %H:%M:%S'),
+        "size": db_size,
+        "page_size": page_size,
+        "chunk_size": tamanho_bloco,
+        "compression": compressao,
+        "integrity": integridade,
+        "chunks": blocos,
+    }).encode("utf-8"))
+
+    duracao = time.perf_counter() - inicio
+    registar_backup(manifesto, db_size, bytes_novos, duracao, compressao, integridade, "ok", len(blocos), novos)
+    logger.info(
+        f"[BACKUP] Snapshot criado: {manifesto} ({db_size / 1048576:.1f} MB, {novos}/{len(blocos)} blocos novos, "
+        f"{bytes_novos / 1048576:.1f} MB escritos, {compressao}) em {duracao:.1f} s. Integridade: {integridade}."
+    )
+    return manifesto
+
+# Lista os manifestos dos snapshots, do mais antigo para o mais recente
+def listar_snapshots(destino_dir=None):
+    _, pasta_manifestos = _pastas_snapshots(destino_dir or BACKUP_DIR)
+    if not os.path.isdir(pasta_manifestos):
+        return []
+    return sorted(
+        os.path.join(pasta_manifestos, ficheiro)
+        for ficheiro in os.listdir(pasta_manifestos)
+        if ficheiro.startswith("snapshot_") and ficheiro.endswith(".json")
+    )
+
+def _ler_manifesto(caminho):
+    with open(caminho, "rb") as f:
+        return json.loads(f.read())
+
+# Encontra um backup a partir do nome dado no restauro: "ultimo", o nome/caminho de um snapshot
+# ou o caminho de um backup completo (backup_<timestamp>.db[.gz|.xz|.zst])
+def _resolver_backup(backup, destino_dir):
+    if backup == "ultimo":
+        snapshots = listar_snapshots(destino_dir)
+        if not snapshots:
+            raise FileNotFoundError("Não existem snapshots.")
+        return snapshots[-1]
+    if os.path.exists(backup):
+        return backup
+    _, pasta_manifestos = _pastas_snapshots(destino_dir)
+    for candidato in (backup, f"{backup}.json", f"snapshot_{backup}.json"):
+        caminho = os.path.join(pasta_manifestos, candidato)
+        if os.path.exists(caminho):
+            return caminho
+    raise FileNotFoundError(f"Backup não encontrado: {backup}")
+
+# Reconstrói um snapshot (ou descomprime um backup completo) para destino. Cada bloco é validado pelo seu
+# SHA-256 e a base de dados reconstruída passa por PRAGMA integrity_check antes de substituir destino.
+def restaurar_backup(backup, destino, destino_dir=None, forcar=False):
+    destino_dir = destino_dir or BACKUP_DIR
+    if os.path.exists(destino) and not forcar:
+        raise FileExistsError(f"{destino} já existe (usar --forcar para o substituir).")
+
+    inicio = time.perf_counter()
+    caminho = _resolver_backup(backup, destino_dir)
+    temporario = f"{destino}.restauro.tmp"
+    try:
+        if caminho.endswith(".json"):
+            manifesto = _ler_manifesto(caminho)
+            pasta_blocos, _ = _pastas_snapshots(destino_dir)
+            with open(temporario, "wb") as dst:
+                for digest in manifesto["chunks"]:
+                    with open(_caminho_bloco(pasta_blocos, digest, manifesto["compression"]), "rb") as f:
+                        bloco = descomprimir_bytes(f.read(), manifesto["compression"])
+                    if hashlib.sha256(bloco).hexdigest() != digest:
+                        raise RuntimeError(f"Bloco {digest} corrompido.")
+                    dst.write(bloco)
+        else:
+            with abrir_para_leitura(caminho) as src, open(temporario, "wb") as dst:
+                shutil.copyfileobj(src, dst, _BLOCO_COMPRESSAO)
+
+        integridade = verificar_integridade(temporario)
+        if integridade != "ok":
+            raise RuntimeError(f"Base de dados restaurada falhou a verificação de integridade: {integridade}")
+        # Em modo WAL, um -wal/-shm da base de dados substituída seria aplicado à restaurada ao abri-la
+        for sufixo in ("-wal", "-shm"):
+            if os.path.exists(destino + sufixo):
+                os.remove(destino + sufixo)
+        os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+    logger.info(f"[BACKUP] Backup {caminho} restaurado para {destino} em {time.perf_counter() - inicio:.1f} s.")
+    return destino
+
+# Retenção dos snapshots: apaga os manifestos com mais de dias dias (mantendo sempre o mais recente) e depois
+# os blocos que já não são referenciados por nenhum manifesto (mark-and-sweep). Devolve (manifestos, blocos) apagados.
+def limpar_snapshots_antigos(destino_dir=None, dias=None):
+    destino_dir = destino_dir or BACKUP_DIR
+    dias = BACKUP_RETENTION_DAYS if dias is None else dias
+    limite_data = datetime.now() - timedelta(days=dias)
+    pasta_blocos, _ = _pastas_snapshots(destino_dir)
+
+    snapshots = listar_snapshots(destino_dir)
+    manifestos_apagados = 0
+    for caminho in snapshots[:-1]:
+        if datetime.fromtimestamp(os.path.getmtime(caminho)) < limite_data:
+            os.remove(caminho)
+            manifestos_apagados += 1
+            logger.info(f"[BACKUP] Snapshot antigo removido: {os.path.basename(caminho)}")
+
+    referenciados = set()
+    for caminho in listar_snapshots(destino_dir):
+        referenciados.update(_ler_manifesto(caminho)["chunks"])
+
+    blocos_apagados = 0
+    limite_gc = time.time() - _GC_MARGEM_SEGUNDOS
+    if os.path.isdir(pasta_blocos):
+        for pasta in os.listdir(pasta_blocos):
+            for ficheiro in os.listdir(os.path.join(pasta_blocos, pasta)):
+                caminho = os.path.join(pasta_blocos, pasta, ficheiro)
+                referenciado = not ficheiro.endswith(".tmp") and ficheiro.split(".")[0] in referenciados
+                if referenciado or os.path.getmtime(caminho) > limite_gc:
+                    continue
+                os.remove(caminho)
+                blocos_apagados += 1
+
+    if manifestos_apagados or blocos_apagados:
+        logger.info(f"[BACKUP] GC dos snapshots: {manifestos_apagados} snapshots e {blocos_apagados} blocos removidos.")
+    return manifestos_apagados, blocos_apagados
+
+# Indica se um nome de ficheiro é um backup (backup_<timestamp>.db, comprimido ou não)
+def e_ficheiro_backup(ficheiro):
+    return ficheiro.startswith("backup_") and any(ficheiro.endswith(f".db{ext}") for ext in EXTENSOES.values())
+
+# Apaga os backups (e temporários deixados por backups interrompidos) com mais de dias dias. Devolve o número apagado.
+def limpar_backups_antigos(destino_dir=None, dias=None):
+    destino_dir = destino_dir or BACKUP_DIR
+    dias = BACKUP_RETENTION_DAYS if dias is None else dias
+    limite_data = datetime.now() - timedelta(days=dias)
+    apagados = 0
+
+    for ficheiro in os.listdir(destino_dir):
+        if e_ficheiro_backup(ficheiro) or (ficheiro.startswith("backup_") and ficheiro.endswith(".tmp")):
+            caminho = os.path.join(destino_dir, ficheiro)
+            mtime = datetime.fromtimestamp(os.path.getmtime(caminho))
+            if mtime < limite_data:
+                os.remove(caminho)
+                apagados += 1
+                logger.info(f"[BACKUP] Backup antigo removido: {ficheiro}")
+    return apagados
+
+# Linha de comandos para consultar e restaurar backups (ex.: dentro do contentor do scheduler):
+#   python -m db.backup listar
+#   python -m db.backup restaurar ultimo /app/db/uniAnalytics.db --forcar
+#   python -m db.backup gc
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backups da base de dados uniAnalytics.")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    subparsers.add_parser("listar", help="Lista os snapshots existentes.")
+    restaurar = subparsers.add_parser("restaurar", help="Restaura um snapshot ou backup completo.")
+    restaurar.add_argument("backup", help="'ultimo', nome do snapshot (ex.: 20250101_020000) ou caminho de um backup.")
+    restaurar.add_argument("destino", help="Ficheiro da base de dados a criar.")
+    restaurar.add_argument("--forcar", action="store_true", help="Substitui o destino se já existir (parar antes a aplicação).")
+    subparsers.add_parser("gc", help="Aplica a retenção e apaga os blocos sem referências.")
+    args = parser.parse_args()
+
+    if args.comando == "listar":
+        for caminho in listar_snapshots():
+            manifesto = _ler_manifesto(caminho)
+            print(f"{os.path.basename(caminho)[len('snapshot_'):-len('.json')]}  {manifesto['created_at']}  "
+                  f"{manifesto['size'] / 1048576:.1f} MB  {len(manifesto['chunks'])} blocos  {manifesto['compression']}")
+    elif args.comando == "restaurar":
+        restaurar_backup(args.backup, args.destino, forcar=args.forcar)
+    else:
+        limpar_snapshots_antigos()
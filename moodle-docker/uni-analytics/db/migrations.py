@@ -0,0 +1,325 @@
+import os
+import re
+import time
+from datetime import datetime
+from db.uniAnalytics import connect_to_uni_analytics_db, init_uni_analytics_db
+from utils.logger import logger
+from queries.syncLoader import nome_tabela_sombra, existe_tabela
+from queries.categorias import COLUNAS_CODIFICADAS
+
+# Configuração das migrações (variáveis de ambiente)
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "10000"))  # Linhas por lote nas migrações em lotes
+MIGRATION_BATCH_PAUSE = float(os.getenv("MIGRATION_BATCH_PAUSE", "0.05"))  # Pausa (s) entre lotes, para dar vez aos outros escritores
+MIGRATION_LOCK_TIMEOUT = int(os.getenv("MIGRATION_LOCK_TIMEOUT", "300"))  # Espera máxima (s) pelo lock de escrita
+
+# Migrações do esquema da base de dados local, aplicadas por ordem de versão e registadas em schema_version.
+# init_uni_analytics_db continua a criar o esquema base (CREATE TABLE IF NOT EXISTS); as alterações a uma base de
+# dados existente que não se fazem dessa forma (remover/alterar colunas, reescrever dados, novas tabelas derivadas)
+# são acrescentadas aqui como uma nova migração, com a versão seguinte. Uma migração aplicada nunca se altera.
+#
+# Cada migração é um dicionário com versao, nome e:
+#   aplicar(cursor): alteração aplicada numa única transação; ou
+#   lote(cursor, desde, tamanho): migração online em lotes (ex.: reescrever uma tabela grande por intervalos de
+#     rowid). Processa o lote seguinte a desde e devolve a nova posição, ou None quando terminar. Cada lote corre
+#     numa transação curta e a posição fica em sync_checkpoints, pelo que a aplicação e o sync continuam a
+#     funcionar entre lotes e uma migração interrompida é retomada onde parou.
+#     antes(cursor) e depois(cursor), opcionais, correm na transação do primeiro e do último lote
+#     (ex.: ADD COLUMN antes de preencher a coluna; CREATE INDEX no fim).
+# antes_do_esquema=True marca uma migração que tem de correr antes de init_uni_analytics_db, porque o esquema base
+# cria índices sobre o resultado dela (ex.: renomear uma coluna indexada). Só pode tocar em tabelas que já existam.
+MIGRACOES = []
+
+# Regista uma migração (as versões têm de ser crescentes)
+def registar_migracao(versao, nome, aplicar=None, lote=None, antes=None, depois=None, antes_do_esquema=False):
+    if MIGRACOES and versao <= MIGRACOES[-1]["versao"]:
+        raise ValueError(f"Versão de migração fora de ordem: {versao}")
+    MIGRACOES.append({"versao": versao, "nome": nome, "aplicar": aplicar, "lote": lote, "antes": antes, "depois": depois,
+                      "antes_do_esquema": antes_do_esquema})
+
+def _colunas(cursor, tabela):
+    cursor.execute(f"PRAGMA table_info({tabela})")
+    return [linha[1] for linha in cursor.fetchall()]
+
+################### Migrações ###################
+# 1: available_pre/available_pos deixaram de ser usadas (a disponibilidade dos formulários é calculada na leitura)
+def _remover_disponibilidade_efolios(cursor):
+    colunas = _colunas(cursor, "efolios")
+    for coluna in ("available_pre", "available_pos"):
+        if coluna in colunas:
+            cursor.execute(f"ALTER TABLE efolios DROP COLUMN {coluna}")
+
+registar_migracao(1, "remover_disponibilidade_efolios", aplicar=_remover_disponibilidade_efolios)
+
+# 2 a 10: colunas temporais das tabelas sincronizadas em epochs unix (inteiros), como já vinham do Moodle.
+# O texto "AAAA-MM-DD[ HH:MM:SS]" (hora local, escrito pelos syncs anteriores ou por FROM_UNIXTIME) passa a epoch;
+# os valores que já são inteiros ficam como estão. Migrações em lotes de rowid (course_access_logs e interacao podem
+# ter milhões de linhas); a tabela sombra de uma reconstrução interrompida é convertida no último lote.
+_COLUNAS_TEMPORAIS = [
+    ("forum", ["time_updated"]),
+    ("interacao", ["time_updated"]),
+    ("interacao_diaria", ["dia", "time_updated"]),
+    ("grade_progress", ["time_updated"]),
+    ("grade_progress_changes", ["changed_at"]),
+    ("efolios", ["start_date", "end_date", "time_created", "time_updated"]),
+    ("course_data", ["time_updated"]),
+    ("conteudos_disponibilizados", ["time_updated"]),
+    ("course_access_logs", ["access_time", "time_updated"]),
+]
+
+# Converte para epoch as colunas em texto das linhas com rowid em ]desde, ate] (ate None = todas).
+# O modificador 'utc' do SQLite interpreta o texto como hora local; um texto inválido fica como está.
+def _converter_para_epoch(cursor, tabela, colunas, desde=0, ate=None):
+    for coluna in colunas:
+        cursor.execute(f"""
+            UPDATE {tabela}
+            SET {coluna} = COALESCE(CAST(strftime('%s', {coluna}, 'utc') AS INTEGER), {coluna})
+            WHERE rowid > ? AND rowid <= ? AND typeof({coluna}) = 'text'
+        """, (desde, ate if ate is not None else 2 ** 63 - 1))
+
+# Remove o índice de uma tabela com exatamente estas colunas, se existir (procurado pelas colunas, como em garantir_indice)
+def _remover_indice(cursor, tabela, colunas):
+    cursor.execute(f"PRAGMA index_list({tabela})")
+    for indice in cursor.fetchall():
+        cursor.execute(f"PRAGMA index_info({indice[1]})")
+        if [linha[2] for linha in sorted(cursor.fetchall())] == list(colunas) and indice[3] == "c":
+            cursor.execute(f"DROP INDEX {indice[1]}")
+
+# Regista a migração em lotes que converte as colunas temporais de uma tabela
+def _registar_migracao_epoch(versao, tabela, colunas):
+    def lote(cursor, desde, tamanho):
+        cursor.execute(f"SELECT MAX(rowid) FROM (SELECT rowid FROM {tabela} WHERE rowid > ? ORDER BY rowid LIMIT ?)", (desde, tamanho))
+        (ate,) = cursor.fetchone()
+        if ate is None:
+            return None
+        _converter_para_epoch(cursor, tabela, colunas, desde, ate)
+        return ate
+
+    def depois(cursor):
+        if existe_tabela(cursor, nome_tabela_sombra(tabela)):
+            _converter_para_epoch(cursor, nome_tabela_sombra(tabela), colunas)
+        # O índice (course_id, user_id) dos acessos passou a incluir access_time (ver init_uni_analytics_db)
+        if tabela == "course_access_logs":
+            _remover_indice(cursor, tabela, ["course_id", "user_id"])
+
+    registar_migracao(versao, f"epoch_{tabela}", lote=lote, depois=depois)
+
+for _versao, _definicao in enumerate(_COLUNAS_TEMPORAIS, start=2):
+    _registar_migracao_epoch(_versao, *_definicao)
+
+# 11 a 17: role, module_type, tipo_interacao e group_name passam a códigos inteiros do dicionário categorias
+# (ver queries/categorias.py). Uma coluna declarada TEXT converteria os códigos de volta para texto, pelo que cada
+# tabela (e a sua tabela sombra, se existir) é reconstruída com as colunas em INTEGER, numa única transação: os syncs
+# trocam tabelas inteiras e não podem ver uma tabela meio convertida. O espaço libertado é reutilizado pelos syncs
+# seguintes (ou devolvido ao sistema com um VACUUM manual).
+
+# Tipos declarados das colunas de uma tabela
+def _tipos_colunas(cursor, tabela):
+    cursor.execute(f"PRAGMA table_info({tabela})")
+    return {linha[1]: linha[2].upper() for linha in cursor.fetchall()}
+
+# Reconstrói uma tabela com as colunas indicadas codificadas (texto -> código de categorias), mantendo a ordem das
+# linhas, o resto do esquema e os índices. As colunas que já são INTEGER ficam como estão.
+def _codificar_tabela(cursor, tabela, colunas):
+    tipos = _tipos_colunas(cursor, tabela)
+    colunas = [coluna for coluna in colunas if tipos.get(coluna) == "TEXT"]
+    if not colunas:
+        return
+
+    for coluna in colunas:
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO categorias (dominio, valor)
+            SELECT DISTINCT ?, {coluna} FROM {tabela} WHERE {coluna} IS NOT NULL
+        """, (coluna,))
+
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,))
+    (sql_tabela,) = cursor.fetchone()
+    cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (tabela,)
+    )
+    sql_indices = [linha[0] for linha in cursor.fetchall()]
+
+    nova = f"{tabela}__codificada"
+    sql_tabela = re.sub(
+        r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?("?)\w+\2', f"CREATE TABLE {nova}", sql_tabela, flags=re.IGNORECASE
+    )
+    for coluna in colunas:
+        sql_tabela = re.sub(rf"\b{coluna}\s+TEXT\b", f"{coluna} INTEGER", sql_tabela, flags=re.IGNORECASE)
+    cursor.execute(f"DROP TABLE IF EXISTS {nova}")
+    cursor.execute(sql_tabela)
+
+    todas = list(tipos)
+    valores = [
+        f"(SELECT id FROM categorias WHERE dominio = '{coluna}' AND valor = t.{coluna})" if coluna in colunas else f"t.{coluna}"
+        for coluna in todas
+    ]
+    cursor.execute(f"""
+        INSERT INTO {nova} ({', '.join(todas)})
+        SELECT {', '.join(valores)} FROM {tabela} t ORDER BY t.rowid
+    """)
+
+    cursor.execute(f"DROP TABLE {tabela}")
+    cursor.execute(f"ALTER TABLE {nova} RENAME TO {tabela}")
+    for sql_indice in sql_indices:
+        cursor.execute(sql_indice)
+
+# Regista a migração que codifica as colunas categóricas de uma tabela
+def _registar_migracao_categorias(versao, tabela, colunas):
+    def aplicar(cursor):
+        for destino in (tabela, nome_tabela_sombra(tabela)):
+            if existe_tabela(cursor, destino):
+                _codificar_tabela(cursor, destino, colunas)
+
+    registar_migracao(versao, f"categorias_{tabela}", aplicar=aplicar)
+
+for _versao, _definicao in enumerate(COLUNAS_CODIFICADAS.items(), start=11):
+    _registar_migracao_categorias(_versao, *_definicao)
+
+# 18: a coluna interacao.userid do esquema original passa a user_id (o nome usado por todas as leituras e escritas).
+# A tabela sombra de uma reconstrução interrompida copiou o esquema antigo, pelo que também é corrigida.
+# Corre antes do esquema base, que cria o índice idx_interacao_user_course sobre user_id.
+def _renomear_userid_interacao(cursor):
+    for tabela in ("interacao", nome_tabela_sombra("interacao")):
+        if existe_tabela(cursor, tabela) and "userid" in _colunas(cursor, tabela):
+            cursor.execute(f"ALTER TABLE {tabela} RENAME COLUMN userid TO user_id")
+
+registar_migracao(18, "renomear_userid_interacao", aplicar=_renomear_userid_interacao, antes_do_esquema=True)
+
+# 19: índice único em forum.post_id (o micro-lote acrescenta os posts novos com ON CONFLICT(post_id)).
+# As bases de dados anteriores a post_id ser a chave primária têm a coluna sem restrição: as linhas repetidas de
+# um post são removidas primeiro (fica a última gravada). Com post_id como chave primária não há nada a fazer.
+def _post_id_unico(cursor, tabela):
+    cursor.execute(f"PRAGMA table_info({tabela})")
+    if [linha[1] for linha in cursor.fetchall() if linha[5]] == ["post_id"]:
+        return True
+    cursor.execute(f"PRAGMA index_list({tabela})")
+    for indice in [linha for linha in cursor.fetchall() if linha[2]]:
+        cursor.execute(f"PRAGMA index_info({indice[1]})")
+        if [linha[2] for linha in cursor.fetchall()] == ["post_id"]:
+            return True
+    return False
+
+def _indice_unico_post_id_forum(cursor):
+    if not existe_tabela(cursor, "forum") or _post_id_unico(cursor, "forum"):
+        return
+    cursor.execute("""
+        DELETE FROM forum
+        WHERE post_id IS NOT NULL
+          AND rowid NOT IN (SELECT MAX(rowid) FROM forum WHERE post_id IS NOT NULL GROUP BY post_id)
+    """)
+    cursor.execute("CREATE UNIQUE INDEX idx_forum_post_id ON forum(post_id)")
+
+registar_migracao(19, "indice_unico_post_id_forum", aplicar=_indice_unico_post_id_forum)
+
+################### Execução ###################
+def _versao_aplicada(cursor, versao):
+    cursor.execute("SELECT 1 FROM schema_version WHERE version = ?", (versao,))
+    return cursor.fetchone() is not None
+
+def _registar_versao(cursor, migracao, inicio):
+    cursor.execute("""
+        INSERT INTO schema_version (version, name, applied_at, duration_seconds)
+        VALUES (?, ?, ?, ?)
+    """, (migracao["versao"], migracao["nome"], datetime.now().strftime('%Y-%m-%d %H:%M:%S'), time.perf_counter() - inicio))
+
+def _posicao(cursor, chave):
+    cursor.execute("SELECT last_id FROM sync_checkpoints WHERE table_name = ?", (chave,))
+    linha = cursor.fetchone()
+    return linha[0] if linha else None
+
+def _guardar_posicao(cursor, chave, posicao):
+    agora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    cursor.execute("""
+        INSERT INTO sync_checkpoints (table_name, last_id, started_at, time_updated)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(table_name) DO UPDATE SET last_id = excluded.last_id, time_updated = excluded.time_updated
+    """, (chave, posicao, agora, agora))
+
+# Aplica uma migração numa única transação. Devolve False se outra instância já a tiver aplicado.
+def _aplicar_transacao(cursor, migracao, inicio):
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        if _versao_aplicada(cursor, migracao["versao"]):
+            cursor.execute("ROLLBACK")
+            return False
+        migracao["aplicar"](cursor)
+        _registar_versao(cursor, migracao, inicio)
+        cursor.execute("COMMIT")
+        return True
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+# Aplica uma migração em lotes, um lote por transação. A aplicação e o scheduler podem correr a mesma migração
+# em simultâneo: como cada lote lê a posição dentro da sua transação, os lotes nunca se repetem.
+def _aplicar_em_lotes(cursor, migracao, inicio):
+    chave = f"migracao_{migracao['versao']}"
+    lotes = 0
+    while True:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if _versao_aplicada(cursor, migracao["versao"]):
+                cursor.execute("ROLLBACK")
+                return lotes > 0
+            desde = _posicao(cursor, chave)
+            if desde is None:
+                if migracao["antes"]:
+                    migracao["antes"](cursor)
+                desde = 0
+            proxima = migracao["lote"](cursor, desde, MIGRATION_BATCH_SIZE)
+            if proxima is None:
+                if migracao["depois"]:
+                    migracao["depois"](cursor)
+                _registar_versao(cursor, migracao, inicio)
+                cursor.execute("DELETE FROM sync_checkpoints WHERE table_name = ?", (chave,))
+                cursor.execute("COMMIT")
+                return True
+            _guardar_posicao(cursor, chave, proxima)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        lotes += 1
+        if lotes % 100 == 0:
+            logger.info(f"[MIGRACAO] v{migracao['versao']} {migracao['nome']}: {lotes} lotes aplicados (posição {proxima}).")
+        time.sleep(MIGRATION_BATCH_PAUSE)
+
+# Cria o esquema base e aplica as migrações pendentes, por ordem. Chamada no arranque da aplicação e do scheduler.
+# Aplica as migrações pendentes: primeiro as que têm de correr antes do esquema base, depois init_uni_analytics_db
+# e as restantes. Cada versão é verificada em schema_version (as anteriores ao esquema ficam com versões mais altas
+# registadas antes das restantes, pelo que não se usa a versão máxima como marca).
+def aplicar_migracoes():
+    conn = connect_to_uni_analytics_db()
+    conn.isolation_level = None  # Transações explícitas (BEGIN IMMEDIATE / COMMIT)
+    conn.execute(f"PRAGMA busy_timeout = {MIGRATION_LOCK_TIMEOUT * 1000}")
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at DATETIME NOT NULL,
+            duration_seconds REAL
+        );
+    """)
+
+    try:
+        _aplicar_pendentes(cursor, [m for m in MIGRACOES if m["antes_do_esquema"]])
+        init_uni_analytics_db()
+        _aplicar_pendentes(cursor, [m for m in MIGRACOES if not m["antes_do_esquema"]])
+    finally:
+        conn.close()
+
+def _aplicar_pendentes(cursor, migracoes):
+    try:
+        for migracao in migracoes:
+            if _versao_aplicada(cursor, migracao["versao"]):
+                continue
+            logger.info(f"[MIGRACAO] A aplicar v{migracao['versao']} {migracao['nome']}...")
+            inicio = time.perf_counter()
+            aplicada = (_aplicar_em_lotes if migracao["lote"] else _aplicar_transacao)(cursor, migracao, inicio)
+            if aplicada:
+                logger.info(f"[MIGRACAO] v{migracao['versao']} {migracao['nome']} aplicada em {time.perf_counter() - inicio:.1f} s.")
+            else:
+                logger.info(f"[MIGRACAO] v{migracao['versao']} {migracao['nome']} já aplicada por outra instância.")
+    except Exception:
+        logger.exception(f"[MIGRACAO] Erro ao aplicar a migração v{migracao['versao']} {migracao['nome']}.")
+        raise
@@ -1,22 +1,369 @@
 import os
+import re
 import time
-import mysql.connector
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from mysql.connector import Error
+from mysql.connector.pooling import MySQLConnectionPool
+from mysql.connector.errors import PoolError
+from utils.logger import logger
 
-def connect_to_moodle_db(retries=10, delay=3):
-    for attempt in range(retries):
-        try:
-            conn = mysql.connector.connect(
-                host=os.getenv("DB_HOST", "localhost"),
+# Configuração do pool de ligações ao Moodle (variáveis de ambiente)
+MOODLE_POOL_SIZE = int(os.getenv("MOODLE_POOL_SIZE", "8"))  # Ligações mantidas abertas (máximo 32)
+MOODLE_POOL_TIMEOUT = float(os.getenv("MOODLE_POOL_TIMEOUT", "30"))  # Segundos à espera de uma ligação livre
+MOODLE_CONNECT_TIMEOUT = int(os.getenv("MOODLE_CONNECT_TIMEOUT", "5"))  # Timeout de cada tentativa de ligação
+MOODLE_RETRIES = int(os.getenv("MOODLE_RETRIES", "5"))  # Tentativas até desistir
+MOODLE_BACKOFF_BASE = float(os.getenv("MOODLE_BACKOFF_BASE", "0.5"))  # Espera inicial entre tentativas (duplica a cada falha)
+MOODLE_BACKOFF_MAX = float(os.getenv("MOODLE_BACKOFF_MAX", "15"))  # Espera máxima entre tentativas
+MOODLE_CIRCUIT_THRESHOLD = int(os.getenv("MOODLE_CIRCUIT_THRESHOLD", "5"))  # Falhas seguidas que abrem o circuito
+MOODLE_CIRCUIT_COOLDOWN = float(os.getenv("MOODLE_CIRCUIT_COOLDOWN", "60"))  # Segundos em que o circuito fica aberto
+
+# Réplica de leitura do Moodle (opcional): se definida, as extrações do sync leem da réplica e não do primário
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST", "")
+
+# Proteção da carga no Moodle durante as extrações do sync (0 desativa cada mecanismo)
+MOODLE_THROTTLE_ROWS_PER_SEC = float(os.getenv("MOODLE_THROTTLE_ROWS_PER_SEC", "0"))  # Teto de linhas lidas por segundo
+MOODLE_MAX_EXECUTION_MS = int(os.getenv("MOODLE_MAX_EXECUTION_MS", "0"))  # Tempo máximo de cada query (hint MAX_EXECUTION_TIME)
+MOODLE_LATENCY_THRESHOLD_MS = int(os.getenv("MOODLE_LATENCY_THRESHOLD_MS", "0"))  # Latência a partir da qual o sync abranda
+MOODLE_LATENCY_BACKOFF_MAX = float(os.getenv("MOODLE_LATENCY_BACKOFF_MAX", "60"))  # Pausa máxima por latência elevada
+
+# Erro lançado quando o Moodle não está acessível (ou o circuito está aberto)
+class MoodleIndisponivel(Exception):
+    pass
+
+# Pools de ligações por nome: "moodle" (primário) e "moodle_replica" (réplica de leitura)
+_pools = {}
+_lock = threading.Lock()
+
+# Estado do circuit breaker de cada pool: após MOODLE_CIRCUIT_THRESHOLD falhas seguidas, os pedidos falham logo
+# durante MOODLE_CIRCUIT_COOLDOWN segundos em vez de ficarem bloqueados à espera do Moodle.
+# Passado esse tempo, uma única falha volta a abrir o circuito (meio-aberto) até haver uma ligação com sucesso.
+_circuitos = {
+    "moodle": {"falhas_seguidas": 0, "aberto_ate": 0.0},
+    "moodle_replica": {"falhas_seguidas": 0, "aberto_ate": 0.0},
+}
+
+# Métricas do pool (consultáveis com obter_metricas_pool)
+_metricas = {
+    "checkouts": 0,
+    "falhas": 0,
+    "circuito_aberto": 0,
+    "rejeitados_circuito": 0,
+    "em_uso": 0,
+    "max_em_uso": 0,
+    "espera_total_s": 0.0,
+    "espera_ritmo_s": 0.0,
+    "pausas_latencia": 0,
+}
+
+# Nome do pool a usar: as extrações do sync usam a réplica quando DB_REPLICA_HOST está definido
+def _nome_pool(extracao):
+    return "moodle_replica" if extracao and DB_REPLICA_HOST else "moodle"
+
+# Cria o pool na primeira utilização (a criação abre logo MOODLE_POOL_SIZE ligações)
+def _obter_pool(nome="moodle"):
+    with _lock:
+        if nome not in _pools:
+            _pools[nome] = MySQLConnectionPool(
+                pool_name=nome,
+                pool_size=min(MOODLE_POOL_SIZE, 32),
+                pool_reset_session=True,
+                host=DB_REPLICA_HOST if nome == "moodle_replica" else os.getenv("DB_HOST", "localhost"),
                 # host=os.getenv("DB_HOST", "db"), # Default to 'db' for Docker setup
                 user=os.getenv("DB_USER", "moodle"),
                 password=os.getenv("DB_PASS", "moodle"),
-                database=os.getenv("DB_NAME", "moodle")
+                database=os.getenv("DB_NAME", "moodle"),
+                connection_timeout=MOODLE_CONNECT_TIMEOUT
             )
-            if conn.is_connected():
-                print("Uni Analytics ligado à base de dados Moodle.")
-                return conn
+            destino = "réplica de leitura" if nome == "moodle_replica" else "base de dados"
+            logger.info(f"[MOODLE] Uni Analytics ligado à {destino} Moodle (pool de ligações criado).")
+        return _pools[nome]
+
+def _registar_sucesso(nome="moodle"):
+    with _lock:
+        _circuitos[nome]["falhas_seguidas"] = 0
+        _circuitos[nome]["aberto_ate"] = 0.0
+
+def _registar_falha(nome="moodle"):
+    circuito = _circuitos[nome]
+    with _lock:
+        _metricas["falhas"] += 1
+        circuito["falhas_seguidas"] += 1
+        meio_aberto = circuito["aberto_ate"] > 0
+        if meio_aberto or circuito["falhas_seguidas"] >= MOODLE_CIRCUIT_THRESHOLD:
+            circuito["aberto_ate"] = time.monotonic() + MOODLE_CIRCUIT_COOLDOWN
+            circuito["falhas_seguidas"] = 0
+            _metricas["circuito_aberto"] += 1
+            logger.warning(f"[MOODLE] Circuito do Moodle ({nome}) aberto durante {MOODLE_CIRCUIT_COOLDOWN:.0f} s após falhas consecutivas.")
+
+# Espera por uma ligação livre do pool (o pool do mysql.connector falha logo se estiver esgotado).
+# O get_connection do pool já faz a verificação de saúde: testa a ligação (ping) e religa-a se o servidor a fechou.
+def _checkout(pool):
+    limite = time.monotonic() + MOODLE_POOL_TIMEOUT
+    while True:
+        try:
+            return pool.get_connection()
+        except PoolError as e:
+            if "exhausted" not in str(e):
+                raise
+            if time.monotonic() >= limite:
+                raise MoodleIndisponivel(f"Nenhuma ligação ao Moodle livre após {MOODLE_POOL_TIMEOUT:.0f} s (pool esgotado).")
+            time.sleep(0.05)
+
+# Obtém uma ligação saudável do pool, com backoff exponencial entre tentativas e circuit breaker
+def _obter_ligacao(retries=None, nome="moodle"):
+    retries = retries if retries is not None else MOODLE_RETRIES
+    circuito = _circuitos[nome]
+
+    if time.monotonic() < circuito["aberto_ate"]:
+        with _lock:
+            _metricas["rejeitados_circuito"] += 1
+        raise MoodleIndisponivel("Moodle indisponível (circuito aberto após falhas consecutivas).")
+
+    inicio = time.monotonic()
+    for attempt in range(retries):
+        try:
+            conn = _checkout(_obter_pool(nome))
+            _registar_sucesso(nome)
+            with _lock:
+                _metricas["checkouts"] += 1
+                _metricas["em_uso"] += 1
+                _metricas["max_em_uso"] = max(_metricas["max_em_uso"], _metricas["em_uso"])
+                _metricas["espera_total_s"] += time.monotonic() - inicio
+            return conn
         except Error as e:
-            print(f"Tentativa {attempt+1} falhou: {e}")
-            time.sleep(delay)
-    raise Exception("Não foi possível ligar à base de dados após várias tentativas.")
+            _registar_falha(nome)
+            logger.warning(f"[MOODLE] Tentativa {attempt+1} falhou: {e}")
+            if time.monotonic() < circuito["aberto_ate"] or attempt == retries - 1:
+                break
+            espera = min(MOODLE_BACKOFF_BASE * (2 ** attempt), MOODLE_BACKOFF_MAX)
+            time.sleep(espera + random.uniform(0, espera / 2))
+    raise MoodleIndisponivel("Não foi possível ligar à base de dados após várias tentativas.")
+
+# Devolve uma ligação ao pool (mesmo que a limpeza da sessão falhe, a ligação volta ao pool e é religada no próximo uso)
+def _devolver_ligacao(conn):
+    with _lock:
+        _metricas["em_uso"] -= 1
+    try:
+        conn.close()
+    except Error:
+        pass
+
+# Context manager que empresta uma ligação do pool e a devolve no fim:
+#   with moodle_connection() as conn:
+#       ...
+# Com extracao=True (extrações do sync) a ligação vem da réplica de leitura, se DB_REPLICA_HOST estiver definido.
+@contextmanager
+def moodle_connection(retries=None, extracao=False):
+    conn = _obter_ligacao(retries, _nome_pool(extracao))
+    try:
+        yield conn
+    finally:
+        _devolver_ligacao(conn)
+
+# Devolve uma cópia das métricas do pool e do estado dos circuitos
+def obter_metricas_pool():
+    with _lock:
+        metricas = dict(_metricas)
+        metricas["tamanho_pool"] = min(MOODLE_POOL_SIZE, 32)
+        metricas["replica"] = bool(DB_REPLICA_HOST)
+        metricas["circuito_aberto_agora"] = any(time.monotonic() < c["aberto_ate"] for c in _circuitos.values())
+    return metricas
+
+
+################### Proteção da carga no Moodle ###################
+# As extrações do sync passam por executar_extracao e limitar_ritmo, para não saturar o Moodle em horas de aulas.
+
+# Estado partilhado pelas threads de extração: fim da "janela" de leitura já reservada (teto de linhas/s)
+# e pausa em curso por latência elevada (que duplica enquanto a latência se mantiver acima do limite)
+_carga = {"livre_em": 0.0, "pausa_ate": 0.0, "pausa_s": 0.0}
+
+# Literais de texto, parênteses e a palavra SELECT de uma query (para encontrar o SELECT principal)
+_TOKENS_QUERY = re.compile(r"'(?:[^'\\]|\\.)*'|\(|\)|\bSELECT\b", re.IGNORECASE)
+
+# Acrescenta à query o hint MAX_EXECUTION_TIME (o MySQL interrompe a query se passar esse tempo).
+# O hint vai no primeiro SELECT fora de parênteses, que é o SELECT principal também nas queries com WITH (CTE).
+# max_execucao_ms substitui MOODLE_MAX_EXECUTION_MS numa query com um limite próprio.
+def limitar_tempo_query(query, max_execucao_ms=None):
+    if max_execucao_ms is None:
+        max_execucao_ms = MOODLE_MAX_EXECUTION_MS
+    if max_execucao_ms <= 0:
+        return query
+    profundidade = 0
+    for token in _TOKENS_QUERY.finditer(query):
+        texto = token.group()
+        if texto == "(":
+            profundidade += 1
+        elif texto == ")":
+            profundidade -= 1
+        elif texto.upper() == "SELECT" and profundidade == 0:
+            hint = f" /*+ MAX_EXECUTION_TIME({max_execucao_ms}) */"
+            return query[:token.end()] + hint + query[token.end():]
+    logger.warning("[MOODLE] Query sem SELECT principal: extração sem limite de tempo (MAX_EXECUTION_TIME).")
+    return query
+
+# Regista a latência de uma query: acima de MOODLE_LATENCY_THRESHOLD_MS as extrações seguintes fazem uma pausa
+# (1 s, depois 2 s, 4 s, ... até MOODLE_LATENCY_BACKOFF_MAX); abaixo do limite a pausa volta a zero
+def _registar_latencia(segundos):
+    if MOODLE_LATENCY_THRESHOLD_MS <= 0:
+        return
+    with _lock:
+        if segundos * 1000 <= MOODLE_LATENCY_THRESHOLD_MS:
+            _carga["pausa_s"] = 0.0
+            return
+        _carga["pausa_s"] = min(max(_carga["pausa_s"] * 2, 1.0), MOODLE_LATENCY_BACKOFF_MAX)
+        _carga["pausa_ate"] = time.monotonic() + _carga["pausa_s"]
+        _metricas["pausas_latencia"] += 1
+        pausa = _carga["pausa_s"]
+    logger.warning(f"[MOODLE] Latência do Moodle elevada ({segundos * 1000:.0f} ms): extrações em pausa durante {pausa:.0f} s.")
+
+# Espera enquanto houver uma pausa por latência elevada em curso
+def _aguardar_pausa():
+    espera = _carga["pausa_ate"] - time.monotonic()
+    if espera > 0:
+        time.sleep(espera)
+
+# Executa uma query de extração: espera pelo fim de uma pausa por latência, acrescenta o hint de tempo máximo
+# e mede a latência da execução
+def executar_extracao(cursor, query, params=None, max_execucao_ms=None):
+    _aguardar_pausa()
+    inicio = time.monotonic()
+    cursor.execute(limitar_tempo_query(query, max_execucao_ms), params)
+    _registar_latencia(time.monotonic() - inicio)
+
+# Limita o ritmo de leitura ao teto MOODLE_THROTTLE_ROWS_PER_SEC (partilhado por todas as threads de extração):
+# cada bloco de linhas lido reserva linhas / teto segundos e quem lê espera pelo fim da sua reserva
+def limitar_ritmo(linhas):
+    if MOODLE_THROTTLE_ROWS_PER_SEC <= 0 or not linhas:
+        return
+    with _lock:
+        agora = time.monotonic()
+        _carga["livre_em"] = max(_carga["livre_em"], agora) + linhas / MOODLE_THROTTLE_ROWS_PER_SEC
+        espera = _carga["livre_em"] - agora
+        _metricas["espera_ritmo_s"] += espera
+    time.sleep(espera)
+
+
+# Número de linhas lidas de cada vez nos cursores não bufferizados (configurável por variável de ambiente)
+MOODLE_FETCH_SIZE = int(os.getenv("MOODLE_FETCH_SIZE", "5000"))
+
+# Gerador que executa uma query no Moodle e devolve as linhas (dicionários) à medida que são lidas.
+# Usa um cursor não bufferizado e fetchmany, pelo que a memória usada não depende do tamanho do resultado.
+# Os erros são propagados a quem consome o gerador, para que uma extração incompleta nunca pareça completa.
+def stream_moodle_query(query, params=None, fetch_size=None):
+    fetch_size = fetch_size or MOODLE_FETCH_SIZE
+    with moodle_connection(extracao=True) as conn:
+        lido_ate_ao_fim = False
+        try:
+            cursor = conn.cursor(dictionary=True, buffered=False)
+            executar_extracao(cursor, query, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                limitar_ritmo(len(rows))
+                yield from rows
+            cursor.close()
+            lido_ate_ao_fim = True
+        finally:
+            # Se a leitura foi interrompida a meio ainda há resultados por ler: a ligação é desligada
+            # (o pool volta a ligá-la no próximo checkout) em vez de ler o resto do resultado
+            if not lido_ate_ao_fim:
+                try:
+                    conn.disconnect()
+                except Error:
+                    pass
+
+
+# Extração do log do Moodle (mdl_logstore_standard_log) por intervalos de ids com paginação por keyset
+MOODLE_PAGE_SIZE = int(os.getenv("MOODLE_PAGE_SIZE", "10000"))  # Linhas por página (LIMIT de cada query)
+MOODLE_LOG_RANGE_SIZE = int(os.getenv("MOODLE_LOG_RANGE_SIZE", "1000000"))  # Ids do log por intervalo
+MOODLE_LOG_WORKERS = int(os.getenv("MOODLE_LOG_WORKERS", "1"))  # Intervalos lidos em simultâneo (ligações do pool)
+
+# Executa uma query curta de extração no Moodle e devolve todas as linhas (dicionários)
+def _consultar(query, params):
+    with moodle_connection(extracao=True) as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            executar_extracao(cursor, query, params)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    limitar_ritmo(len(rows))
+    return rows
+
+# Devolve o maior id atual do log do Moodle (0 se estiver vazio)
+def obter_max_id_log():
+    return _consultar("SELECT COALESCE(MAX(id), 0) AS max_id FROM mdl_logstore_standard_log", ())[0]["max_id"]
+
+# Gerador das páginas de um intervalo de ids (inicio, fim]. A query recebe, depois de params, o id a partir do
+# qual se lê, o fim do intervalo e o LIMIT (ex.: "AND l.id > %s AND l.id <= %s ORDER BY l.id LIMIT %s").
+# Cada página continua a partir do último id da anterior (chave). Com pagina=None o intervalo é lido numa só query
+# (sem LIMIT, para queries agregadas com GROUP BY).
+def _paginas_intervalo(query, params, inicio, fim, chave, pagina):
+    if pagina is None:
+        yield _consultar(query, (*params, inicio, fim))
+        return
+    while True:
+        rows = _consultar(query, (*params, inicio, fim, pagina))
+        if rows:
+            yield rows
+        if len(rows) < pagina:
+            return
+        inicio = rows[-1][chave]
+
+# Lê um intervalo completo (usado pelas threads de extração)
+def _ler_intervalo(query, params, inicio, fim, chave, pagina):
+    return [row for rows in _paginas_intervalo(query, params, inicio, fim, chave, pagina) for row in rows]
+
+# Gerador que extrai do log do Moodle os registos com id em (desde_id, max id atual], em vez de uma única query longa.
+# O espaço de ids é dividido em intervalos de MOODLE_LOG_RANGE_SIZE e cada intervalo é lido com paginação por keyset
+# (MOODLE_PAGE_SIZE linhas por query), pelo que cada query é curta e usa a chave primária do log.
+# Com workers > 1 vários intervalos são lidos em simultâneo, cada um na sua ligação do pool, com uma janela
+# deslizante de intervalos em curso; as linhas são sempre devolvidas pela ordem dos ids (necessário aos checkpoints).
+# O fim é fixado no arranque: os registos escritos durante a extração ficam para o sync seguinte.
+def stream_moodle_log(query, params=(), desde_id=0, chave="log_id", pagina=None, paginar=True, workers=None):
+    pagina = (pagina or MOODLE_PAGE_SIZE) if paginar else None
+    workers = workers or MOODLE_LOG_WORKERS
+    max_id = obter_max_id_log()
+    intervalos = [
+        (inicio, min(inicio + MOODLE_LOG_RANGE_SIZE, max_id))
+        for inicio in range(desde_id, max_id, MOODLE_LOG_RANGE_SIZE)
+    ]
+
+    if workers <= 1:
+        for inicio, fim in intervalos:
+            for rows in _paginas_intervalo(query, params, inicio, fim, chave, pagina):
+                yield from rows
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pendentes = deque()
+        por_submeter = iter(intervalos)
+        try:
+            for inicio, fim in por_submeter:
+                pendentes.append(executor.submit(_ler_intervalo, query, params, inicio, fim, chave, pagina))
+                if len(pendentes) >= workers * 2:
+                    break
+            while pendentes:
+                rows = pendentes.popleft().result()
+                proximo = next(por_submeter, None)
+                if proximo:
+                    pendentes.append(executor.submit(_ler_intervalo, query, params, *proximo, chave, pagina))
+                yield from rows
+        finally:
+            # Se a extração falhar ou for interrompida, os intervalos ainda não iniciados são cancelados
+            for futuro in pendentes:
+                futuro.cancel()
+
+# Constrói o filtro "AND <coluna> IN (...)" para limitar uma query do Moodle a um conjunto de cursos.
+# course_ids=None não filtra; uma lista vazia não devolve nenhuma linha. Devolve (sql, parâmetros).
+def filtro_cursos(coluna, course_ids):
+    if course_ids is None:
+        return "", ()
+    if not course_ids:
+        return "AND 1 = 0", ()
+    return f"AND {coluna} IN ({', '.join(['%s'] * len(course_ids))})", tuple(course_ids)
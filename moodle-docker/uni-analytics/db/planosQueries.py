@@ -0,0 +1,186 @@
+import os
+import re
+import ast
+import sys
+import glob
+import sqlite3
+import tempfile
+import importlib
+import db.uniAnalytics as uniAnalytics
+from db.migrations import aplicar_migracoes
+
+# Verificação dos planos de execução das queries à base de dados local.
+# Extrai do código (queries/*.py, forms/*.py e main.py) o SQL passado a execute()/executemany()/read_sql(),
+# corre EXPLAIN QUERY PLAN de cada query sobre o esquema criado por aplicar_migracoes (numa base de dados
+# temporária) e falha se alguma fizer um SCAN completo de uma tabela que não esteja em PERMITIDAS.
+# Correr depois de alterar queries ou índices:
+#   python -m db.planosQueries
+
+FICHEIROS = ["queries/*.py", "forms/*.py", "main.py"]
+
+# Funções de execução de SQL cujo primeiro argumento é a query
+_FUNCOES_SQL = {"execute", "executemany", "read_sql", "read_sql_query"}
+
+# Só se verificam queries de leitura ou alteração de linhas (as restantes não têm plano relevante)
+_INICIO_VERIFICAVEL = re.compile(r"^\s*(SELECT|WITH|UPDATE|DELETE)\b", re.IGNORECASE)
+
+# Valores das expressões das f-strings que não são constantes do módulo, por (ficheiro, função).
+# Cada dicionário gera uma variante da query (ex.: tabela lida consoante o modo de sincronização).
+# Nas funções com filtro_local verifica-se a leitura filtrada (sem filtros, a leitura é da tabela inteira por definição).
+SUBSTITUICOES = {
+    ("queries/queriesAluno.py", "fetch_interacoes_aluno_local"): [
+        {"tabela": "interacao", "total": "COUNT(*)"},
+        {"tabela": "interacao_diaria", "total": "SUM(total)"},
+    ],
+    ("queries/queriesComuns.py", "fetch_all_forum_posts_local"): [{"filtro": "WHERE course_id = ?"}],
+    ("queries/queriesComuns.py", "fetch_all_grade_progress_local"): [{"filtro": "WHERE course_id = ?"}],
+    ("queries/queriesProfessor.py", "fetch_conteudos_disponibilizados_local"): [{"filtro": "WHERE course_id = ?"}],
+    ("queries/queriesProfessor.py", "fetch_course_access_logs_local"): [{"filtro": "WHERE course_id = ?"}],
+}
+
+# SCAN completos aceites, por (ficheiro, função, tabela), com o motivo.
+# São leituras da tabela inteira por natureza (cargas completas, sincronização, listas sem filtro).
+PERMITIDAS = {
+    ("queries/formsComuns.py", "fetch_all_efolios_local", "efolios"): "lista de todos os e-fólios (dropdowns pré/pós)",
+    ("queries/queriesAluno.py", "fetch_interacao_tipos_local", "interacao_tipos"): "tabela de mapeamento pequena",
+    ("queries/queriesAluno.py", "fetch_all_interacoes_local", "interacao"): "carga completa das interações",
+    ("queries/queriesComuns.py", "fetch_all_user_course_data_local", "course_data"): "carga completa (dashboards filtram em pandas)",
+    ("queries/syncData.py", "grade_progress_requer_reconstrucao", "grade_progress"): "verificação de row_hash, uma vez por sync",
+    ("queries/syncData.py", "sync_course_access_logs", "course_data"): "mapa completo de utilizadores/cursos para o sync",
+    ("queries/syncTelemetry.py", "fetch_sync_runs_local", "sync_runs"): "percorre o rowid por ordem decrescente com LIMIT",
+    ("forms/formulariosAdmin.py", "listar_perguntas_html", "forms_questions"): "lista de todas as perguntas (sem filtro de tipo)",
+}
+
+# Devolve as queries SQL de um ficheiro: lista de (função, linha, sql). O SQL das f-strings é reconstruído com
+# SUBSTITUICOES e com as constantes de texto do módulo (ex.: SQL_DISPONIVEL_PRE); as restantes expressões passam
+# a "?" (ex.: {placeholders} em IN (...)). Se o resultado não for SQL válido, a query é reportada como dinâmica.
+def extrair_queries(caminho, modulo=None, relativo=None):
+    with open(caminho, encoding="utf-8") as f:
+        arvore = ast.parse(f.read(), filename=caminho)
+
+    queries = []
+
+    # variaveis: último texto atribuído a cada variável da função (ex.: query = """...""" seguido de execute(query))
+    def visitar(no, funcao, variaveis):
+        for filho in ast.iter_child_nodes(no):
+            if isinstance(filho, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                visitar(filho, filho.name, {})
+                continue
+            if isinstance(filho, ast.Assign) and len(filho.targets) == 1 and isinstance(filho.targets[0], ast.Name):
+                variaveis[filho.targets[0].id] = filho.value
+            if isinstance(filho, ast.Call) and filho.args:
+                nome = filho.func.attr if isinstance(filho.func, ast.Attribute) else getattr(filho.func, "id", None)
+                if nome in _FUNCOES_SQL:
+                    argumento = filho.args[0]
+                    if isinstance(argumento, ast.Name):
+                        argumento = variaveis.get(argumento.id, argumento)
+                    for valores in SUBSTITUICOES.get((relativo, funcao), [{}]):
+                        sql = _texto_sql(argumento, modulo, valores)
+                        if sql is not None and _INICIO_VERIFICAVEL.match(sql):
+                            queries.append((funcao, filho.lineno, sql))
+            visitar(filho, funcao, variaveis)
+
+    visitar(arvore, "<módulo>", {})
+    return queries
+
+def _texto_sql(no, modulo, valores):
+    if isinstance(no, ast.Constant) and isinstance(no.value, str):
+        return no.value
+    if isinstance(no, ast.JoinedStr):
+        partes = []
+        for valor in no.values:
+            nome = valor.value.id if isinstance(valor, ast.FormattedValue) and isinstance(valor.value, ast.Name) else None
+            if isinstance(valor, ast.Constant):
+                partes.append(valor.value)
+            elif nome in valores:
+                partes.append(valores[nome])
+            elif isinstance(getattr(modulo, nome or "", None), str):
+                partes.append(getattr(modulo, nome))
+            else:
+                partes.append("?")
+        return "".join(partes)
+    return None
+
+# Corre EXPLAIN QUERY PLAN com parâmetros nulos (o número de parâmetros é obtido do erro do sqlite3)
+def plano(cursor, sql):
+    parametros = ()
+    while True:
+        try:
+            return cursor.execute(f"EXPLAIN QUERY PLAN {sql}", parametros).fetchall()
+        except sqlite3.ProgrammingError as e:
+            encontrado = re.search(r"uses (\d+)", str(e))
+            if not encontrado or parametros:
+                raise
+            parametros = (None,) * int(encontrado.group(1))
+
+_PALAVRAS_RESERVADAS = {"WHERE", "JOIN", "LEFT", "INNER", "CROSS", "ON", "USING", "GROUP", "ORDER", "LIMIT", "SET", "UNION"}
+
+# Aliases das tabelas usados numa query (o plano identifica as tabelas pelo alias: "SCAN a")
+def aliases(sql):
+    mapa = {}
+    for tabela, alias in re.findall(r"\b(?:FROM|JOIN|UPDATE)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.IGNORECASE):
+        if alias and alias.upper() not in _PALAVRAS_RESERVADAS:
+            mapa[alias] = tabela
+    return mapa
+
+# Tabelas percorridas por inteiro num plano (SCAN sem índice de tabelas reais; exclui subqueries e CTEs)
+def tabelas_percorridas(linhas_plano, sql, tabelas):
+    mapa = aliases(sql)
+    percorridas = []
+    for linha in linhas_plano:
+        encontrado = re.match(r"SCAN (?:TABLE )?(\w+)(?: AS (\w+))?$", linha[-1])
+        if not encontrado:
+            continue
+        tabela = mapa.get(encontrado.group(1), encontrado.group(1))
+        if tabela in tabelas:
+            percorridas.append(tabela)
+    return percorridas
+
+# Verifica todas as queries e devolve (falhas, dinâmicas, total verificado)
+def verificar(base=None):
+    base = base or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if base not in sys.path:
+        sys.path.insert(0, base)
+
+    db_path_original = uniAnalytics.DB_PATH
+    with tempfile.TemporaryDirectory() as pasta:
+        uniAnalytics.DB_PATH = os.path.join(pasta, "planos.db")
+        try:
+            aplicar_migracoes()
+        finally:
+            uniAnalytics.DB_PATH = db_path_original
+        conn = sqlite3.connect(os.path.join(pasta, "planos.db"))
+        cursor = conn.cursor()
+        tabelas = {nome for (nome,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+        falhas, dinamicas, total = [], [], 0
+        for padrao in FICHEIROS:
+            for caminho in sorted(glob.glob(os.path.join(base, padrao))):
+                relativo = os.path.relpath(caminho, base).replace(os.sep, "/")
+                nome_modulo = relativo[:-3].replace("/", ".")
+                modulo = importlib.import_module(nome_modulo) if nome_modulo != "main" else None
+
+                for funcao, linha, sql in extrair_queries(caminho, modulo, relativo):
+                    # Queries ao Moodle (MySQL) não se verificam aqui
+                    if "mdl_" in sql:
+                        continue
+                    try:
+                        linhas_plano = plano(cursor, sql)
+                    except sqlite3.Error as e:
+                        dinamicas.append((relativo, funcao, linha, str(e)))
+                        continue
+                    total += 1
+                    for tabela in tabelas_percorridas(linhas_plano, sql, tabelas):
+                        if (relativo, funcao, tabela) not in PERMITIDAS:
+                            falhas.append((relativo, funcao, linha, tabela))
+        conn.close()
+    return falhas, dinamicas, total
+
+if __name__ == "__main__":
+    falhas, dinamicas, total = verificar()
+    for relativo, funcao, linha, erro in dinamicas:
+        print(f"AVISO  {relativo}:{linha} ({funcao}): query dinâmica não verificada ({erro})")
+    for relativo, funcao, linha, tabela in falhas:
+        print(f"FALHA  {relativo}:{linha} ({funcao}): SCAN completo de {tabela}")
+    print(f"{total} queries verificadas, {len(falhas)} com SCAN completo, {len(dinamicas)} dinâmicas.")
+    sys.exit(1 if falhas else 0)
@@ -1,12 +1,108 @@
 import sqlite3
+import threading
 import os
+import numpy as np
 
 # Caminho da base de dados local
 DB_PATH = os.path.join(os.path.dirname(__file__), "uniAnalytics.db")
 
-# Função que estabelece ligação à base de dados
+# Configuração das ligações à base de dados local (variáveis de ambiente)
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")  # WAL: os leitores não bloqueiam o escritor (nem o contrário)
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL é seguro em WAL (só o último commit pode perder-se num crash do SO)
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))  # Cache de páginas por ligação
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # Bytes da base de dados lidos por memory-mapping (0 = desativado)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))  # Espera por um lock antes de "database is locked"
+SQLITE_REUSE_CONNECTIONS = os.getenv("SQLITE_REUSE_CONNECTIONS", "1") == "1"  # Reutilizar uma ligação por thread
+
+# Ligação que pode ser reutilizada pela mesma thread: close() não fecha a ligação, apenas desfaz uma transação
+# que tenha ficado aberta, repõe as opções alteradas pelo chamador e devolve-a à thread, pronta para o próximo pedido.
+class LigacaoReutilizavel(sqlite3.Connection):
+    reutilizavel = False
+    chave = None
+
+    def close(self):
+        if not self.reutilizavel:
+            return super().close()
+        ligacoes = _ligacoes_da_thread()
+        if ligacoes.get(self.chave) is self:
+            return  # Já devolvida (close() repetido)
+        if self.in_transaction:
+            self.rollback()
+        self.isolation_level = ""
+        self.row_factory = None
+        self.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        if self.chave in ligacoes:
+            super().close()  # A thread já tem outra ligação livre
+        else:
+            ligacoes[self.chave] = self
+
+    # Fecha mesmo a ligação
+    def fechar(self):
+        super().close()
+
+_ligacoes = threading.local()
+
+# Ligações livres da thread atual, por (pid, caminho da base de dados)
+def _ligacoes_da_thread():
+    ligacoes = getattr(_ligacoes, "ligacoes", None)
+    if ligacoes is None:
+        ligacoes = _ligacoes.ligacoes = {}
+    return ligacoes
+
+def _nova_ligacao():
+    conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, factory=LigacaoReutilizavel)
+    conn.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    return conn
+
+# Função que estabelece ligação à base de dados.
+# Cada thread reutiliza a ligação que o chamador anterior "fechou" (no Dash/Flask, cada pedido corre na sua thread);
+# se não houver nenhuma livre (ex.: uma função que abre outra ligação a meio de uma transação), cria uma nova.
+# Uma ligação em uso não fica guardada em lado nenhum: se o chamador a perder sem a fechar (ex.: uma exceção),
+# é libertada pelo garbage collector, que desfaz a transação aberta, e nunca volta a ser entregue.
+# A chave inclui o pid, para que um processo criado por fork (jobs do scheduler) nunca use a ligação do processo pai.
 def connect_to_uni_analytics_db():
-    return sqlite3.connect(DB_PATH)
+    if not SQLITE_REUSE_CONNECTIONS:
+        return _nova_ligacao()
+
+    chave = (os.getpid(), DB_PATH)
+    conn = _ligacoes_da_thread().pop(chave, None)
+    if conn is None:
+        conn = _nova_ligacao()
+        conn.reutilizavel = True
+        conn.chave = chave
+    elif conn.in_transaction:
+        conn.rollback()
+    return conn
+
+# Devolve a cláusula WHERE (e os parâmetros) que filtra as colunas com valor diferente de None.
+# Ex.: filtro_local(course_id=5, user_id=None) -> ("WHERE course_id = ?", [5]); sem filtros -> ("", []).
+# Os escalares numpy (ex.: um id lido de um DataFrame) passam a tipos Python: o sqlite3 ligaria um numpy.int64 como BLOB.
+def filtro_local(**colunas):
+    filtros = {coluna: valor for coluna, valor in colunas.items() if valor is not None}
+    if not filtros:
+        return "", []
+    valores = [valor.item() if isinstance(valor, np.generic) else valor for valor in filtros.values()]
+    return "WHERE " + " AND ".join(f"{coluna} = ?" for coluna in filtros), valores
+
+# Acrescenta uma coluna a uma tabela existente, se ainda não existir (bases de dados criadas por versões anteriores)
+def adicionar_coluna_se_nao_existir(cursor, tabela, coluna, definicao):
+    cursor.execute(f"PRAGMA table_info({tabela})")
+    if coluna not in [linha[1] for linha in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+
+# Cria um índice sobre as colunas indicadas se a tabela ainda não tiver um índice com essas mesmas colunas.
+# A verificação é feita pelas colunas e não pelo nome, porque a troca das tabelas sombra renomeia os índices (sufixo __g<ms>).
+def garantir_indice(cursor, nome, tabela, colunas):
+    cursor.execute(f"PRAGMA index_list({tabela})")
+    for indice in cursor.fetchall():
+        cursor.execute(f"PRAGMA index_info({indice[1]})")
+        if [linha[2] for linha in sorted(cursor.fetchall())] == list(colunas):
+            return
+    cursor.execute(f"CREATE INDEX {nome} ON {tabela}({', '.join(colunas)})")
 
 # Função para inicializar todas as tabelas necessárias no sistema
 def init_uni_analytics_db():
@@ -23,6 +119,7 @@ def init_uni_analytics_db():
             updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
         );
     """)
+    garantir_indice(cursor, "idx_forms_questions_form_type", "forms_questions", ["form_type"])
 
     # Tabela de respostas possíveis às perguntas
     cursor.execute("""
@@ -35,6 +132,7 @@ def init_uni_analytics_db():
             FOREIGN KEY (question_id) REFERENCES forms_questions(id)
         );
     """)
+    garantir_indice(cursor, "idx_forms_answers_question_id", "forms_answers", ["question_id"])
 
     # Tabela de respostas dadas pelos alunos
     cursor.execute("""
@@ -50,29 +148,88 @@ def init_uni_analytics_db():
             FOREIGN KEY (answer_id) REFERENCES forms_answers(id)
         );
     """)
+    # Resultados dos formulários por e-fólio e pergunta, e verificação de respostas já submetidas
+    garantir_indice(cursor, "idx_forms_student_answers_item", "forms_student_answers", ["item_id", "question_id", "form_type"])
+    garantir_indice(cursor, "idx_forms_student_answers_student", "forms_student_answers", ["student_id", "item_id"])
+
+    # Nas tabelas sincronizadas do Moodle as colunas temporais são epochs unix (INTEGER, em segundos), convertidos
+    # para datas legíveis só na apresentação (utils/tempo.py). Bases de dados anteriores são convertidas pelas migrações 2 a 10.
+    # As colunas role, module_type, tipo_interacao e group_name guardam códigos inteiros do dicionário categorias
+    # (ver queries/categorias.py). Bases de dados anteriores são convertidas pelas migrações 11 a 17.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS categorias (
+            id INTEGER PRIMARY KEY,
+            dominio TEXT NOT NULL,
+            valor TEXT NOT NULL,
+            UNIQUE (dominio, valor)
+        );
+    """)
 
     # Tabela de dados de participação em fóruns
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS forum (
             post_id INTEGER PRIMARY KEY,
             user_id INTEGER NOT NULL,
-            role TEXT NOT NULL,
+            role INTEGER NOT NULL,
             course_id INTEGER NOT NULL,
             post_type TEXT NOT NULL,
             parent INTEGER NOT NULL,
-            time_created DATETIME NOT NULL,
-            time_updated DATETIME
+            time_created INTEGER NOT NULL,
+            time_updated INTEGER
         );
     """)
+    garantir_indice(cursor, "idx_forum_course_id", "forum", ["course_id", "user_id"])
 
     # Tabela de interações gerais dos utilizadores
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS interacao (
-            userid INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
             course_id INTEGER NOT NULL,
+            tipo_interacao INTEGER NOT NULL,
+            time_created INTEGER NOT NULL,
+            time_updated INTEGER
+        );
+    """)
+    # Totais por tipo de interação de um aluno numa UC (dashboard do aluno)
+    garantir_indice(cursor, "idx_interacao_user_course", "interacao", ["user_id", "course_id", "tipo_interacao"])
+
+    # Mapeamento dos eventos do log do Moodle para tipos de interação (usado na extração das interações).
+    # eventname vazio aplica-se a todos os eventos do componente; um eventname concreto sobrepõe-se a esse mapeamento.
+    # Para considerar um novo tipo de atividade basta acrescentar aqui uma linha (ex.: 'mod_scorm', '', 'SCORM').
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS interacao_tipos (
+            component TEXT NOT NULL,
+            eventname TEXT NOT NULL DEFAULT '',
             tipo_interacao TEXT NOT NULL,
-            time_created DATETIME NOT NULL,
-            time_updated DATETIME
+            PRIMARY KEY (component, eventname)
+        );
+    """)
+    cursor.executemany("""
+        INSERT OR IGNORE INTO interacao_tipos (component, eventname, tipo_interacao)
+        VALUES (?, '', ?)
+    """, [
+        ("mod_resource", "Ficheiros"),
+        ("mod_page", "Páginas"),
+        ("mod_url", "Links"),
+        ("mod_book", "Livros"),
+        ("mod_folder", "Pastas"),
+        ("mod_quiz", "Quizzes"),
+        ("mod_lesson", "Lições"),
+        ("mod_assign", "Tarefas"),
+        ("mod_forum", "Fóruns"),
+    ])
+
+    # Tabela agregada de interações: total de eventos por utilizador, curso, tipo de interação e dia
+    # (alternativa compacta à tabela interacao, preenchida quando SYNC_INTERACAO_MODO é agregado ou ambos)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS interacao_diaria (
+            user_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            tipo_interacao INTEGER NOT NULL,
+            dia INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            time_updated INTEGER,
+            PRIMARY KEY (user_id, course_id, tipo_interacao, dia)
         );
     """)
 
@@ -81,17 +238,35 @@ def init_uni_analytics_db():
         CREATE TABLE IF NOT EXISTS grade_progress (
             course_module_id INTEGER NOT NULL,
             course_id INTEGER NOT NULL,
-            module_type TEXT NOT NULL,
+            module_type INTEGER NOT NULL,
             user_id INTEGER NOT NULL,
             completion_state INTEGER,
             item_name TEXT,
             group_id INTEGER,
-            group_name TEXT,
+            group_name INTEGER,
             final_grade REAL,
-            time_created DATETIME,
-            time_updated DATETIME
+            time_created INTEGER,
+            time_updated INTEGER,
+            row_hash TEXT
+        );
+    """)
+    adicionar_coluna_se_nao_existir(cursor, "grade_progress", "row_hash", "TEXT")
+    garantir_indice(cursor, "idx_grade_progress_chave", "grade_progress", ["course_module_id", "user_id"])
+    garantir_indice(cursor, "idx_grade_progress_course_id", "grade_progress", ["course_id", "user_id"])
+
+    # Registo das alterações aplicadas a grade_progress pelo sync incremental (change feed para agregados a jusante).
+    # change_type: insert, update, delete ou reconstrucao (carga completa: recalcular tudo)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS grade_progress_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_module_id INTEGER,
+            user_id INTEGER,
+            course_id INTEGER,
+            change_type TEXT NOT NULL,
+            changed_at INTEGER NOT NULL
         );
     """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_grade_progress_changes_changed_at ON grade_progress_changes(changed_at)")
 
     # Cria a tabela de utilizadores locais com email, password e role.
     cursor.execute("""
@@ -106,59 +281,159 @@ def init_uni_analytics_db():
         );
     """)
 
-    # Tabela com os e-fólios importados do Moodle
+    # Tabela com os e-fólios importados do Moodle.
+    # A disponibilidade dos formulários é calculada na leitura a partir de start_date/end_date
+    # (ver queries/formsComuns.py), com os índices criados abaixo.
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS efolios (
             item_id INTEGER PRIMARY KEY,
             name TEXT NOT NULL,
             course_id INTEGER NOT NULL,
             course_name TEXT NOT NULL,
-            start_date DATETIME NOT NULL,
-            end_date DATETIME NOT NULL,
-            available_pre INTEGER DEFAULT 0,
-            available_pos INTEGER DEFAULT 0,
-            time_created DATETIME DEFAULT CURRENT_TIMESTAMP,
-            time_updated DATETIME DEFAULT CURRENT_TIMESTAMP           
+            start_date INTEGER NOT NULL,
+            end_date INTEGER NOT NULL,
+            time_created INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            time_updated INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
         );
     """)
 
+    garantir_indice(cursor, "idx_efolios_start_date", "efolios", ["start_date"])
+    garantir_indice(cursor, "idx_efolios_end_date", "efolios", ["end_date"])
+
     # Tabela com os dados dos cursos e alunos
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS course_data (
             user_id INTEGER NOT NULL,
             email TEXT NOT NULL,
             name TEXT NOT NULL,
-            role TEXT NOT NULL,
+            role INTEGER NOT NULL,
             course_id INTEGER NOT NULL,
             course_name TEXT NOT NULL,
-            group_name TEXT,
-            time_created DATETIME DEFAULT CURRENT_TIMESTAMP,
-            time_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+            group_name INTEGER,
+            time_created INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            time_updated INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
         );
     """)
+    garantir_indice(cursor, "idx_course_data_user_id", "course_data", ["user_id", "course_id"])
+    garantir_indice(cursor, "idx_course_data_course_id", "course_data", ["course_id"])
 
     # Tabela para os conteúdos disponibilizados pelos professores
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS conteudos_disponibilizados (
             course_module_id INTEGER NOT NULL,
             course_id INTEGER NOT NULL,
-            module_type TEXT NOT NULL,
-            time_created DATETIME NOT NULL,
-            time_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+            module_type INTEGER NOT NULL,
+            time_created INTEGER NOT NULL,
+            time_updated INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
         );
     """)
+    garantir_indice(cursor, "idx_conteudos_disponibilizados_course_id", "conteudos_disponibilizados", ["course_id"])
 
     # Tabela para os logs de acesso ao curso
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS course_access_logs (
             user_id INTEGER NOT NULL,
             name TEXT NOT NULL,
-            role TEXT NOT NULL,
+            role INTEGER NOT NULL,
             course_id INTEGER NOT NULL,
             course_name TEXT NOT NULL,
-            access_time DATETIME NOT NULL,
+            access_time INTEGER NOT NULL,
+            time_updated INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        );
+    """)
+    # Acessos de um utilizador a uma UC, por semana e o mais recente (dashboard do professor)
+    garantir_indice(cursor, "idx_course_access_logs_acessos", "course_access_logs", ["course_id", "user_id", "access_time"])
+
+    # Tabela com o estado das sincronizações incrementais (último id de origem ingerido por tabela)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            table_name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0,
             time_updated DATETIME DEFAULT CURRENT_TIMESTAMP
         );
     """)
+
+    # Histórico das execuções dos jobs do scheduler (uma linha por execução; scheduled_for é a hora marcada)
+    # status: em_curso, ok, erro, timeout ou interrompido
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_name TEXT NOT NULL,
+            scheduled_for DATETIME NOT NULL,
+            started_at DATETIME NOT NULL,
+            finished_at DATETIME,
+            duration_seconds REAL,
+            status TEXT NOT NULL,
+            error TEXT,
+            pid INTEGER
+        );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_runs_job_name ON job_runs(job_name, scheduled_for)")
+
+    # Histórico dos backups da base de dados local (tamanho, duração e resultado da verificação de integridade)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS backup_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file TEXT NOT NULL,
+            created_at DATETIME NOT NULL,
+            db_size_bytes INTEGER,
+            backup_size_bytes INTEGER,
+            duration_seconds REAL,
+            compression TEXT,
+            integrity TEXT,
+            status TEXT NOT NULL,
+            chunks_total INTEGER,
+            chunks_new INTEGER
+        );
+    """)
+
+    # Ponto de retoma das reconstruções completas das tabelas incrementais: último log id já confirmado na
+    # tabela sombra. Enquanto existir uma linha para a tabela, o próximo sync retoma a carga a partir desse id.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_checkpoints (
+            table_name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            started_at DATETIME,
+            time_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+    # Impressão digital de cada curso no último sync bem sucedido de cada tabela (deteção de cursos alterados).
+    # max_log_id é o maior id do log do Moodle já visto para o curso.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS course_fingerprints (
+            table_name TEXT NOT NULL,
+            course_id INTEGER NOT NULL,
+            fingerprint TEXT NOT NULL,
+            max_log_id INTEGER NOT NULL DEFAULT 0,
+            time_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (table_name, course_id)
+        );
+    """)
+
+    # Tabela com a telemetria das sincronizações (uma linha por tabela e uma de resumo, com table_name NULL, por execução)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            table_name TEXT,
+            started_at DATETIME,
+            finished_at DATETIME,
+            extract_seconds REAL,
+            load_seconds REAL,
+            rows_read INTEGER,
+            rows_inserted INTEGER,
+            rows_ignored INTEGER,
+            rows_updated INTEGER,
+            rows_unchanged INTEGER,
+            rows_deleted INTEGER,
+            peak_memory_kb INTEGER,
+            status TEXT,
+            error TEXT
+        );
+    """)
+    for coluna in ["rows_updated", "rows_unchanged", "rows_deleted"]:
+        adicionar_coluna_se_nao_existir(cursor, "sync_runs", coluna, "INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sync_runs_run_id ON sync_runs(run_id)")
     conn.commit()
     conn.close()
\ No newline at end of file
@@ -1,7 +1,7 @@
 from forms import formularioPre, formularioPos, formulariosAdmin
 from utils.logger import logger
 from db.uniAnalytics import connect_to_uni_analytics_db
-from datetime import datetime, timedelta
+from queries.formsComuns import FORM_WINDOW_DAYS, fetch_disponibilidade_efolio, fetch_efolios_disponiveis
 from dash import html, dcc
 
 # Função que devolve o layout com base na rota atual, validando janela temporal
@@ -18,43 +18,26 @@ def get_layout(pathname, user_id, item_id):
         logger.warning(f"[Router] item_id inválido: {item_id}")
         return html.Div("Item inválido.")
 
-    conn = connect_to_uni_analytics_db()
-    cursor = conn.cursor()
-
-    # Buscar dados do e-fólio
-    cursor.execute("""
-        SELECT name, start_date, end_date
-        FROM efolios
-        WHERE item_id = ?
-        LIMIT 1
-    """, (item_id,))
-    row = cursor.fetchone()
-    conn.close()
+    # Buscar o e-fólio e a disponibilidade dos formulários (janela definida em queries/formsComuns.py)
+    row = fetch_disponibilidade_efolio(item_id)
 
     if not row:
         logger.warning(f"[Router] item_id {item_id} não encontrado na tabela efolios.")
         return html.Div("Formulário não disponível.")
 
-    name, start_date_str, end_date_str = row
-    start_date = datetime.strptime(start_date_str, "%Y-%m-%d %H:%M:%S")
-    end_date = datetime.strptime(end_date_str, "%Y-%m-%d %H:%M:%S")
-    now = datetime.now()
+    name, disponivel_pre, disponivel_pos = row
 
     if pathname == "/forms/formularioPre":
-        janela_inicio = start_date - timedelta(days=5)
-        janela_fim = start_date
-        if not (janela_inicio <= now <= janela_fim):
+        if not disponivel_pre:
             logger.warning(f"[Router] Fora da janela do formulário pré para item_id={item_id}.")
-            return html.Div("O formulário de pré-avaliação só está disponível na semana anterior ao início do e-fólio.")
+            return html.Div(f"O formulário de pré-avaliação só está disponível nos {FORM_WINDOW_DAYS} dias anteriores ao início do e-fólio.")
         logger.info("A carregar layout: formulário de pré-avaliação")
         return formularioPre.layout(user_id, item_id)
 
     elif pathname == "/forms/formularioPos":
-        janela_inicio = end_date
-        janela_fim = end_date + timedelta(days=5)
-        if not (janela_inicio <= now <= janela_fim):
+        if not disponivel_pos:
             logger.warning(f"[Router] Fora da janela do formulário pós para item_id={item_id}.")
-            return html.Div("O formulário de pós-avaliação só está disponível na semana após o fim do e-fólio.")
+            return html.Div(f"O formulário de pós-avaliação só está disponível nos {FORM_WINDOW_DAYS} dias após o fim do e-fólio.")
         logger.info("A carregar layout: formulário de pós-avaliação")
         return formularioPos.layout(user_id, item_id)
 
@@ -69,7 +52,7 @@ def listar_formularios_disponiveis(user_id):
 
         # Verifica se o aluno pertence ao grupo "Avaliação Continua"
         cursor.execute("""
-            SELECT group_name
+            SELECT (SELECT valor FROM categorias WHERE id = group_name)
             FROM course_data
             WHERE user_id = ?
             LIMIT 1
@@ -83,15 +66,10 @@ def listar_formularios_disponiveis(user_id):
                 html.Div("Os formulários de Avaliação só estão disponíveis para alunos de Avaliação Contínua.")
             ])
 
-        cursor.execute("""
-            SELECT item_id, name, course_name, available_pre, available_pos
-            FROM efolios
-            WHERE available_pre = 1 OR available_pos = 1
-            ORDER BY start_date DESC
-        """)
-        resultados = cursor.fetchall()
         conn.close()
 
+        resultados = fetch_efolios_disponiveis()
+
         logger.debug(f"[Formulários] Formularios encontrados: {len(resultados)}")
 
         componentes = []
@@ -2,9 +2,9 @@
 
 import dash
 from dash import html, dcc, Input, Output, State, ctx, no_update
-from dashboards import dashboardGeral, dashboardAluno, dashboardProfessor, dashboardPre, dashboardPos
+from dashboards import dashboardGeral, dashboardAluno, dashboardProfessor, dashboardPre, dashboardPos, dashboardSync
 from forms import formularioMain, formularioPre, formularioPos  , formulariosAdmin
-from db.uniAnalytics import init_uni_analytics_db
+from db.migrations import aplicar_migracoes
 from db.uniAnalytics import connect_to_uni_analytics_db
 from auth import login
 from flask import Flask, session
@@ -12,9 +12,9 @@ from urllib.parse import urlparse, parse_qs
 import os
 import secrets
 
-# Inicializar a base de dados (caso necessário)
+# Inicializar a base de dados (caso necessário) e aplicar as migrações pendentes do esquema
 print("A inicializar a base de dados...")
-init_uni_analytics_db()
+aplicar_migracoes()
 print("Base de dados pronta.")
 
 # Instanciar aplicação Dash
@@ -112,7 +112,8 @@ def display_page(pathname, search):
             links_dash.extend([
                 dcc.Link("→ Administração de Formulários", href="/forms/formularioAdmin", className="btn-suave"),
                 dcc.Link("→ Dashboard Grau de Confiança", href="/dashboards/dashboardPre", className="btn-suave"),
-                dcc.Link("→ Dashboard Reflexão sobre a Avaliação", href="/dashboards/dashboardPos", className="btn-suave")
+                dcc.Link("→ Dashboard Reflexão sobre a Avaliação", href="/dashboards/dashboardPos", className="btn-suave"),
+                dcc.Link("→ Dashboard Saúde da Sincronização", href="/dashboards/dashboardSync", className="btn-suave")
             ])
         elif user_role == "professor":
             links_dash.extend([
@@ -129,7 +130,7 @@ def display_page(pathname, search):
             conn = connect_to_uni_analytics_db()
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT group_name
+                SELECT (SELECT valor FROM categorias WHERE id = group_name)
                 FROM course_data
                 WHERE user_id = ?
                 LIMIT 1
@@ -199,6 +200,11 @@ def display_page(pathname, search):
             return dashboardPos.layout()
         return html.Div("Acesso não autorizado.")
 
+    elif pathname == "/dashboards/dashboardSync":
+        if user_role == "admin":
+            return dashboardSync.layout()
+        return html.Div("Acesso não autorizado.")
+
     elif pathname.startswith("/forms/"):
         if user_role in ["aluno" ,"admin"]:
             return formularioMain.get_layout(pathname, user_id, item_id) or html.Div("Formulário não encontrado.")
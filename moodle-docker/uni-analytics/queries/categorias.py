@@ -0,0 +1,63 @@
+import pandas as pd
+
+# Colunas categóricas codificadas por dicionário: role, module_type, tipo_interacao e group_name são guardadas como
+# códigos inteiros pequenos, e o texto de cada código fica uma única vez na tabela categorias (id, dominio, valor).
+# O domínio de um código é o nome da coluna (course_access_logs.role usa os mesmos códigos que course_data.role).
+# Os códigos são atribuídos no sync (codificador) e os loaders locais devolvem estas colunas como categóricas pandas
+# (descodificar_colunas), pelo que os filtros dos dashboards comparam códigos e não texto.
+# Em SQL, o texto de um código obtém-se com (SELECT valor FROM categorias WHERE id = <coluna>).
+
+# Colunas codificadas de cada tabela sincronizada
+COLUNAS_CODIFICADAS = {
+    "forum": ["role"],
+    "interacao": ["tipo_interacao"],
+    "interacao_diaria": ["tipo_interacao"],
+    "grade_progress": ["module_type", "group_name"],
+    "course_data": ["role", "group_name"],
+    "conteudos_disponibilizados": ["module_type"],
+    "course_access_logs": ["role"],
+}
+
+# Devolve uma função valor -> código de um domínio, usada no sync antes de escrever as linhas.
+# Os valores novos são acrescentados a categorias na transação em curso da ligação do cursor (ficam confirmados
+# com as linhas que os usam). None mantém-se None.
+def codificador(cursor_local, dominio):
+    conn_local = cursor_local.connection
+    codigos = dict(conn_local.execute("SELECT valor, id FROM categorias WHERE dominio = ?", (dominio,)).fetchall())
+
+    def codificar(valor):
+        if valor is None:
+            return None
+        codigo = codigos.get(valor)
+        if codigo is None:
+            conn_local.execute("INSERT OR IGNORE INTO categorias (dominio, valor) VALUES (?, ?)", (dominio, valor))
+            (codigo,) = conn_local.execute(
+                "SELECT id FROM categorias WHERE dominio = ? AND valor = ?", (dominio, valor)
+            ).fetchone()
+            codigos[valor] = codigo
+        return codigo
+
+    return codificar
+
+# Converte as colunas codificadas de um DataFrame lido da base de dados local em categóricas pandas, com todos os
+# valores do domínio como categorias. Códigos NULL (ou desconhecidos) ficam NaN.
+def descodificar_colunas(cursor_local, df, colunas):
+    for coluna in colunas:
+        cursor_local.execute("SELECT id, valor FROM categorias WHERE dominio = ? ORDER BY id", (coluna,))
+        dicionario = cursor_local.fetchall()
+        ids = pd.Index([codigo for codigo, _ in dicionario], dtype="int64")
+        valores = pd.Index([valor for _, valor in dicionario], dtype=object)
+        df[coluna] = pd.Categorical.from_codes(ids.get_indexer(pd.to_numeric(df[coluna])), categories=valores)
+    return df
+
+# Máscara das linhas de uma coluna categórica cujo valor satisfaz condicao(valor).
+# A condição é avaliada uma vez por categoria; a comparação com as linhas é feita sobre os códigos.
+def mascara_categorias(serie, condicao):
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.astype("category")
+    return serie.isin([valor for valor in serie.cat.categories if condicao(valor)])
+
+# Máscara das linhas cujo valor contém texto, sem distinguir maiúsculas (NaN não contém nada)
+def contem(serie, texto):
+    texto = texto.lower()
+    return mascara_categorias(serie, lambda valor: texto in str(valor).lower())
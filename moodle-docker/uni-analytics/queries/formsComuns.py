@@ -1,36 +1,34 @@
 from db.uniAnalytics import connect_to_uni_analytics_db
-from db.moodleConnection import connect_to_moodle_db
+from db.moodleConnection import moodle_connection, executar_extracao, limitar_ritmo, filtro_cursos
 from utils.logger import logger
-from datetime import datetime
+from utils.tempo import epoch_agora, para_epoch
+import os
 
 ################### Moodle Queries ###################
-# Função para obter dados do Moodle dos e-fólios
-def fetch_all_efolios():
-    conn = connect_to_moodle_db()
-    query = """
+# Função para obter dados do Moodle dos e-fólios (course_ids limita a extração a esses cursos)
+def fetch_all_efolios(course_ids=None):
+    filtro, params = filtro_cursos("a.course", course_ids)
+    query = f"""
         SELECT
             gi.id AS item_id,
             a.name,
             a.course AS course_id,
             c.fullname AS course_name,
-            FROM_UNIXTIME(a.allowsubmissionsfromdate) AS start_date,
-            FROM_UNIXTIME(a.duedate) AS end_date,
-            FROM_UNIXTIME(gi.timemodified) AS time_created
+            a.allowsubmissionsfromdate AS start_date,
+            a.duedate AS end_date,
+            gi.timemodified AS time_created
         FROM mdl_assign a
         JOIN mdl_grade_items gi ON gi.iteminstance = a.id
         JOIN mdl_course c ON c.id = a.course
-        WHERE gi.itemmodule = 'assign' AND a.name LIKE '%folio%';
+        WHERE gi.itemmodule = 'assign' AND a.name LIKE '%folio%' {filtro};
     """
-    try:
+    # Os erros propagam-se ao sync, que não troca a tabela nem grava as impressões dos cursos alterados
+    with moodle_connection(extracao=True) as conn:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute(query)
+        executar_extracao(cursor, query, params or None)
         rows = cursor.fetchall()
-        conn.close()
+        limitar_ritmo(len(rows))
         return rows
-    except Exception as e:
-        print("Erro ao obter dados dos e-fólios:", e)
-        conn.close()
-        return []
 
 ################### Local Queries ###################
 def pre_pos_obter_course_id_e_total_respostas(item_id):
@@ -56,15 +54,63 @@ def pre_pos_obter_course_id_e_total_respostas(item_id):
     else:
         return []
     
+################### Disponibilidade dos formulários ###################
+# Número de dias em que os formulários estão abertos: o pré nos FORM_WINDOW_DAYS dias antes do início do e-fólio
+# e o pós nos FORM_WINDOW_DAYS dias após o fim. É a única definição da janela (página inicial, router e dashboards).
+FORM_WINDOW_DAYS = int(os.getenv("FORM_WINDOW_DAYS", "7"))
+
+# A disponibilidade é calculada na leitura, pelo que está sempre atualizada. As datas dos e-fólios (epochs) são
+# comparadas com limites calculados a partir de agora, o que permite usar os índices de start_date e end_date.
+SQL_DISPONIVEL_PRE = "(start_date BETWEEN ? AND ?)"
+SQL_DISPONIVEL_POS = "(end_date BETWEEN ? AND ?)"
+
+# Parâmetros de SQL_DISPONIVEL_PRE e SQL_DISPONIVEL_POS (por esta ordem) para o momento agora (epoch ou datetime)
+def parametros_disponibilidade(agora=None):
+    agora = para_epoch(agora) if agora is not None else epoch_agora()
+    janela = FORM_WINDOW_DAYS * 86400
+    return (agora, agora + janela, agora - janela, agora)
+
+# Função para obter os e-fólios com formulário pré ou pós disponível, do mais recente para o mais antigo
+def fetch_efolios_disponiveis():
+    conn = connect_to_uni_analytics_db()
+    cursor = conn.cursor()
+    parametros = parametros_disponibilidade()
+    cursor.execute(f"""
+        SELECT item_id, name, course_name,
+               {SQL_DISPONIVEL_PRE} AS available_pre,
+               {SQL_DISPONIVEL_POS} AS available_pos
+        FROM efolios
+        WHERE {SQL_DISPONIVEL_PRE} OR {SQL_DISPONIVEL_POS}
+        ORDER BY start_date DESC
+    """, parametros * 2)
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+# Função para obter o nome e a disponibilidade (pré, pós) de um e-fólio; None se não existir
+def fetch_disponibilidade_efolio(item_id):
+    conn = connect_to_uni_analytics_db()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT name, {SQL_DISPONIVEL_PRE}, {SQL_DISPONIVEL_POS}
+        FROM efolios
+        WHERE item_id = ?
+        LIMIT 1
+    """, (*parametros_disponibilidade(), item_id))
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
 # Função para obter dados locais de Efolios
 def fetch_all_efolios_local():
     conn = connect_to_uni_analytics_db()
     cursor = conn.cursor()
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT item_id, name, course_id, course_name, start_date, end_date, 
-               available_pre, available_pos, time_created, time_updated
+               {SQL_DISPONIVEL_PRE} AS available_pre, {SQL_DISPONIVEL_POS} AS available_pos,
+               time_created, time_updated
         FROM efolios
-    """)
+    """, parametros_disponibilidade())
     rows = cursor.fetchall()
     conn.close()
 
@@ -1,58 +1,89 @@
 import pandas as pd
-from db.moodleConnection import connect_to_moodle_db
+from db.moodleConnection import stream_moodle_log
 from db.uniAnalytics import connect_to_uni_analytics_db
+from queries.categorias import descodificar_colunas
 
 ################### Moodle Queries ###################
+# Os eventos do log são classificados por tipo de interação a partir da tabela local interacao_tipos
+# (component/eventname → tipo_interacao). A query ao Moodle filtra apenas por igualdade em component,
+# e a classificação é feita aqui, pelo que novos tipos de atividade (scorm, h5p, ...) não exigem alterar SQL.
+
+# Constrói o filtro dos eventos considerados interações para os componentes indicados (um placeholder por componente)
+def filtro_interacoes(componentes):
+    return f"""l.edulevel = 2
+          AND l.action IN ('viewed', 'launched')
+          AND l.component IN ({', '.join(['%s'] * len(componentes))})"""
+
+# Devolve o tipo de interação de um evento: primeiro o mapeamento específico do eventname, depois o do componente
+def classificar_interacao(tipos, component, eventname):
+    return tipos.get((component, eventname)) or tipos.get((component, "")) or "Outro"
+
+# Gerador que acrescenta tipo_interacao às linhas lidas do Moodle (e retira component/eventname)
+def classificar_interacoes(linhas, tipos):
+    for row in linhas:
+        row["tipo_interacao"] = classificar_interacao(tipos, row.pop("component"), row.pop("eventname"))
+        yield row
+
 # Função para obter dados de Moodle das interações
-def fetch_all_interacoes():
-    conn = connect_to_moodle_db()
-    query = """
+# Só devolve os registos do log com id superior a desde_id (0 devolve todo o histórico)
+# É um gerador: as linhas são lidas do Moodle por intervalos de ids e páginas (keyset) à medida que são consumidas
+def fetch_all_interacoes(desde_id=0):
+    tipos = fetch_interacao_tipos_local()
+    componentes = sorted({component for component, _ in tipos})
+    query = f"""
         SELECT
+          l.id as log_id,
           l.userid as user_id,
           l.courseid as course_id,
           l.timecreated as time_created,
-          CASE
-            WHEN l.eventname LIKE '%mod_resource%' THEN 'Ficheiros'
-            WHEN l.eventname LIKE '%mod_page%'     THEN 'Páginas'
-            WHEN l.eventname LIKE '%mod_url%'      THEN 'Links'
-            WHEN l.eventname LIKE '%mod_book%'     THEN 'Livros'
-            WHEN l.eventname LIKE '%mod_folder%'   THEN 'Pastas'
-            WHEN l.eventname LIKE '%mod_quiz%'     THEN 'Quizzes'
-            WHEN l.eventname LIKE '%mod_lesson%'   THEN 'Lições' 
-            WHEN l.eventname LIKE '%mod_assign%'   THEN 'Tarefas'
-            WHEN l.eventname LIKE '%mod_forum%'    THEN 'Fóruns'
-            ELSE 'Outro'
-          END AS tipo_interacao
+          l.component,
+          l.eventname
         FROM mdl_logstore_standard_log l
-        WHERE l.edulevel = 2
-          AND l.action IN ('viewed', 'launched')
-          AND (
-            l.eventname LIKE '%mod_resource%' OR
-            l.eventname LIKE '%mod_page%'     OR
-            l.eventname LIKE '%mod_url%'      OR
-            l.eventname LIKE '%mod_book%'     OR
-            l.eventname LIKE '%mod_folder%'   OR
-            l.eventname LIKE '%mod_quiz%'     OR
-            l.eventname LIKE '%mod_lesson%'   OR 
-            l.eventname LIKE '%mod_assign%'   OR
-            l.eventname LIKE '%mod_forum%'
-          );
+        WHERE {filtro_interacoes(componentes)}
+          AND l.id > %s AND l.id <= %s
+        ORDER BY l.id
+        LIMIT %s;
     """
+    return classificar_interacoes(stream_moodle_log(query, componentes, desde_id), tipos)
 
-    conn = connect_to_moodle_db()
-    try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        conn.close()
-        return rows
-    except Exception as e:
-        print("Erro ao obter dados das interações:", e)
-        conn.close()
-        return []
+# Função para obter do Moodle as interações já agregadas por utilizador, curso, evento e dia (GROUP BY no MySQL).
+# Só considera os registos do log com id superior a desde_id; max_log_id é o maior id de cada grupo (para a watermark).
+# Transfere uma linha por utilizador/curso/evento/dia em vez de uma linha por evento. Como vários eventos podem ter
+# o mesmo tipo de interação, podem vir várias linhas para o mesmo utilizador/curso/tipo/dia (o sync soma-as).
+# O GROUP BY é feito por intervalo de ids (ver stream_moodle_log), pelo que um grupo pode também vir repartido
+# por vários intervalos; como o sync soma as linhas repetidas, o total final é o mesmo.
+def fetch_interacoes_diarias(desde_id=0):
+    tipos = fetch_interacao_tipos_local()
+    componentes = sorted({component for component, _ in tipos})
+    query = f"""
+        SELECT
+          l.userid as user_id,
+          l.courseid as course_id,
+          l.component,
+          l.eventname,
+          DATE(FROM_UNIXTIME(l.timecreated)) as dia,
+          COUNT(*) as total,
+          MAX(l.id) as max_log_id
+        FROM mdl_logstore_standard_log l
+        WHERE {filtro_interacoes(componentes)}
+          AND l.id > %s AND l.id <= %s
+        GROUP BY l.userid, l.courseid, l.component, l.eventname, dia;
+    """
+    return classificar_interacoes(stream_moodle_log(query, componentes, desde_id, paginar=False), tipos)
 
 ################### Local Queries ###################
-# Função para obter dados locais de interações de Moodle
+# Função para obter o mapeamento local de eventos do log para tipos de interação.
+# Devolve {(component, eventname): tipo_interacao}; eventname vazio aplica-se a todos os eventos do componente.
+def fetch_interacao_tipos_local():
+    conn = connect_to_uni_analytics_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT component, eventname, tipo_interacao FROM interacao_tipos")
+    rows = cursor.fetchall()
+    conn.close()
+
+    return {(component, eventname): tipo_interacao for component, eventname, tipo_interacao in rows}
+
+# Função para obter dados locais de interações de Moodle (DataFrame, com tipo_interacao categórico)
 def fetch_all_interacoes_local():
     conn = connect_to_uni_analytics_db()
     cursor = conn.cursor()
@@ -60,9 +91,36 @@ def fetch_all_interacoes_local():
         SELECT user_id, course_id, time_created, tipo_interacao, time_updated
         FROM interacao
     """)
+    colunas = ["user_id", "course_id", "time_created", "tipo_interacao", "time_updated"]
+    df = pd.DataFrame.from_records(cursor.fetchall(), columns=colunas)
+    descodificar_colunas(cursor, df, ["tipo_interacao"])
+    conn.close()
+    return df
+
+# Função para obter o total de interações de um aluno num curso, por tipo de interação.
+# Lê da tabela sincronizada mais recentemente: a agregada interacao_diaria (SYNC_INTERACAO_MODO agregado/ambos)
+# ou a tabela interacao, cujos eventos são agregados aqui. A agregação é feita pelo código do tipo de interação.
+def fetch_interacoes_aluno_local(user_id, course_id):
+    conn = connect_to_uni_analytics_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT table_name
+        FROM sync_state
+        WHERE table_name IN ('interacao', 'interacao_diaria')
+        ORDER BY time_updated DESC, table_name = 'interacao_diaria' DESC
+        LIMIT 1
+    """)
+    resultado = cursor.fetchone()
+    tabela = resultado[0] if resultado else "interacao"
+    total = "SUM(total)" if tabela == "interacao_diaria" else "COUNT(*)"
+    cursor.execute(f"""
+        SELECT (SELECT valor FROM categorias WHERE id = tipo_interacao), {total}
+        FROM {tabela}
+        WHERE user_id = ? AND course_id = ?
+        GROUP BY tipo_interacao
+    """, (user_id, course_id))
     rows = cursor.fetchall()
     conn.close()
 
-    # Converter para lista de dicionários
-    colunas = ["user_id", "course_id", "time_created", "tipo_interacao", "time_updated"]
-    return [dict(zip(colunas, row)) for row in rows]
\ No newline at end of file
+    colunas = ["tipo_interacao", "total"]
+    return [dict(zip(colunas, row)) for row in rows]
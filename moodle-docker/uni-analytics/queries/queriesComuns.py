@@ -1,12 +1,13 @@
 import pandas as pd
-from db.moodleConnection import connect_to_moodle_db
-from db.uniAnalytics import connect_to_uni_analytics_db
+from db.moodleConnection import moodle_connection, executar_extracao, limitar_ritmo, stream_moodle_query, filtro_cursos
+from db.uniAnalytics import connect_to_uni_analytics_db, filtro_local
+from queries.categorias import descodificar_colunas
 
 ################### Moodle Queries ###################
-# Função para obter dados do Moodle dos cursos e alunos
-def fetch_all_user_course_data():
-    conn = connect_to_moodle_db()
-    query = """
+# Função para obter dados do Moodle dos cursos e alunos (course_ids limita a extração a esses cursos)
+def fetch_all_user_course_data(course_ids=None):
+    filtro, params = filtro_cursos("c.id", course_ids)
+    query = f"""
         SELECT
           u.id AS user_id,
           u.email AS email,
@@ -23,22 +24,25 @@ def fetch_all_user_course_data():
         JOIN mdl_role r ON r.id = ra.roleid
         LEFT JOIN mdl_groups_members gm ON gm.userid = u.id
         LEFT JOIN mdl_groups g ON g.id = gm.groupid AND g.courseid = c.id
+        WHERE 1 = 1 {filtro}
         GROUP BY u.id, u.email, name, r.shortname, c.id, c.fullname, u.timecreated
         ORDER BY course_id, role, name;           
     """
-    cursor = conn.cursor()
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    columns = [desc[0] for desc in cursor.description]
+    with moodle_connection(extracao=True) as conn:
+        cursor = conn.cursor()
+        executar_extracao(cursor, query, params or None)
+        rows = cursor.fetchall()
+        columns = [desc[0] for desc in cursor.description]
+    limitar_ritmo(len(rows))
     df = pd.DataFrame(rows, columns=columns)
-    conn.close()
     return df
 
-# Função para obter dados do Moodle dos fóruns
-def fetch_all_forum_posts():
-    from db.moodleConnection import connect_to_moodle_db
-    conn = connect_to_moodle_db()
-    query = """
+# Função para obter dados do Moodle dos fóruns (course_ids limita a extração a esses cursos)
+# desde_post_id limita a extração aos posts com id superior (posts novos, usado no micro-lote)
+# É um gerador: as linhas são lidas do Moodle em blocos à medida que são consumidas
+def fetch_all_forum_posts(course_ids=None, desde_post_id=0):
+    filtro, params = filtro_cursos("f.course", course_ids)
+    query = f"""
         SELECT
             u.id AS user_id,
             u.firstname,
@@ -59,23 +63,15 @@ def fetch_all_forum_posts():
         LEFT JOIN mdl_context ctx ON ctx.contextlevel = 50 AND ctx.instanceid = f.course
         LEFT JOIN mdl_role_assignments ra ON ra.contextid = ctx.id AND ra.userid = u.id
         LEFT JOIN mdl_role r ON r.id = ra.roleid
-        WHERE u.deleted = 0;
+        WHERE u.deleted = 0 AND p.id > %s {filtro};
     """
-    try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        conn.close()
-        return rows
-    except Exception as e:
-        print("Erro ao obter dados dos fóruns:", e)
-        conn.close()
-        return []
+    return stream_moodle_query(query, (desde_post_id, *params))
 
-# Função para obter dados do Moodle das notas e progresso dos alunos
-def fetch_all_grade_progress():
-    conn = connect_to_moodle_db()
-    query = """      
+# Função para obter dados do Moodle das notas e progresso dos alunos (course_ids limita a extração a esses cursos)
+# É um gerador: as linhas são lidas do Moodle em blocos à medida que são consumidas
+def fetch_all_grade_progress(course_ids=None):
+    filtro, params = filtro_cursos("cm.course", course_ids)
+    query = f"""      
     WITH grupo_unico AS (
         SELECT gm.userid, g.id AS groupid, g.name AS groupname, g.courseid
         FROM mdl_groups_members gm
@@ -109,54 +105,151 @@ def fetch_all_grade_progress():
     LEFT JOIN grupo_unico gu 
         ON gu.userid = cmc.userid 
        AND gu.courseid = cm.course
-    WHERE cm.completion > 0;   
+    WHERE cm.completion > 0 {filtro};
     """
-    try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        conn.close()
-        return rows
-    except Exception as e:
-        print("Erro ao obter completions globais:", e)
-        conn.close()
-        return []        
+    return stream_moodle_query(query, params or None)
     
+# Função para obter do Moodle os indicadores de alteração de cada curso (usados para calcular a impressão digital).
+# Cada fonte devolve, por curso, o maior id/timemodified e o número de linhas: qualquer inserção, alteração ou
+# remoção nessa fonte muda pelo menos um dos dois valores. O log só é lido a partir de desde_log_id (intervalo
+# da chave primária), pelo que só aparecem os cursos com eventos novos. Devolve linhas (course_id, fonte, valor, total).
+def fetch_course_change_indicators(desde_log_id=0):
+    query = """
+        SELECT c.id AS course_id, 'curso' AS fonte, c.timemodified AS valor, 1 AS total
+        FROM mdl_course c
+        UNION ALL
+        SELECT l.courseid, 'log', MAX(l.id), COUNT(*)
+        FROM mdl_logstore_standard_log l
+        WHERE l.id > %s
+        GROUP BY l.courseid
+        UNION ALL
+        SELECT cm.course, 'modulos', MAX(cm.added), COUNT(*)
+        FROM mdl_course_modules cm
+        GROUP BY cm.course
+        UNION ALL
+        SELECT cm.course, 'conclusoes', MAX(cmc.timemodified), COUNT(*)
+        FROM mdl_course_modules_completion cmc
+        JOIN mdl_course_modules cm ON cm.id = cmc.coursemoduleid
+        GROUP BY cm.course
+        UNION ALL
+        SELECT gi.courseid, 'itens_avaliacao', MAX(gi.timemodified), COUNT(*)
+        FROM mdl_grade_items gi
+        GROUP BY gi.courseid
+        UNION ALL
+        SELECT gi.courseid, 'notas', MAX(gg.timemodified), COUNT(*)
+        FROM mdl_grade_grades gg
+        JOIN mdl_grade_items gi ON gi.id = gg.itemid
+        GROUP BY gi.courseid
+        UNION ALL
+        SELECT d.course, 'forum', MAX(p.modified), COUNT(*)
+        FROM mdl_forum_posts p
+        JOIN mdl_forum_discussions d ON d.id = p.discussion
+        GROUP BY d.course
+        UNION ALL
+        SELECT ctx.instanceid, 'roles', MAX(GREATEST(ra.timemodified, u.timemodified)), COUNT(*)
+        FROM mdl_role_assignments ra
+        JOIN mdl_context ctx ON ctx.id = ra.contextid AND ctx.contextlevel = 50
+        JOIN mdl_user u ON u.id = ra.userid
+        GROUP BY ctx.instanceid
+        UNION ALL
+        SELECT g.courseid, 'grupos', MAX(gm.timeadded), COUNT(*)
+        FROM mdl_groups_members gm
+        JOIN mdl_groups g ON g.id = gm.groupid
+        GROUP BY g.courseid;
+    """
+    with moodle_connection(extracao=True) as conn:
+        cursor = conn.cursor()
+        executar_extracao(cursor, query, (desde_log_id,))
+        return cursor.fetchall()
+
+# Função para obter do Moodle os cursos com conclusões, notas ou inscrições (roles) alteradas desde desde_time
+# (timestamp unix), usada no micro-lote. Devolve linhas (course_id, fonte, ultimo), com ultimo o maior timemodified.
+# Usa >= para voltar a apanhar as alterações feitas no mesmo segundo da última leitura (o sync por diferenças
+# ignora as que já estavam aplicadas). As remoções não alteram timemodified e só são apanhadas no sync completo.
+# O Moodle não tem índices sobre timemodified nestas tabelas: cada chamada lê-as por completo, pelo que
+# max_execucao_ms (hint MAX_EXECUTION_TIME) limita o seu custo; se o limite for excedido a query falha.
+def fetch_cursos_alterados_desde(desde_time, max_execucao_ms=None):
+    query = """
+        SELECT cm.course AS course_id, 'conclusoes' AS fonte, MAX(cmc.timemodified) AS ultimo
+        FROM mdl_course_modules_completion cmc
+        JOIN mdl_course_modules cm ON cm.id = cmc.coursemoduleid
+        WHERE cmc.timemodified >= %s
+        GROUP BY cm.course
+        UNION ALL
+        SELECT gi.courseid, 'notas', MAX(gg.timemodified)
+        FROM mdl_grade_grades gg
+        JOIN mdl_grade_items gi ON gi.id = gg.itemid
+        WHERE gg.timemodified >= %s
+        GROUP BY gi.courseid
+        UNION ALL
+        SELECT ctx.instanceid, 'roles', MAX(ra.timemodified)
+        FROM mdl_role_assignments ra
+        JOIN mdl_context ctx ON ctx.id = ra.contextid AND ctx.contextlevel = 50
+        WHERE ra.timemodified >= %s
+        GROUP BY ctx.instanceid;
+    """
+    with moodle_connection(extracao=True) as conn:
+        cursor = conn.cursor()
+        executar_extracao(cursor, query, (desde_time, desde_time, desde_time), max_execucao_ms)
+        return cursor.fetchall()
+
 ################### Local Queries ###################
-# Função para obter dados locais de fóruns de Moodle
-def fetch_all_forum_posts_local():
+# Os loaders locais devolvem DataFrames, com as colunas codificadas (role, module_type, group_name) como categóricas
+# (ver queries/categorias.py).
+
+# Função para obter dados locais de fóruns de Moodle (course_id limita a leitura a essa UC)
+def fetch_all_forum_posts_local(course_id=None):
+    filtro, params = filtro_local(course_id=course_id)
     conn = connect_to_uni_analytics_db()
     cursor = conn.cursor()
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT post_id, user_id, role, course_id, post_type, parent, time_created
         FROM forum
-    """)
-    rows = cursor.fetchall()
-    conn.close()
-
-    # Converter para lista de dicionários
+        {filtro}
+    """, params)
     colunas = ["post_id", "user_id", "role", "course_id", "post_type", "parent", "time_created"]
-    return [dict(zip(colunas, row)) for row in rows]
+    df = pd.DataFrame.from_records(cursor.fetchall(), columns=colunas)
+    descodificar_colunas(cursor, df, ["role"])
+    conn.close()
+    return df
 
-# Função para obter dados locais de progresso e notas dos alunos
-def fetch_all_grade_progress_local():
+# Função para obter dados locais de progresso e notas dos alunos (course_id limita a leitura a essa UC)
+def fetch_all_grade_progress_local(course_id=None):
+    filtro, params = filtro_local(course_id=course_id)
     conn = connect_to_uni_analytics_db()
     cursor = conn.cursor()
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT course_module_id, course_id, module_type, user_id,
                completion_state, item_name, group_id, group_name,
                final_grade, time_created, time_updated
         FROM grade_progress
-    """)
-    rows = cursor.fetchall()
-    conn.close()
-
-    # Converter para lista de dicionários
+        {filtro}
+    """, params)
     colunas = [
         "course_module_id", "course_id", "module_type", "user_id",
         "completion_state", "item_name", "group_id", "group_name",
         "final_grade", "time_created", "time_updated"
     ]
+    df = pd.DataFrame.from_records(cursor.fetchall(), columns=colunas)
+    descodificar_colunas(cursor, df, ["module_type", "group_name"])
+    conn.close()
+    return df
+
+# Função para obter as alterações a grade_progress registadas pelo sync (change feed) com id superior a desde_id.
+# Uma linha com change_type 'reconstrucao' indica uma carga completa: os agregados devem ser recalculados por inteiro.
+def fetch_grade_progress_changes_local(desde_id=0):
+    conn = connect_to_uni_analytics_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, course_module_id, user_id, course_id, change_type, changed_at
+        FROM grade_progress_changes
+        WHERE id > ?
+        ORDER BY id
+    """, (desde_id,))
+    rows = cursor.fetchall()
+    conn.close()
+
+    colunas = ["id", "course_module_id", "user_id", "course_id", "change_type", "changed_at"]
     return [dict(zip(colunas, row)) for row in rows]
 
 # Função para obter dados locais de cursos e alunos
@@ -176,9 +269,8 @@ def fetch_all_user_course_data_local():
             time_updated
         FROM course_data
     """)
-    rows = cursor.fetchall()
-    conn.close()
-
-    # Converter para lista de dicionários
     colunas = ["user_id", "email", "name", "role", "course_id", "course_name", "group_name", "time_created", "time_updated"]
-    return [dict(zip(colunas, row)) for row in rows]
\ No newline at end of file
+    df = pd.DataFrame.from_records(cursor.fetchall(), columns=colunas)
+    descodificar_colunas(cursor, df, ["role", "group_name"])
+    conn.close()
+    return df
\ No newline at end of file
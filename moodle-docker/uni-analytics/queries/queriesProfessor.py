@@ -1,12 +1,13 @@
 import pandas as pd
-from db.moodleConnection import connect_to_moodle_db
-from db.uniAnalytics import connect_to_uni_analytics_db
+from db.moodleConnection import moodle_connection, executar_extracao, limitar_ritmo, stream_moodle_log, filtro_cursos
+from db.uniAnalytics import connect_to_uni_analytics_db, filtro_local
+from queries.categorias import descodificar_colunas
 
 ################### Moodle Queries ###################
-# Função para obter os conteudos disponibilizados por professores
-def fetch_all_conteudos_disponibilizados():
-    conn = connect_to_moodle_db()
-    query = """
+# Função para obter os conteudos disponibilizados por professores (course_ids limita a extração a esses cursos)
+def fetch_all_conteudos_disponibilizados(course_ids=None):
+    filtro, params = filtro_cursos("cm.course", course_ids)
+    query = f"""
         SELECT
             cm.id AS course_module_id,
             cm.course AS course_id,
@@ -14,57 +15,43 @@ def fetch_all_conteudos_disponibilizados():
             m.name AS module_type
         FROM mdl_course_modules cm
         JOIN mdl_modules m ON m.id = cm.module
-        WHERE m.name IN ('resource', 'page', 'url', 'book', 'folder', 'quiz', 'lesson', 'forum', 'scorm');
+        WHERE m.name IN ('resource', 'page', 'url', 'book', 'folder', 'quiz', 'lesson', 'forum', 'scorm') {filtro};
     """
-    try:
+    # Os erros propagam-se ao sync, que não troca a tabela nem grava as impressões dos cursos alterados
+    with moodle_connection(extracao=True) as conn:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute(query)
+        executar_extracao(cursor, query, params or None)
         rows = cursor.fetchall()
-        conn.close()
+        limitar_ritmo(len(rows))
         return rows
-    except Exception as e:
-        print("Erro ao obter conteúdos disponibilizados:", e)
-        conn.close()
-        return []
 
-# Função para obter informação sobre acessos
-def fetch_all_course_access_logs():
-    conn = connect_to_moodle_db()
+# Função para obter os acessos ao curso (eventos course viewed) do log do Moodle
+# Só devolve os registos com id superior a desde_id; nomes, roles e cursos são resolvidos localmente a partir de course_data
+# É um gerador: as linhas são lidas do Moodle por intervalos de ids e páginas (keyset) à medida que são consumidas
+def fetch_all_course_access_logs(desde_id=0):
     query = """
         SELECT
-            u.id AS user_id,
-            CONCAT(u.firstname, ' ', u.lastname) AS name,
-            r.shortname AS role,
-            c.id AS course_id,
-            c.fullname AS course_name,
-            FROM_UNIXTIME(l.timecreated) AS access_time
-        FROM mdl_user u
-        JOIN mdl_role_assignments ra ON ra.userid = u.id
-        JOIN mdl_context ctx ON ctx.id = ra.contextid AND ctx.contextlevel = 50
-        JOIN mdl_course c ON c.id = ctx.instanceid
-        JOIN mdl_role r ON r.id = ra.roleid
-        JOIN mdl_logstore_standard_log l 
-          ON l.userid = u.id AND l.courseid = c.id
-          AND l.action = 'viewed' AND l.target = 'course'
-        WHERE u.deleted = 0;
+            l.id AS log_id,
+            l.userid AS user_id,
+            l.courseid AS course_id,
+            l.timecreated AS access_time
+        FROM mdl_logstore_standard_log l
+        JOIN mdl_user u ON u.id = l.userid AND u.deleted = 0
+        WHERE l.action = 'viewed'
+          AND l.target = 'course'
+          AND l.id > %s AND l.id <= %s
+        ORDER BY l.id
+        LIMIT %s;
     """
-    try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        conn.close()
-        return rows
-    except Exception as e:
-        print("Erro ao obter logs de acesso ao curso:", e)
-        conn.close()
-        return []
+    return stream_moodle_log(query, desde_id=desde_id)
 
 ################### Local Queries ###################
-# Conteúdos disponibilizados localmente
-def fetch_conteudos_disponibilizados_local():
+# Conteúdos disponibilizados localmente (course_id limita a leitura a essa UC), com module_type categórico
+def fetch_conteudos_disponibilizados_local(course_id=None):
+    filtro, params = filtro_local(course_id=course_id)
     conn = connect_to_uni_analytics_db()
     cursor = conn.cursor()
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT
             course_module_id,
             course_id,
@@ -72,19 +59,20 @@ def fetch_conteudos_disponibilizados_local():
             time_created,
             time_updated
         FROM conteudos_disponibilizados
-    """)
-    rows = cursor.fetchall()
-    conn.close()
-
+        {filtro}
+    """, params)
     colunas = ["course_module_id", "course_id", "module_type", "time_created", "time_updated"]
+    df = pd.DataFrame.from_records(cursor.fetchall(), columns=colunas)
+    descodificar_colunas(cursor, df, ["module_type"])
+    conn.close()
+    return df
 
-    return [dict(zip(colunas, row)) for row in rows]
-
-# Logs de acesso ao curso localmente
-def fetch_course_access_logs_local():
+# Logs de acesso ao curso localmente (course_id limita a leitura a essa UC), com role categórico
+def fetch_course_access_logs_local(course_id=None):
+    filtro, params = filtro_local(course_id=course_id)
     conn = connect_to_uni_analytics_db()
     cursor = conn.cursor()
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT
             user_id,
             name,
@@ -94,9 +82,41 @@ def fetch_course_access_logs_local():
             access_time,
             time_updated
         FROM course_access_logs
-    """)
+        {filtro}
+    """, params)
+    colunas = ["user_id", "name", "role", "course_id", "course_name", "access_time", "time_updated"]
+    df = pd.DataFrame.from_records(cursor.fetchall(), columns=colunas)
+    descodificar_colunas(cursor, df, ["role"])
+    conn.close()
+    return df
+
+# Número de acessos de um utilizador a uma UC por semana (semana "AAAA-SS" na hora local, com início à segunda-feira).
+# A divisão por semanas é feita no SQLite a partir dos epochs, com o índice (course_id, user_id, access_time).
+def fetch_acessos_semanais_local(user_id, course_id):
+    conn = connect_to_uni_analytics_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT strftime('%Y-%W', access_time, 'unixepoch', 'localtime') AS semana, COUNT(*)
+        FROM course_access_logs
+        WHERE course_id = ? AND user_id = ?
+        GROUP BY semana
+        ORDER BY semana
+    """, (course_id, user_id))
     rows = cursor.fetchall()
     conn.close()
 
-    colunas = ["user_id", "name", "role", "course_id", "course_name", "access_time", "time_updated"]
-    return [dict(zip(colunas, row)) for row in rows]
\ No newline at end of file
+    colunas = ["semana", "total"]
+    return [dict(zip(colunas, row)) for row in rows]
+
+# Último acesso (epoch) de um utilizador a uma UC; None se nunca acedeu
+def fetch_ultimo_acesso_local(user_id, course_id):
+    conn = connect_to_uni_analytics_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT MAX(access_time)
+        FROM course_access_logs
+        WHERE course_id = ? AND user_id = ?
+    """, (course_id, user_id))
+    (ultimo,) = cursor.fetchone()
+    conn.close()
+    return ultimo
@@ -0,0 +1,147 @@
+import os
+from datetime import datetime
+from db.uniAnalytics import connect_to_uni_analytics_db
+from utils.logger import logger
+from queries.queriesComuns import fetch_course_change_indicators
+from queries.syncLoader import hash_linha, criar_tabela_sombra
+
+# Deteção de alterações por curso: antes do sync calcula-se uma impressão digital de cada curso no Moodle
+# e as tabelas com carga completa só voltam a extrair os cursos cuja impressão mudou desde o seu último sync.
+# Os dados dos restantes cursos são copiados da geração anterior da tabela local.
+
+# Ativa a deteção de alterações por curso (0 volta a extrair todos os cursos em todas as execuções)
+SYNC_DETETAR_ALTERACOES = os.getenv("SYNC_DETETAR_ALTERACOES", "1") == "1"
+
+# Calcula as impressões digitais atuais dos cursos no Moodle: {course_id: (fingerprint, max_log_id)}.
+# O log só é lido desde o menor max_log_id guardado entre as tabelas, pelo que max_log_id é 0 nos cursos sem eventos novos.
+# Devolve None se a deteção estiver desativada ou falhar (nesse caso todas as tabelas extraem todos os cursos).
+def calcular_impressoes_cursos():
+    if not SYNC_DETETAR_ALTERACOES:
+        return None
+
+    try:
+        conn_local = connect_to_uni_analytics_db()
+        cursor_local = conn_local.cursor()
+        cursor_local.execute("""
+            SELECT COALESCE(MIN(max_log_id), 0)
+            FROM (SELECT MAX(max_log_id) AS max_log_id FROM course_fingerprints GROUP BY table_name)
+        """)
+        desde_log_id = cursor_local.fetchone()[0]
+        conn_local.close()
+
+        fontes = {}
+        max_log = {}
+        for course_id, fonte, valor, total in fetch_course_change_indicators(desde_log_id):
+            if fonte == "log":
+                max_log[course_id] = valor
+            else:
+                fontes.setdefault(course_id, []).append((fonte, valor, total))
+
+        impressoes = {
+            course_id: (hash_linha(sorted(valores)), max_log.get(course_id, 0))
+            for course_id, valores in fontes.items()
+        }
+        logger.info(f"[SYNC] Impressões digitais calculadas para {len(impressoes)} cursos (log id > {desde_log_id}).")
+        return impressoes
+    except Exception as e:
+        logger.exception(f"[SYNC] Erro ao calcular as impressões digitais dos cursos, todos os cursos serão extraídos: {str(e)}")
+        return None
+
+# Apaga as impressões guardadas, para que a próxima execução extraia todos os cursos (reconstrução completa)
+def limpar_impressoes():
+    conn_local = connect_to_uni_analytics_db()
+    conn_local.execute("DELETE FROM course_fingerprints")
+    conn_local.commit()
+    conn_local.close()
+
+# Devolve a lista de cursos a extrair para uma tabela, comparando as impressões atuais com as guardadas:
+# cursos novos, cursos cuja impressão mudou, cursos com eventos novos no log e cursos que deixaram de existir.
+# Devolve None (extrair todos os cursos) se não houver impressões, na reconstrução completa ou no primeiro sync da tabela.
+def cursos_a_sincronizar(cursor_local, tabela, impressoes, reconstrucao_completa=False):
+    if impressoes is None or reconstrucao_completa:
+        return None
+
+    cursor_local.execute(
+        "SELECT course_id, fingerprint, max_log_id FROM course_fingerprints WHERE table_name = ?", (tabela,)
+    )
+    guardadas = {course_id: (fingerprint, max_log_id) for course_id, fingerprint, max_log_id in cursor_local.fetchall()}
+    if not guardadas:
+        return None
+
+    alterados = [
+        course_id for course_id, (fingerprint, max_log_id) in impressoes.items()
+        if course_id not in guardadas
+        or guardadas[course_id][0] != fingerprint
+        or max_log_id > guardadas[course_id][1]
+    ]
+    alterados += [course_id for course_id in guardadas if course_id not in impressoes]
+    return sorted(alterados)
+
+# Versão de cursos_a_sincronizar com uma ligação local própria (usada pelas threads de extração do modo paralelo)
+def cursos_a_sincronizar_local(tabela, impressoes, reconstrucao_completa=False):
+    conn_local = connect_to_uni_analytics_db()
+    cursos = cursos_a_sincronizar(conn_local.cursor(), tabela, impressoes, reconstrucao_completa)
+    conn_local.close()
+    return cursos
+
+# Guarda as impressões de uma tabela após um sync bem sucedido (não faz commit: corre na transação da troca)
+def guardar_impressoes(cursor_local, tabela, impressoes):
+    if impressoes is None:
+        return
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    cursor_local.executemany("""
+        INSERT INTO course_fingerprints (table_name, course_id, fingerprint, max_log_id, time_updated)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(table_name, course_id) DO UPDATE SET
+            fingerprint = excluded.fingerprint,
+            max_log_id = MAX(max_log_id, excluded.max_log_id),
+            time_updated = excluded.time_updated
+    """, [(tabela, course_id, fingerprint, max_log_id, now) for course_id, (fingerprint, max_log_id) in impressoes.items()])
+
+    # Cursos que deixaram de existir no Moodle
+    cursor_local.execute("CREATE TEMP TABLE IF NOT EXISTS cursos_impressoes (course_id INTEGER PRIMARY KEY)")
+    cursor_local.execute("DELETE FROM temp.cursos_impressoes")
+    cursor_local.executemany("INSERT INTO temp.cursos_impressoes VALUES (?)", [(c,) for c in impressoes])
+    cursor_local.execute("""
+        DELETE FROM course_fingerprints
+        WHERE table_name = ? AND course_id NOT IN (SELECT course_id FROM temp.cursos_impressoes)
+    """, (tabela,))
+
+# Copia para a tabela sombra as linhas da geração atual dos cursos que não vão ser extraídos de novo
+def copiar_cursos_inalterados(cursor_local, tabela, sombra, cursos):
+    cursor_local.execute("CREATE TEMP TABLE IF NOT EXISTS cursos_alterados (course_id INTEGER PRIMARY KEY)")
+    cursor_local.execute("DELETE FROM temp.cursos_alterados")
+    cursor_local.executemany("INSERT INTO temp.cursos_alterados VALUES (?)", [(c,) for c in cursos])
+    cursor_local.execute(f"""
+        INSERT INTO {sombra}
+        SELECT * FROM {tabela}
+        WHERE course_id NOT IN (SELECT course_id FROM temp.cursos_alterados)
+    """)
+    copiados = cursor_local.rowcount
+    cursor_local.connection.commit()
+    return copiados
+
+# Apaga da tabela as linhas dos cursos indicados, sem confirmar: a transação é confirmada com as linhas novas
+# desses cursos, pelo que os dashboards nunca veem os cursos vazios. Devolve o número de linhas apagadas.
+def apagar_cursos(cursor_local, tabela, cursos):
+    cursor_local.execute("CREATE TEMP TABLE IF NOT EXISTS cursos_alterados (course_id INTEGER PRIMARY KEY)")
+    cursor_local.execute("DELETE FROM temp.cursos_alterados")
+    cursor_local.executemany("INSERT INTO temp.cursos_alterados VALUES (?)", [(c,) for c in cursos])
+    cursor_local.execute(f"DELETE FROM {tabela} WHERE course_id IN (SELECT course_id FROM temp.cursos_alterados)")
+    return cursor_local.rowcount
+
+# Cria a tabela sombra de uma tabela com carga completa e, se só alguns cursos vão ser extraídos,
+# copia para ela as linhas dos restantes cursos. Devolve o nome da tabela sombra.
+def criar_sombra_com_inalterados(cursor_local, tabela, cursos):
+    sombra = criar_tabela_sombra(cursor_local, tabela)
+    if cursos is not None:
+        copiados = copiar_cursos_inalterados(cursor_local, tabela, sombra, cursos)
+        logger.info(f"[SYNC][{tabela.upper()}] {len(cursos)} cursos alterados a extrair; {copiados} registos dos restantes cursos mantidos.")
+    return sombra
+
+# Corre uma extração limitada aos cursos indicados (usada pelas threads de extração do modo paralelo).
+# Sem cursos alterados não consulta o Moodle.
+def extrair_cursos(extrair, cursos):
+    if cursos == []:
+        return []
+    return extrair(cursos)
@@ -1,336 +1,784 @@
+import os
+import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from db.moodleConnection import obter_metricas_pool
 from db.uniAnalytics import connect_to_uni_analytics_db
 from utils.logger import logger
+from utils.tempo import epoch_agora, para_epoch
+from queries.syncLoader import (
+    carregar_em_lote, carregar_com_checkpoint, criar_tabela_sombra, trocar_tabela_sombra, nome_tabela_sombra,
+    existe_tabela, hash_linha, sincronizar_por_hash
+)
+from queries.syncAlteracoes import (
+    calcular_impressoes_cursos, limpar_impressoes, cursos_a_sincronizar, cursos_a_sincronizar_local, guardar_impressoes,
+    criar_sombra_com_inalterados, apagar_cursos, extrair_cursos
+)
+from queries.categorias import codificador
+from queries.syncTelemetry import (
+    telemetria_sync, telemetria_execucao, extrair_medido, registar_extracao_previa, registar_falha_extracao,
+    falhas_execucao
+)
 from queries.queriesAluno import *
 from queries.queriesComuns import *
 from queries.formsComuns import *
 from queries.queriesProfessor import *
 
+# Forma de ingestão das interações: detalhe (um registo por evento em interacao), agregado (totais diários em
+# interacao_diaria, agregados no Moodle) ou ambos
+SYNC_INTERACAO_MODO = os.getenv("SYNC_INTERACAO_MODO", "detalhe").lower()
+
+# Dias durante os quais as alterações ficam guardadas no change feed (grade_progress_changes)
+SYNC_CHANGES_RETENTION_DAYS = int(os.getenv("SYNC_CHANGES_RETENTION_DAYS", "30"))
+
+# Tempo máximo (ms) da query dos cursos alterados de cada micro-lote, que lê por completo as tabelas de conclusões,
+# notas e roles do Moodle (0 = sem limite)
+SYNC_MICRO_ALTERACOES_MAX_MS = int(os.getenv("SYNC_MICRO_ALTERACOES_MAX_MS", "10000"))
+
+# Devolve o último id de origem ingerido para uma tabela (None se nunca houve sincronização incremental)
+def obter_watermark(cursor_local, tabela):
+    cursor_local.execute("SELECT last_id FROM sync_state WHERE table_name = ?", (tabela,))
+    resultado = cursor_local.fetchone()
+    return resultado[0] if resultado else None
+
+# Guarda o último id de origem ingerido para uma tabela (não faz commit)
+def guardar_watermark(cursor_local, tabela, last_id):
+    cursor_local.execute("""
+        INSERT INTO sync_state (table_name, last_id, time_updated)
+        VALUES (?, ?, ?)
+        ON CONFLICT(table_name) DO UPDATE SET
+            last_id = excluded.last_id,
+            time_updated = excluded.time_updated
+    """, (tabela, last_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+# Determina a partir de que log id se extrai uma tabela incremental. Devolve (desde_id, reconstrucao_completa).
+# Sem watermark os dados locais (se existirem) vêm de uma carga completa antiga, pelo que se reconstrói.
+def resolver_desde_id(cursor_local, tabela, reconstrucao_completa):
+    desde_id = None if reconstrucao_completa else obter_watermark(cursor_local, tabela)
+    if desde_id is None:
+        return 0, True
+    return desde_id, False
+
+# Devolve o último log id confirmado na tabela sombra de uma reconstrução completa interrompida (None se não houver)
+def obter_checkpoint(cursor_local, tabela):
+    cursor_local.execute("SELECT last_id FROM sync_checkpoints WHERE table_name = ?", (tabela,))
+    resultado = cursor_local.fetchone()
+    return resultado[0] if resultado else None
+
+# Guarda o último log id confirmado na tabela sombra de uma reconstrução completa (não faz commit)
+def guardar_checkpoint(cursor_local, tabela, last_id):
+    agora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    cursor_local.execute("""
+        INSERT INTO sync_checkpoints (table_name, last_id, started_at, time_updated)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(table_name) DO UPDATE SET
+            last_id = excluded.last_id,
+            time_updated = excluded.time_updated
+    """, (tabela, last_id, agora, agora))
+
+# Apaga o checkpoint de uma tabela (não faz commit)
+def apagar_checkpoint(cursor_local, tabela):
+    cursor_local.execute("DELETE FROM sync_checkpoints WHERE table_name = ?", (tabela,))
+
+# Determina como arranca o sync de uma tabela incremental carregada por blocos.
+# Devolve (desde_id, reconstrucao_completa, retomar): se uma reconstrução completa anterior foi interrompida
+# (há checkpoint e a tabela sombra ainda existe), retoma-a a partir do checkpoint, mesmo que não tenha sido pedida.
+def resolver_inicio(cursor_local, tabela, reconstrucao_completa):
+    checkpoint = obter_checkpoint(cursor_local, tabela)
+    if checkpoint is not None and existe_tabela(cursor_local, nome_tabela_sombra(tabela)):
+        return checkpoint, True, True
+    desde_id, reconstrucao_completa = resolver_desde_id(cursor_local, tabela, reconstrucao_completa)
+    return desde_id, reconstrucao_completa, False
+
+# Prepara o destino da carga por blocos de uma tabela incremental e devolve (destino, ao_confirmar, estado).
+# No modo incremental os blocos são acrescentados à tabela real e cada commit avança a watermark.
+# Na reconstrução completa vão para a tabela sombra e cada commit avança o checkpoint; a watermark só é
+# gravada na troca (ver concluir_carga_por_blocos).
+def preparar_carga_por_blocos(cursor_local, tabela, desde_id, reconstrucao_completa, retomar):
+    estado = {"ultimo_id": desde_id}
+
+    if not reconstrucao_completa:
+        def ao_confirmar(cursor, ultimo_id):
+            estado["ultimo_id"] = ultimo_id
+            guardar_watermark(cursor, tabela, ultimo_id)
+        return tabela, ao_confirmar, estado
+
+    destino = criar_tabela_sombra(cursor_local, tabela, reutilizar=retomar)
+    if retomar:
+        logger.info(f"[SYNC][{tabela.upper()}] A retomar a reconstrução completa interrompida a partir do log id {desde_id}.")
+    else:
+        guardar_checkpoint(cursor_local, tabela, desde_id)
+        cursor_local.connection.commit()
+
+    def ao_confirmar(cursor, ultimo_id):
+        estado["ultimo_id"] = ultimo_id
+        guardar_checkpoint(cursor, tabela, ultimo_id)
+    return destino, ao_confirmar, estado
+
+# Termina a carga por blocos: na reconstrução completa troca a tabela sombra e, na mesma transação,
+# grava a watermark e apaga o checkpoint. Devolve o último log id ingerido.
+def concluir_carga_por_blocos(cursor_local, tabela, reconstrucao_completa, estado):
+    ultimo_id = estado["ultimo_id"]
+    if reconstrucao_completa:
+        def antes_de_confirmar(cursor):
+            guardar_watermark(cursor, tabela, ultimo_id)
+            apagar_checkpoint(cursor, tabela)
+        trocar_tabela_sombra(cursor_local, tabela, antes_de_confirmar=antes_de_confirmar)
+    return ultimo_id
+
 # Função para sincronizar os dados dos fóruns
-def sync_forum_data():
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+def sync_forum_data(dados=None, impressoes=None):
+    now = epoch_agora()
 
     try:
-        logger.debug("[SYNC] A obter dados dos fóruns a partir do Moodle...")
-        dados = fetch_all_forum_posts()
-        
-        conn_local = connect_to_uni_analytics_db()
-        cursor_local = conn_local.cursor()
-        cursor_local.execute("DELETE FROM forum")
-
-        inseridos = 0
-        ignorados = 0
+        with telemetria_sync("forum") as metricas, closing(connect_to_uni_analytics_db()) as conn_local:
+            cursor_local = conn_local.cursor()
+
+            # Só se extraem os cursos alterados desde o último sync (None = todos)
+            cursos = cursos_a_sincronizar(cursor_local, "forum", impressoes)
+            if cursos == []:
+                logger.info("[SYNC] Forum: nenhum curso alterado, sincronização ignorada.")
+                return
+
+            logger.debug("[SYNC] A obter dados dos fóruns a partir do Moodle...")
+            dados = extrair_medido(metricas, dados, fetch_all_forum_posts, cursos)
+
+            sombra = criar_sombra_com_inalterados(cursor_local, "forum", cursos)
+            codificar_role = codificador(cursor_local, "role")
+
+            inseridos, ignorados = metricas["rows_inserted"], metricas["rows_ignored"] = carregar_em_lote(
+                cursor_local, sombra,
+                ["post_id", "user_id", "role", "course_id", "post_type", "parent", "time_created", "time_updated"],
+                (
+                    (row["post_id"], row["user_id"], codificar_role(row["role"]), row["course_id"],
+                     row["post_type"], row["parent"], row["time_created"], now)
+                    for row in dados
+                ),
+                commit_por_lote=True
+            )
 
-        for row in dados:
-            try:
-                logger.debug(f"[SYNC][FORUM] Inserir: user_id={row['user_id']}, role={row['role']}, course_id={row['course_id']}, post_type={row['post_type']}, time_created={row['time_created']}")
-                cursor_local.execute("""
-                    INSERT INTO forum (
-                        post_id, user_id, role, course_id, post_type, parent, time_created, time_updated
-                    )
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    row["post_id"],
-                    row["user_id"],
-                    row["role"],
-                    row["course_id"],
-                    row["post_type"],
-                    row["parent"],                   
-                    row["time_created"],
-                    now # last_updated
-                ))
-                inseridos += 1
-            except Exception as item_error:
-                ignorados += 1
-                logger.warning(f"[SYNC][FORUM] Registo ignorado por erro: {str(item_error)} | Dados: {row}")
-
-        conn_local.commit()
-        conn_local.close()
-        logger.info(f"[SYNC] Forum sincronizado com {inseridos} registos. Ignorados: {ignorados}.")
+            trocar_tabela_sombra(
+                cursor_local, "forum",
+                antes_de_confirmar=lambda cursor: guardar_impressoes(cursor, "forum", impressoes)
+            )
+            logger.info(f"[SYNC] Forum sincronizado com {inseridos} registos. Ignorados: {ignorados}.")
     except Exception as e:
         logger.exception(f"[SYNC] Erro ao sincronizar dados de forum: {str(e)}")
 
+# Função para acrescentar ao forum os posts novos (id superior ao maior post_id local), usada no micro-lote.
+# O sync completo carrega todos os posts dos cursos alterados, pelo que o maior post_id local é um ponto de
+# partida seguro; as edições e remoções de posts só são reconciliadas no sync completo.
+def sync_forum_novos():
+    now = epoch_agora()
+
+    try:
+        with telemetria_sync("forum") as metricas, closing(connect_to_uni_analytics_db()) as conn_local:
+            cursor_local = conn_local.cursor()
+
+            cursor_local.execute("SELECT COALESCE(MAX(post_id), 0) FROM forum")
+            (desde_post_id,) = cursor_local.fetchone()
+
+            logger.debug(f"[SYNC] A obter posts novos dos fóruns a partir do Moodle (post id > {desde_post_id})...")
+            dados = extrair_medido(metricas, None, fetch_all_forum_posts, None, desde_post_id)
+            codificar_role = codificador(cursor_local, "role")
+
+            inseridos, ignorados = metricas["rows_inserted"], metricas["rows_ignored"] = carregar_em_lote(
+                cursor_local, "forum",
+                ["post_id", "user_id", "role", "course_id", "post_type", "parent", "time_created", "time_updated"],
+                (
+                    (row["post_id"], row["user_id"], codificar_role(row["role"]), row["course_id"],
+                     row["post_type"], row["parent"], row["time_created"], now)
+                    for row in dados
+                ),
+                em_conflito="ON CONFLICT(post_id) DO NOTHING"
+            )
+            conn_local.commit()
+            logger.info(f"[SYNC] Forum: {inseridos} posts novos acrescentados. Ignorados: {ignorados}.")
+    except Exception as e:
+        logger.exception(f"[SYNC] Erro ao acrescentar posts novos do forum: {str(e)}")
+
 # Função para sincronizar os dados de interações
-def sync_interacao_data():
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+# Por omissão é incremental: só acrescenta os registos do log com id superior à watermark guardada em sync_state.
+# Com reconstrucao_completa=True volta a importar todo o histórico para uma tabela sombra.
+# A carga é feita em blocos de log ids, cada um confirmado com o seu ponto de retoma (watermark ou checkpoint),
+# pelo que um sync interrompido continua no bloco seguinte ao último confirmado.
+# Se dados vier preenchido (modo paralelo), usa os dados já extraídos a partir do mesmo desde_id.
+def sync_interacao_data(reconstrucao_completa=False, dados=None):
+    now = epoch_agora()
 
     try:
-        logger.debug("[SYNC] A obter dados de interações a partir do Moodle...")
-        dados = fetch_all_interacoes()
-        
-        conn_local = connect_to_uni_analytics_db()
-        cursor_local = conn_local.cursor()
-        cursor_local.execute("DELETE FROM interacao")
+        with telemetria_sync("interacao") as metricas, closing(connect_to_uni_analytics_db()) as conn_local:
+            cursor_local = conn_local.cursor()
 
-        inseridos = 0
-        ignorados = 0
+            desde_id, reconstrucao_completa, retomar = resolver_inicio(cursor_local, "interacao", reconstrucao_completa)
 
-        for row in dados:
-            try:
-                logger.debug(f"[SYNC][INTERACAO] Inserir: user_id={row['user_id']}, course_id={row['course_id']}, tipo_interacao={row['tipo_interacao']}, time_created={row['time_created']}")
-                cursor_local.execute("""
-                    INSERT INTO interacao (
-                        user_id, course_id, tipo_interacao, time_created, time_updated
-                    )
-                    VALUES (?, ?, ?, ?, ?)
-                """, (
-                    row["user_id"],
-                    row["course_id"],
-                    row["tipo_interacao"],
-                    row["time_created"],
-                    now
-                ))
-                inseridos += 1
-            except Exception as item_error:
-                ignorados += 1
-                logger.warning(f"[SYNC][INTERACAO] Registo ignorado por erro: {str(item_error)} | Dados: {row}")
-
-        conn_local.commit()
-        conn_local.close()
-        logger.info(f"[SYNC] Interações sincronizadas com {inseridos} registos. Ignorados: {ignorados}.")
+            logger.debug(f"[SYNC] A obter dados de interações a partir do Moodle (log id > {desde_id})...")
+            dados = extrair_medido(metricas, dados, fetch_all_interacoes, desde_id)
+
+            destino, ao_confirmar, estado = preparar_carga_por_blocos(
+                cursor_local, "interacao", desde_id, reconstrucao_completa, retomar
+            )
+            codificar_tipo = codificador(cursor_local, "tipo_interacao")
+
+            inseridos, ignorados = metricas["rows_inserted"], metricas["rows_ignored"] = carregar_com_checkpoint(
+                cursor_local, destino,
+                ["user_id", "course_id", "tipo_interacao", "time_created", "time_updated"],
+                dados,
+                lambda row: [(row["user_id"], row["course_id"], codificar_tipo(row["tipo_interacao"]), row["time_created"], now)],
+                "log_id", ao_confirmar
+            )
+
+            ultimo_id = concluir_carga_por_blocos(cursor_local, "interacao", reconstrucao_completa, estado)
+            modo = "reconstrução completa" if reconstrucao_completa else "incremental"
+            logger.info(f"[SYNC] Interações sincronizadas ({modo}) com {inseridos} registos. Ignorados: {ignorados}. Último log id: {ultimo_id}.")
     except Exception as e:
         logger.exception(f"[SYNC] Erro ao sincronizar dados de interações: {str(e)}")
 
-# Função para sincronizar os dados de progresso e notas
-def sync_grade_progress_data():
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+# Função para sincronizar as interações agregadas por utilizador, curso, tipo e dia (tabela interacao_diaria)
+# A agregação é feita no MySQL; no modo incremental os totais dos eventos novos (log id > watermark) são somados
+# aos totais já existentes do mesmo dia. Com reconstrucao_completa=True reconstrói a tabela numa tabela sombra.
+# Se dados vier preenchido (modo paralelo), usa os dados já extraídos a partir do mesmo desde_id.
+def sync_interacao_diaria(reconstrucao_completa=False, dados=None):
+    now = epoch_agora()
 
     try:
-        logger.debug("[SYNC] A obter dados de progresso a partir do Moodle...")
-        dados = fetch_all_grade_progress()
-        
-        conn_local = connect_to_uni_analytics_db()
-        cursor_local = conn_local.cursor()
-        cursor_local.execute("DELETE FROM grade_progress")
+        with telemetria_sync("interacao_diaria") as metricas, closing(connect_to_uni_analytics_db()) as conn_local:
+            cursor_local = conn_local.cursor()
 
-        inseridos = 0
-        ignorados = 0
+            desde_id, reconstrucao_completa = resolver_desde_id(cursor_local, "interacao_diaria", reconstrucao_completa)
 
-        for row in dados:
-            try:
-                logger.debug(
-                    f"[SYNC][GRADE_PROGRESS] Inserir: user_id={row['user_id']}, course_id={row['course_id']}, "
-                    f"module_type={row['module_type']}, item_name={row['item_name']}, final_grade={row['final_grade']}, "
-                    f"group={row['group_name']}, time_created={row['time_created']}"
-                )
+            logger.debug(f"[SYNC] A obter interações agregadas a partir do Moodle (log id > {desde_id})...")
+            dados = extrair_medido(metricas, dados, fetch_interacoes_diarias, desde_id)
+
+            destino = criar_tabela_sombra(cursor_local, "interacao_diaria") if reconstrucao_completa else "interacao_diaria"
 
-                cursor_local.execute("""
-                    INSERT INTO grade_progress (
-                        course_module_id, course_id, module_type, user_id,
-                        completion_state, item_name, group_id, group_name,
-                        final_grade, time_created, time_updated
+            estado = {"ultimo_id": desde_id}
+            codificar_tipo = codificador(cursor_local, "tipo_interacao")
+
+            def linhas():
+                for row in dados:
+                    estado["ultimo_id"] = max(estado["ultimo_id"], row["max_log_id"])
+                    yield (
+                        row["user_id"], row["course_id"], codificar_tipo(row["tipo_interacao"]), para_epoch(row["dia"]),
+                        row["total"], now
                     )
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    row["course_module_id"],
-                    row["course_id"],
-                    row["module_type"],
-                    row["user_id"],
-                    row["completion_state"],
-                    row["item_name"],
-                    row["group_id"],
-                    row["group_name"],
-                    float(row["final_grade"]) if row["final_grade"] is not None else None,
-                    row["time_created"],
-                    now
-                ))
-                inseridos += 1
-            except Exception as item_error:
-                ignorados += 1
-                logger.warning(f"[SYNC][GRADE_PROGRESS] Registo ignorado por erro: {str(item_error)} | Dados: {row}")
-
-        conn_local.commit()
-        conn_local.close()
-        logger.info(f"[SYNC] Grade progress sincronizado com {inseridos} registos. Ignorados: {ignorados}.")
+
+            inseridos, ignorados = metricas["rows_inserted"], metricas["rows_ignored"] = carregar_em_lote(
+                cursor_local, destino,
+                ["user_id", "course_id", "tipo_interacao", "dia", "total", "time_updated"],
+                linhas(),
+                commit_por_lote=reconstrucao_completa,
+                em_conflito=(
+                    "ON CONFLICT(user_id, course_id, tipo_interacao, dia) DO UPDATE SET "
+                    "total = total + excluded.total, time_updated = excluded.time_updated"
+                )
+            )
+
+            ultimo_id = estado["ultimo_id"]
+            if reconstrucao_completa:
+                trocar_tabela_sombra(
+                    cursor_local, "interacao_diaria",
+                    antes_de_confirmar=lambda cursor: guardar_watermark(cursor, "interacao_diaria", ultimo_id)
+                )
+            else:
+                guardar_watermark(cursor_local, "interacao_diaria", ultimo_id)
+                conn_local.commit()
+            modo = "reconstrução completa" if reconstrucao_completa else "incremental"
+            logger.info(f"[SYNC] Interações diárias sincronizadas ({modo}) com {inseridos} totais. Ignorados: {ignorados}. Último log id: {ultimo_id}.")
     except Exception as e:
-        logger.exception(f"[SYNC] Erro ao sincronizar dados de grade_progress: {str(e)}")
+        logger.exception(f"[SYNC] Erro ao sincronizar interações diárias: {str(e)}")
+
+# Linhas de versões anteriores (sem hash) não podem ser comparadas: nesse caso (ou com a tabela vazia) reconstrói-se a tabela
+def grade_progress_requer_reconstrucao(cursor_local):
+    cursor_local.execute("SELECT COUNT(*), COUNT(row_hash) FROM grade_progress")
+    total_local, com_hash = cursor_local.fetchone()
+    return total_local == 0 or com_hash < total_local
+
+# Cursos a extrair para grade_progress, com uma ligação local própria (usada pelas threads de extração do modo paralelo)
+def cursos_grade_progress_local(impressoes, reconstrucao_completa):
+    conn_local = connect_to_uni_analytics_db()
+    cursor_local = conn_local.cursor()
+    reconstrucao_completa = reconstrucao_completa or grade_progress_requer_reconstrucao(cursor_local)
+    cursos = cursos_a_sincronizar(cursor_local, "grade_progress", impressoes, reconstrucao_completa)
+    conn_local.close()
+    return cursos
 
-# Função para sincronizar os dados dos e-fólios
-def sync_efolios_data():
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+# Função para sincronizar os dados de progresso e notas
+# Por omissão sincroniza por diferenças: cada linha (chave course_module_id + user_id) leva um hash do seu conteúdo
+# e só as linhas novas, alteradas ou desaparecidas são escritas, ficando registadas em grade_progress_changes.
+# Com reconstrucao_completa=True (ou com a tabela vazia / sem hashes) carrega tudo numa tabela sombra e troca-a.
+# cursos indica diretamente os cursos a sincronizar por diferenças (micro-lote); nesse caso nunca reconstrói.
+def sync_grade_progress_data(reconstrucao_completa=False, dados=None, impressoes=None, cursos=None):
+    now = epoch_agora()
 
     try:
-        logger.debug("[SYNC] A obter e-fólios a partir do Moodle...")
-        dados = fetch_all_efolios()
+        with telemetria_sync("grade_progress") as metricas, closing(connect_to_uni_analytics_db()) as conn_local:
+            cursor_local = conn_local.cursor()
+
+            reconstrucao_completa = reconstrucao_completa or grade_progress_requer_reconstrucao(cursor_local)
+
+            if cursos is not None and reconstrucao_completa:
+                logger.info("[SYNC] Grade progress: requer reconstrução completa, fica para o sync completo.")
+                return
+
+            # Só se extraem os cursos alterados desde o último sync (None = todos)
+            if cursos is None:
+                cursos = cursos_a_sincronizar(cursor_local, "grade_progress", impressoes, reconstrucao_completa)
+            if cursos == []:
+                logger.info("[SYNC] Grade progress: nenhum curso alterado, sincronização ignorada.")
+                return
+
+            logger.debug("[SYNC] A obter dados de progresso a partir do Moodle...")
+            dados = extrair_medido(metricas, dados, fetch_all_grade_progress, cursos)
+
+            colunas = [
+                "course_module_id", "course_id", "module_type", "user_id",
+                "completion_state", "item_name", "group_id", "group_name",
+                "final_grade", "time_created", "row_hash"
+            ]
+            estado = {"duplicados": 0}
+            codificar_modulo = codificador(cursor_local, "module_type")
+            codificar_grupo = codificador(cursor_local, "group_name")
+
+            # Um aluno em mais do que um grupo do curso aparece repetido na extração: fica a primeira linha de cada chave.
+            # O hash é calculado sobre o texto de module_type e group_name (não depende dos códigos atribuídos).
+            def linhas():
+                vistos = set()
+                for row in dados:
+                    chave = (row["course_module_id"], row["user_id"])
+                    if chave in vistos:
+                        estado["duplicados"] += 1
+                        continue
+                    vistos.add(chave)
+                    final_grade = float(row["final_grade"]) if row["final_grade"] is not None else None
+                    valores = (
+                        row["course_module_id"], row["course_id"], row["module_type"], row["user_id"],
+                        row["completion_state"], row["item_name"], row["group_id"], row["group_name"],
+                        final_grade, row["time_created"]
+                    )
+                    yield (
+                        row["course_module_id"], row["course_id"], codificar_modulo(row["module_type"]), row["user_id"],
+                        row["completion_state"], row["item_name"], row["group_id"], codificar_grupo(row["group_name"]),
+                        final_grade, row["time_created"], hash_linha(valores)
+                    )
 
-        conn_local = connect_to_uni_analytics_db()
-        cursor_local = conn_local.cursor()
-        cursor_local.execute("DELETE FROM efolios")
+            if reconstrucao_completa:
+                sombra = criar_tabela_sombra(cursor_local, "grade_progress")
+                inseridos, ignorados = metricas["rows_inserted"], metricas["rows_ignored"] = carregar_em_lote(
+                    cursor_local, sombra,
+                    colunas + ["time_updated"],
+                    (linha + (now,) for linha in linhas()),
+                    commit_por_lote=True
+                )
 
-        inseridos = 0
-        ignorados = 0
+                # Na carga completa o change feed recebe um único marcador: os agregados a jusante recalculam tudo
+                def antes_de_confirmar(cursor):
+                    cursor.execute(
+                        "INSERT INTO grade_progress_changes (change_type, changed_at) VALUES ('reconstrucao', ?)", (now,)
+                    )
+                    guardar_impressoes(cursor, "grade_progress", impressoes)
 
-        for row in dados:
-            try:
-                logger.debug(
-                    f"[SYNC][EFOLIOS] Inserir: item_id={row['item_id']}, "
-                    f"name={row['name']}, course_id={row['course_id']}, "
-                    f"course_name={row['course_name']}, start={row['start_date']}, end={row['end_date']}, created={row['time_created']}"
+                trocar_tabela_sombra(cursor_local, "grade_progress", antes_de_confirmar=antes_de_confirmar)
+                logger.info(
+                    f"[SYNC] Grade progress sincronizado (reconstrução completa) com {inseridos} registos. "
+                    f"Ignorados: {ignorados}. Duplicados: {estado['duplicados']}."
                 )
-                cursor_local.execute("""
-                    INSERT INTO efolios (
-                        item_id, name, course_id, course_name, start_date, end_date,
-                        available_pre, available_pos, time_created, time_updated
-                    )
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    row["item_id"],
-                    row["name"],
-                    row["course_id"],
-                    row["course_name"],
-                    row["start_date"],
-                    row["end_date"],
-                    0,  # available_pre
-                    0,  # available_pos
-                    row["time_created"],  # time_created da origem
-                    now  # time_updated no momento da sincronização
-                ))
-                inseridos += 1
-            except Exception as item_error:
-                ignorados += 1
-                logger.warning(f"[SYNC][EFOLIOS] Registo ignorado por erro: {str(item_error)} | Dados: {row}")
-
-        conn_local.commit()
-        conn_local.close()
-        logger.info(f"[SYNC] E-fólios sincronizados com {inseridos} registos. Ignorados: {ignorados}.")
+            else:
+                contagens, ignorados = sincronizar_por_hash(
+                    cursor_local, "grade_progress", ["course_module_id", "user_id"], colunas, linhas(),
+                    "grade_progress_changes", ["course_module_id", "user_id", "course_id"], now,
+                    cursos=cursos,
+                    antes_de_confirmar=lambda cursor: guardar_impressoes(cursor, "grade_progress", impressoes)
+                )
+                metricas["rows_inserted"] = contagens["inseridos"]
+                metricas["rows_updated"] = contagens["atualizados"]
+                metricas["rows_unchanged"] = contagens["inalterados"]
+                metricas["rows_deleted"] = contagens["apagados"]
+                metricas["rows_ignored"] = ignorados
+                logger.info(
+                    f"[SYNC] Grade progress sincronizado por diferenças: {contagens['inseridos']} inseridos, "
+                    f"{contagens['atualizados']} atualizados, {contagens['inalterados']} inalterados, "
+                    f"{contagens['apagados']} apagados. Ignorados: {ignorados}. Duplicados: {estado['duplicados']}."
+                )
+
+            # O change feed só guarda as alterações dos últimos SYNC_CHANGES_RETENTION_DAYS dias
+            cursor_local.execute(
+                "DELETE FROM grade_progress_changes WHERE changed_at < ?",
+                (now - SYNC_CHANGES_RETENTION_DAYS * 86400,)
+            )
+            conn_local.commit()
     except Exception as e:
-        logger.exception(f"[SYNC] Erro ao sincronizar dados de e-fólios: {str(e)}")
+        logger.exception(f"[SYNC] Erro ao sincronizar dados de grade_progress: {str(e)}")
 
-# Função para sincronizar os dados dos cursos e utilizadores
-def sync_user_course_data():
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+# Função para sincronizar os dados dos e-fólios
+def sync_efolios_data(dados=None, impressoes=None):
+    now = epoch_agora()
 
     try:
-        logger.debug("[SYNC] A obter dados de cursos e utilizadores a partir do Moodle...")
-        dados = fetch_all_user_course_data()
+        with telemetria_sync("efolios") as metricas, closing(connect_to_uni_analytics_db()) as conn_local:
+            cursor_local = conn_local.cursor()
+
+            # Só se extraem os cursos alterados desde o último sync (None = todos)
+            cursos = cursos_a_sincronizar(cursor_local, "efolios", impressoes)
+            if cursos == []:
+                logger.info("[SYNC] E-fólios: nenhum curso alterado, sincronização ignorada.")
+                return
+
+            logger.debug("[SYNC] A obter e-fólios a partir do Moodle...")
+            dados = extrair_medido(metricas, dados, fetch_all_efolios, cursos)
+
+            sombra = criar_sombra_com_inalterados(cursor_local, "efolios", cursos)
+
+            inseridos, ignorados = metricas["rows_inserted"], metricas["rows_ignored"] = carregar_em_lote(
+                cursor_local, sombra,
+                [
+                    "item_id", "name", "course_id", "course_name", "start_date", "end_date",
+                    "time_created", "time_updated"
+                ],
+                (
+                    (row["item_id"], row["name"], row["course_id"], row["course_name"],
+                     row["start_date"], row["end_date"],
+                     row["time_created"],  # time_created da origem
+                     now)  # time_updated no momento da sincronização
+                    for row in dados
+                ),
+                commit_por_lote=True
+            )
 
-        conn_local = connect_to_uni_analytics_db()
-        cursor_local = conn_local.cursor()
-        cursor_local.execute("DELETE FROM course_data")
+            trocar_tabela_sombra(
+                cursor_local, "efolios",
+                antes_de_confirmar=lambda cursor: guardar_impressoes(cursor, "efolios", impressoes)
+            )
+            logger.info(f"[SYNC] E-fólios sincronizados com {inseridos} registos. Ignorados: {ignorados}.")
+    except Exception as e:
+        logger.exception(f"[SYNC] Erro ao sincronizar dados de e-fólios: {str(e)}")
 
-        inseridos = 0
-        ignorados = 0
+# Função para sincronizar os dados dos cursos e utilizadores
+# Com cursos indicados (micro-lote) só as linhas desses cursos são substituídas, diretamente na tabela e numa única
+# transação; a tabela sombra completa (com as impressões digitais) fica para o sync completo.
+def sync_user_course_data(dados=None, impressoes=None, cursos=None):
+    now = epoch_agora()
+    parcial = cursos is not None
 
-        for _, row in dados.iterrows():
-            try:
-                logger.debug(
-                    f"[SYNC][COURSE_DATA] Inserir: user_id={row['user_id']}, email={row['email']}, "
-                    f"name={row['name']}, role={row['role']}, course_id={row['course_id']}, "
-                    f"course_name={row['course_name']}, group_name={row['group_name']}, "
-                    f"time_created={row['time_created']}"
+    try:
+        with telemetria_sync("course_data") as metricas, closing(connect_to_uni_analytics_db()) as conn_local:
+            cursor_local = conn_local.cursor()
+
+            # Só se extraem os cursos alterados desde o último sync (None = todos), salvo se vierem indicados (micro-lote)
+            if cursos is None:
+                cursos = cursos_a_sincronizar(cursor_local, "course_data", impressoes)
+            if cursos == []:
+                logger.info("[SYNC] Dados de cursos/utilizadores: nenhum curso alterado, sincronização ignorada.")
+                return
+
+            logger.debug("[SYNC] A obter dados de cursos e utilizadores a partir do Moodle...")
+            dados = extrair_medido(metricas, dados, fetch_all_user_course_data, cursos, em_streaming=False)
+            metricas["rows_read"] = len(dados)
+
+            if parcial:
+                destino = "course_data"
+                metricas["rows_deleted"] = apagar_cursos(cursor_local, "course_data", cursos)
+            else:
+                destino = criar_sombra_com_inalterados(cursor_local, "course_data", cursos)
+
+            # Converte para tipos Python nativos (o sqlite3 não aceita numpy.int64) e NaN para NULL
+            colunas = ["user_id", "email", "name", "role", "course_id", "course_name", "group_name", "time_created"]
+            dados = dados[colunas].astype(object)
+            dados = dados.where(dados.notna(), None)
+            codificar_role = codificador(cursor_local, "role")
+            codificar_grupo = codificador(cursor_local, "group_name")
+
+            inseridos, ignorados = metricas["rows_inserted"], metricas["rows_ignored"] = carregar_em_lote(
+                cursor_local, destino,
+                colunas + ["time_updated"],
+                (
+                    (user_id, email, name, codificar_role(role), course_id, course_name, codificar_grupo(group_name),
+                     time_created, now)
+                    for user_id, email, name, role, course_id, course_name, group_name, time_created
+                    in dados.itertuples(index=False, name=None)
+                ),
+                commit_por_lote=not parcial
+            )
+
+            if parcial:
+                conn_local.commit()
+            else:
+                trocar_tabela_sombra(
+                    cursor_local, "course_data",
+                    antes_de_confirmar=lambda cursor: guardar_impressoes(cursor, "course_data", impressoes)
                 )
-                cursor_local.execute("""
-                    INSERT INTO course_data (
-                        user_id, email, name, role, course_id, course_name,
-                        group_name, time_created, time_updated
-                    )
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    row["user_id"],
-                    row["email"],
-                    row["name"],
-                    row["role"],
-                    row["course_id"],
-                    row["course_name"],
-                    row["group_name"],
-                    row["time_created"],
-                    now
-                ))
-                inseridos += 1
-            except Exception as item_error:
-                ignorados += 1
-                logger.warning(f"[SYNC][COURSE_DATA] Registo ignorado por erro: {str(item_error)} | Dados: {row.to_dict()}")
-
-        conn_local.commit()
-        conn_local.close()
-        logger.info(f"[SYNC] Dados de cursos/utilizadores sincronizados com {inseridos} registos. Ignorados: {ignorados}.")
+            logger.info(f"[SYNC] Dados de cursos/utilizadores sincronizados com {inseridos} registos. Ignorados: {ignorados}.")
     except Exception as e:
         logger.exception(f"[SYNC] Erro ao sincronizar dados de cursos/utilizadores: {str(e)}")
 
 # Função para sincronizar os conteúdos disponibilizados
-def sync_conteudos_disponibilizados():
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+def sync_conteudos_disponibilizados(dados=None, impressoes=None):
+    now = epoch_agora()
 
     try:
-        logger.debug("[SYNC] A obter conteúdos disponibilizados do Moodle...")
-        dados = fetch_all_conteudos_disponibilizados()
+        with telemetria_sync("conteudos_disponibilizados") as metricas, closing(connect_to_uni_analytics_db()) as conn_local:
+            cursor_local = conn_local.cursor()
+
+            # Só se extraem os cursos alterados desde o último sync (None = todos)
+            cursos = cursos_a_sincronizar(cursor_local, "conteudos_disponibilizados", impressoes)
+            if cursos == []:
+                logger.info("[SYNC] Conteúdos disponibilizados: nenhum curso alterado, sincronização ignorada.")
+                return
+
+            logger.debug("[SYNC] A obter conteúdos disponibilizados do Moodle...")
+            dados = extrair_medido(metricas, dados, fetch_all_conteudos_disponibilizados, cursos)
+
+            sombra = criar_sombra_com_inalterados(cursor_local, "conteudos_disponibilizados", cursos)
+            codificar_modulo = codificador(cursor_local, "module_type")
+
+            inseridos, ignorados = metricas["rows_inserted"], metricas["rows_ignored"] = carregar_em_lote(
+                cursor_local, sombra,
+                ["course_module_id", "course_id", "module_type", "time_created", "time_updated"],
+                (
+                    (row["course_module_id"], row["course_id"], codificar_modulo(row["module_type"]), row["time_created"], now)
+                    for row in dados
+                ),
+                commit_por_lote=True
+            )
 
-        conn_local = connect_to_uni_analytics_db()
-        cursor_local = conn_local.cursor()
-        cursor_local.execute("DELETE FROM conteudos_disponibilizados")
-
-        inseridos = 0
-        for row in dados:
-            logger.debug(
-                f"[SYNC][CONTEUDOS] Inserir: course_module_id={row['course_module_id']}, "
-                f"course_id={row['course_id']}, module_type={row['module_type']}, "
-                f"time_created={row['time_created']}, time_updated={now}"
+            trocar_tabela_sombra(
+                cursor_local, "conteudos_disponibilizados",
+                antes_de_confirmar=lambda cursor: guardar_impressoes(cursor, "conteudos_disponibilizados", impressoes)
             )
-            cursor_local.execute("""
-                INSERT INTO conteudos_disponibilizados (
-                    course_module_id, course_id, module_type, time_created, time_updated
-                ) VALUES (?, ?, ?, ?, ?)
-            """, (
-                row["course_module_id"],
-                row["course_id"],
-                row["module_type"],
-                row["time_created"],
-                now
-            ))
-            inseridos += 1
-
-        conn_local.commit()
-        conn_local.close()
-        logger.info(f"[SYNC] Conteúdos disponibilizados sincronizados: {inseridos} registos.")
+            logger.info(f"[SYNC] Conteúdos disponibilizados sincronizados: {inseridos} registos. Ignorados: {ignorados}.")
     except Exception as e:
         logger.exception(f"[SYNC] Erro ao sincronizar conteúdos disponibilizados: {str(e)}")
 
 # Função para sincronizar os logs de acesso ao curso
-def sync_course_access_logs():
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+# Por omissão é incremental (append-only a partir da watermark em sync_state), carregado em blocos de log ids
+# com ponto de retoma, como sync_interacao_data.
+# O nome, role e nome do curso são resolvidos a partir de course_data, que tem de estar sincronizada antes
+# (role é copiado já codificado, com os códigos de course_data).
+# Se dados vier preenchido (modo paralelo), usa os dados já extraídos a partir do mesmo desde_id.
+def sync_course_access_logs(reconstrucao_completa=False, dados=None):
+    now = epoch_agora()
 
     try:
-        logger.debug("[SYNC] A obter logs de acesso ao curso do Moodle...")
-        dados = fetch_all_course_access_logs()
+        with telemetria_sync("course_access_logs") as metricas, closing(connect_to_uni_analytics_db()) as conn_local:
+            cursor_local = conn_local.cursor()
 
-        conn_local = connect_to_uni_analytics_db()
-        cursor_local = conn_local.cursor()
-        cursor_local.execute("DELETE FROM course_access_logs")
-
-        inseridos = 0
-        for row in dados:
-            logger.debug(
-                f"[SYNC][ACESSOS] Inserir: user_id={row['user_id']}, name={row['name']}, "
-                f"role={row['role']}, course_id={row['course_id']}, course_name={row['course_name']}, "
-                f"access_time={row['access_time']}, time_updated={now}"
+            desde_id, reconstrucao_completa, retomar = resolver_inicio(cursor_local, "course_access_logs", reconstrucao_completa)
+
+            logger.debug(f"[SYNC] A obter logs de acesso ao curso do Moodle (log id > {desde_id})...")
+            dados = extrair_medido(metricas, dados, fetch_all_course_access_logs, desde_id)
+
+            # Utilizadores por curso (um utilizador pode ter mais do que um role no mesmo curso)
+            cursor_local.execute("SELECT user_id, course_id, name, role, course_name FROM course_data")
+            inscritos = {}
+            for user_id, course_id, name, role, course_name in cursor_local.fetchall():
+                inscritos.setdefault((user_id, course_id), []).append((name, role, course_name))
+
+            destino, ao_confirmar, estado = preparar_carga_por_blocos(
+                cursor_local, "course_access_logs", desde_id, reconstrucao_completa, retomar
+            )
+            estado["sem_role"] = 0
+
+            # Um registo do log dá uma linha por role do utilizador no curso
+            def converter(row):
+                papeis = inscritos.get((row["user_id"], row["course_id"]))
+
+                # Acessos de utilizadores sem role no curso não são considerados
+                if not papeis:
+                    estado["sem_role"] += 1
+                    return []
+
+                return [
+                    (row["user_id"], name, role, row["course_id"], course_name, row["access_time"], now)
+                    for name, role, course_name in papeis
+                ]
+
+            inseridos, ignorados = metricas["rows_inserted"], metricas["rows_ignored"] = carregar_com_checkpoint(
+                cursor_local, destino,
+                ["user_id", "name", "role", "course_id", "course_name", "access_time", "time_updated"],
+                dados, converter, "log_id", ao_confirmar
+            )
+
+            ultimo_id = concluir_carga_por_blocos(cursor_local, "course_access_logs", reconstrucao_completa, estado)
+            modo = "reconstrução completa" if reconstrucao_completa else "incremental"
+            logger.info(
+                f"[SYNC] Logs de acesso ao curso sincronizados ({modo}): {inseridos} registos. Ignorados: {ignorados}. "
+                f"Sem role no curso: {estado['sem_role']}. Último log id: {ultimo_id}."
             )
-            cursor_local.execute("""
-                INSERT INTO course_access_logs (
-                    user_id, name, role, course_id, course_name, access_time, time_updated
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                row["user_id"],
-                row["name"],
-                row["role"],
-                row["course_id"],
-                row["course_name"],
-                row["access_time"],
-                now
-            ))
-            inseridos += 1
-
-        conn_local.commit()
-        conn_local.close()
-        logger.info(f"[SYNC] Logs de acesso ao curso sincronizados: {inseridos} registos.")
     except Exception as e:
         logger.exception(f"[SYNC] Erro ao sincronizar logs de acesso ao curso: {str(e)}")
 
+# Número de extrações do Moodle feitas em simultâneo (1 = execução sequencial, em streaming)
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "1"))
+
+# Devolve o desde_id de uma tabela incremental, lido com uma ligação local própria (usado pelas threads de extração).
+# Com retoma=True considera também o checkpoint de uma reconstrução interrompida (tabelas carregadas por blocos).
+def desde_id_local(tabela, reconstrucao_completa, retoma=False):
+    conn_local = connect_to_uni_analytics_db()
+    if retoma:
+        desde_id, _, _ = resolver_inicio(conn_local.cursor(), tabela, reconstrucao_completa)
+    else:
+        desde_id, _ = resolver_desde_id(conn_local.cursor(), tabela, reconstrucao_completa)
+    conn_local.close()
+    return desde_id
+
+# Lista ordenada dos syncs: (nome, função de extração, função de carga).
+# A ordem é a ordem de escrita local (course_data tem de ser carregada antes de course_access_logs).
+# Nas tabelas com carga completa a extração só cobre os cursos alterados segundo as impressões digitais.
+def obter_syncs(reconstrucao_completa=False, impressoes=None):
+    syncs = [
+        ("forum",
+         lambda: extrair_cursos(lambda cursos: list(fetch_all_forum_posts(cursos)),
+                                cursos_a_sincronizar_local("forum", impressoes)),
+         lambda dados: sync_forum_data(dados, impressoes)),
+    ]
+    if SYNC_INTERACAO_MODO in ("detalhe", "ambos"):
+        syncs.append(
+            ("interacao",
+             lambda: list(fetch_all_interacoes(desde_id_local("interacao", reconstrucao_completa, retoma=True))),
+             lambda dados: sync_interacao_data(reconstrucao_completa, dados))
+        )
+    if SYNC_INTERACAO_MODO in ("agregado", "ambos"):
+        syncs.append(
+            ("interacao_diaria",
+             lambda: list(fetch_interacoes_diarias(desde_id_local("interacao_diaria", reconstrucao_completa))),
+             lambda dados: sync_interacao_diaria(reconstrucao_completa, dados))
+        )
+    return syncs + [
+        ("grade_progress",
+         lambda: extrair_cursos(lambda cursos: list(fetch_all_grade_progress(cursos)),
+                                cursos_grade_progress_local(impressoes, reconstrucao_completa)),
+         lambda dados: sync_grade_progress_data(reconstrucao_completa, dados, impressoes)),
+        ("efolios",
+         lambda: extrair_cursos(fetch_all_efolios, cursos_a_sincronizar_local("efolios", impressoes)),
+         lambda dados: sync_efolios_data(dados, impressoes)),
+        ("course_data",
+         lambda: extrair_cursos(fetch_all_user_course_data, cursos_a_sincronizar_local("course_data", impressoes)),
+         lambda dados: sync_user_course_data(dados, impressoes)),
+        ("conteudos_disponibilizados",
+         lambda: extrair_cursos(fetch_all_conteudos_disponibilizados,
+                                cursos_a_sincronizar_local("conteudos_disponibilizados", impressoes)),
+         lambda dados: sync_conteudos_disponibilizados(dados, impressoes)),
+        ("course_access_logs",
+         lambda: list(fetch_all_course_access_logs(desde_id_local("course_access_logs", reconstrucao_completa, retoma=True))),
+         lambda dados: sync_course_access_logs(reconstrucao_completa, dados)),
+    ]
+
+# Corre uma extração numa thread do pool e regista o seu tempo na telemetria da tabela
+def extrair_e_medir(nome, extrair):
+    inicio = time.perf_counter()
+    try:
+        return extrair()
+    finally:
+        registar_extracao_previa(nome, time.perf_counter() - inicio)
+
+# Modo paralelo: as extrações do Moodle correm em simultâneo num pool limitado de threads, cada uma com a sua ligação.
+# As escritas na base de dados local continuam em série, na thread principal e pela ordem de obter_syncs.
+# Neste modo cada tabela é extraída por completo para memória antes de ser carregada.
+def executar_syncs_em_paralelo(reconstrucao_completa, workers, impressoes=None):
+    logger.info(f"[SYNC] Execução paralela com {workers} extrações em simultâneo.")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sync") as pool:
+        pendentes = [
+            (nome, pool.submit(extrair_e_medir, nome, extrair), carregar)
+            for nome, extrair, carregar in obter_syncs(reconstrucao_completa, impressoes)
+        ]
+
+        for nome, futuro, carregar in pendentes:
+            try:
+                dados = futuro.result()
+            except Exception as e:
+                logger.exception(f"[SYNC] Erro ao extrair {nome} do Moodle: {str(e)}")
+                registar_falha_extracao(nome, e)
+                continue
+            carregar(dados)
+
 # Ponto de entrada principal para o scheduler
-def executar_todos_os_syncs():
-    sync_forum_data()
-    sync_interacao_data()
-    sync_grade_progress_data()
-    sync_efolios_data()
-    sync_user_course_data()
-    sync_conteudos_disponibilizados()
-    sync_course_access_logs()
\ No newline at end of file
+# reconstrucao_completa=True força a reimportação total de todas as tabelas (incluindo os cursos sem alterações)
+# workers > 1 (ou SYNC_WORKERS) ativa a extração paralela
+def executar_todos_os_syncs(reconstrucao_completa=False, workers=None):
+    workers = workers or SYNC_WORKERS
+    with telemetria_execucao():
+        if reconstrucao_completa:
+            limpar_impressoes()
+        impressoes = calcular_impressoes_cursos()
+
+        if workers > 1:
+            executar_syncs_em_paralelo(reconstrucao_completa, workers, impressoes)
+        else:
+            sync_forum_data(impressoes=impressoes)
+            if SYNC_INTERACAO_MODO in ("detalhe", "ambos"):
+                sync_interacao_data(reconstrucao_completa)
+            if SYNC_INTERACAO_MODO in ("agregado", "ambos"):
+                sync_interacao_diaria(reconstrucao_completa)
+            sync_grade_progress_data(reconstrucao_completa, impressoes=impressoes)
+            sync_efolios_data(impressoes=impressoes)
+            sync_user_course_data(impressoes=impressoes)
+            sync_conteudos_disponibilizados(impressoes=impressoes)
+            sync_course_access_logs(reconstrucao_completa)
+
+    logger.info(f"[SYNC] Métricas do pool de ligações ao Moodle: {obter_metricas_pool()}")
+
+# Indica se uma tabela incremental já tem watermark (isto é, se já teve um sync completo)
+def tem_watermark(tabela):
+    conn_local = connect_to_uni_analytics_db()
+    watermark = obter_watermark(conn_local.cursor(), tabela)
+    conn_local.close()
+    return watermark is not None
+
+# Micro-lote: aplica incrementalmente, a cada SYNC_MICRO_INTERVAL_MINUTES, só o que é novo no Moodle desde o último
+# lote, para que os dashboards mostrem a atividade com poucos minutos de atraso:
+#   - eventos novos do log (interações e acessos ao curso), a partir das watermarks de log id;
+#   - posts novos dos fóruns, a partir do maior post_id local;
+#   - cursos com conclusões, notas ou inscrições alteradas desde a watermark de tempo "micro_lote" (timestamp do
+#     Moodle), que são sincronizados por diferenças em grade_progress e substituídos curso a curso em course_data.
+#     A query desses cursos lê por completo tabelas do Moodle sem índice em timemodified, pelo que tem um tempo
+#     máximo próprio (SYNC_MICRO_ALTERACOES_MAX_MS); se o exceder, os cursos ficam para o micro-lote seguinte.
+# O sync completo noturno continua a reconciliar tudo (remoções, edições e fontes sem timemodified).
+# As tabelas que ainda não tiveram um sync completo (sem watermark) são deixadas para esse sync.
+def executar_micro_lote():
+    with telemetria_execucao(descartar_vazios=True):
+        conn_local = connect_to_uni_analytics_db()
+        desde_time = obter_watermark(conn_local.cursor(), "micro_lote")
+        conn_local.close()
+
+        # Na primeira execução recua-se um dia (o sync por diferenças ignora o que já estava aplicado)
+        if desde_time is None:
+            desde_time = int(time.time()) - 86400
+
+        try:
+            alterados = fetch_cursos_alterados_desde(desde_time, SYNC_MICRO_ALTERACOES_MAX_MS)
+        except Exception as e:
+            logger.exception(f"[SYNC] Erro ao obter os cursos alterados para o micro-lote: {str(e)}")
+            alterados = []
+
+        cursos_roles = sorted({course_id for course_id, fonte, _ in alterados if fonte == "roles"})
+        cursos_progresso = sorted({course_id for course_id, fonte, _ in alterados if fonte in ("conclusoes", "notas")})
+        logger.info(
+            f"[SYNC] Micro-lote: {len(cursos_roles)} cursos com inscrições alteradas e "
+            f"{len(cursos_progresso)} com conclusões/notas alteradas desde {datetime.fromtimestamp(desde_time)}."
+        )
+
+        # course_data primeiro: os acessos ao curso de utilizadores recém-inscritos precisam do seu role
+        if cursos_roles:
+            sync_user_course_data(cursos=cursos_roles)
+        sync_forum_novos()
+        if SYNC_INTERACAO_MODO in ("detalhe", "ambos") and tem_watermark("interacao"):
+            sync_interacao_data()
+        if SYNC_INTERACAO_MODO in ("agregado", "ambos") and tem_watermark("interacao_diaria"):
+            sync_interacao_diaria()
+        if cursos_progresso:
+            sync_grade_progress_data(cursos=cursos_progresso)
+        if tem_watermark("course_access_logs"):
+            sync_course_access_logs()
+
+        # A watermark só avança se todos os syncs do lote correram sem erro; caso contrário o próximo micro-lote
+        # volta a sincronizar os mesmos cursos
+        if alterados and falhas_execucao():
+            logger.warning("[SYNC] Micro-lote com syncs falhados: watermark de tempo não avançada.")
+        elif alterados:
+            conn_local = connect_to_uni_analytics_db()
+            cursor_local = conn_local.cursor()
+            guardar_watermark(cursor_local, "micro_lote", max(ultimo for _, _, ultimo in alterados))
+            conn_local.commit()
+            conn_local.close()
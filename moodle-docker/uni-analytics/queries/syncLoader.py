@@ -0,0 +1,299 @@
+import os
+import hashlib
+import re
+import time
+from itertools import islice
+from utils.logger import logger
+
+# Número de registos enviados por cada executemany (configurável por variável de ambiente)
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "5000"))
+
+# Número de registos de origem por bloco confirmado nas cargas com checkpoint (cada bloco é um commit)
+SYNC_CHECKPOINT_ROWS = int(os.getenv("SYNC_CHECKPOINT_ROWS", "50000"))
+
+# Função que insere registos em lote numa tabela local, em blocos de batch_size via executemany.
+# Por omissão não faz commit: tudo corre na transação do cursor, que o chamador confirma no fim.
+# Com commit_por_lote=True cada bloco é confirmado logo (usado nas tabelas sombra, invisíveis aos dashboards).
+# Se um bloco falhar, é desfeito e repetido registo a registo para isolar e ignorar apenas os registos inválidos.
+# em_conflito acrescenta uma cláusula ON CONFLICT ao INSERT (ex.: para somar contagens a linhas já existentes).
+# Com silencioso=True não regista o ritmo da carga (usado quando a função é chamada bloco a bloco).
+# Devolve (inseridos, ignorados).
+def carregar_em_lote(cursor_local, tabela, colunas, linhas, batch_size=None, commit_por_lote=False, em_conflito=None,
+                     silencioso=False):
+    batch_size = batch_size or SYNC_BATCH_SIZE
+    query = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' for _ in colunas)})"
+    if em_conflito:
+        query += f" {em_conflito}"
+
+    inseridos = 0
+    ignorados = 0
+    inicio = time.perf_counter()
+    linhas = iter(linhas)
+
+    while True:
+        bloco = list(islice(linhas, batch_size))
+        if not bloco:
+            break
+
+        # Garante que existe uma transação aberta, para que o RELEASE do savepoint não faça commit
+        if not cursor_local.connection.in_transaction:
+            cursor_local.execute("BEGIN")
+
+        cursor_local.execute("SAVEPOINT carregar_lote")
+        try:
+            cursor_local.executemany(query, bloco)
+            cursor_local.execute("RELEASE carregar_lote")
+            inseridos += len(bloco)
+        except Exception as bloco_error:
+            cursor_local.execute("ROLLBACK TO carregar_lote")
+            cursor_local.execute("RELEASE carregar_lote")
+            logger.warning(f"[SYNC][{tabela.upper()}] Bloco de {len(bloco)} registos falhou ({bloco_error}). A inserir registo a registo.")
+
+            for linha in bloco:
+                try:
+                    cursor_local.execute(query, linha)
+                    inseridos += 1
+                except Exception as item_error:
+                    ignorados += 1
+                    logger.warning(f"[SYNC][{tabela.upper()}] Registo ignorado por erro: {str(item_error)} | Dados: {linha}")
+
+        if commit_por_lote:
+            cursor_local.connection.commit()
+
+    if not silencioso:
+        duracao = time.perf_counter() - inicio
+        ritmo = inseridos / duracao if duracao > 0 else 0
+        logger.info(f"[SYNC][{tabela.upper()}] {inseridos} registos carregados em {duracao:.2f} s ({ritmo:.0f} registos/s, lotes de {batch_size}).")
+    return inseridos, ignorados
+
+# Carrega registos de origem ordenados por uma chave crescente (ex.: log id) em blocos de bloco registos,
+# confirmando cada bloco numa transação própria. converter(row) devolve as linhas a inserir para cada registo
+# de origem (zero ou mais). Antes de cada commit chama ao_confirmar(cursor, ultima_chave) com a maior chave do
+# bloco, para gravar o ponto de retoma (watermark ou checkpoint) na mesma transação dos dados: se a carga for
+# interrompida, o que ficou confirmado é consistente com o ponto de retoma e o próximo sync continua daí.
+# Devolve (inseridos, ignorados).
+def carregar_com_checkpoint(cursor_local, tabela, colunas, dados, converter, chave, ao_confirmar, bloco=None, batch_size=None):
+    bloco = bloco or SYNC_CHECKPOINT_ROWS
+    batch_size = batch_size or SYNC_BATCH_SIZE
+    conn_local = cursor_local.connection
+
+    inseridos = 0
+    ignorados = 0
+    blocos = 0
+    inicio = time.perf_counter()
+    dados = iter(dados)
+
+    while True:
+        registos = list(islice(dados, bloco))
+        if not registos:
+            break
+
+        try:
+            i, g = carregar_em_lote(
+                cursor_local, tabela, colunas,
+                (linha for row in registos for linha in converter(row)),
+                batch_size, silencioso=True
+            )
+            ao_confirmar(cursor_local, max(row[chave] for row in registos))
+            conn_local.commit()
+        except Exception:
+            conn_local.rollback()
+            raise
+        inseridos += i
+        ignorados += g
+        blocos += 1
+
+    duracao = time.perf_counter() - inicio
+    ritmo = inseridos / duracao if duracao > 0 else 0
+    logger.info(
+        f"[SYNC][{tabela.upper()}] {inseridos} registos carregados em {duracao:.2f} s ({ritmo:.0f} registos/s, "
+        f"{blocos} blocos confirmados de até {bloco} registos de origem)."
+    )
+    return inseridos, ignorados
+
+
+################### Tabelas sombra ###################
+# As tabelas com carga completa são carregadas numa tabela sombra (<tabela>__staging) e depois trocadas
+# com a tabela real numa transação curta, para que os dashboards vejam sempre uma geração completa dos dados.
+
+# Nome da tabela sombra de uma tabela
+def nome_tabela_sombra(tabela):
+    return f"{tabela}__staging"
+
+# Indica se uma tabela existe na base de dados local
+def existe_tabela(cursor_local, tabela):
+    cursor_local.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,))
+    return cursor_local.fetchone() is not None
+
+# Cria (ou recria vazia) a tabela sombra com o mesmo esquema da tabela real. Devolve o nome da tabela sombra.
+# Com reutilizar=True mantém a tabela sombra se já existir (retoma de uma carga interrompida).
+# Os índices UNIQUE são criados logo, por serem restrições: as linhas repetidas são rejeitadas durante a carga,
+# como na tabela real. Os restantes índices só são criados no fim da carga, em trocar_tabela_sombra.
+def criar_tabela_sombra(cursor_local, tabela, reutilizar=False):
+    sombra = nome_tabela_sombra(tabela)
+    if reutilizar and existe_tabela(cursor_local, sombra):
+        return sombra
+
+    cursor_local.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,))
+    (sql_tabela,) = cursor_local.fetchone()
+
+    cursor_local.execute(f"DROP TABLE IF EXISTS {sombra}")
+    cursor_local.execute(re.sub(
+        r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?("?)\w+\2', f"CREATE TABLE {sombra}", sql_tabela, flags=re.IGNORECASE
+    ))
+    criar_indices_sombra(cursor_local, tabela, unicos=True)
+    return sombra
+
+# Recria na tabela sombra os índices da tabela real. Como os nomes dos índices são únicos na base de dados,
+# cada geração recebe o sufixo __g<timestamp em ms> (o índice antigo desaparece com a tabela antiga).
+# unicos indica se são recriados os índices UNIQUE (na criação da tabela sombra) ou os restantes (no fim da carga).
+def criar_indices_sombra(cursor_local, tabela, unicos=False):
+    sombra = nome_tabela_sombra(tabela)
+    geracao = int(time.time() * 1000)
+    cursor_local.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (tabela,)
+    )
+    for nome, sql_indice in cursor_local.fetchall():
+        if bool(re.match(r"CREATE\s+UNIQUE\b", sql_indice, flags=re.IGNORECASE)) != unicos:
+            continue
+        novo_nome = re.sub(r"__g\d+$", "", nome) + f"__g{geracao}"
+        cursor_local.execute(re.sub(
+            r'^(CREATE\s+(?:UNIQUE\s+)?INDEX\s+)(?:IF NOT EXISTS\s+)?("?)\w+\2\s+ON\s+("?)\w+\3',
+            lambda m: f"{m.group(1)}{novo_nome} ON {sombra}", sql_indice, flags=re.IGNORECASE
+        ))
+    cursor_local.connection.commit()
+
+# Troca a tabela sombra com a tabela real numa única transação curta (apenas renomeações).
+# antes_de_confirmar(cursor) permite gravar dados relacionados (ex.: watermark) na mesma transação da troca.
+# A geração antiga é apagada depois da troca, fora da transação que os leitores esperam.
+def trocar_tabela_sombra(cursor_local, tabela, antes_de_confirmar=None):
+    conn_local = cursor_local.connection
+    sombra = nome_tabela_sombra(tabela)
+    antiga = f"{tabela}__old"
+
+    criar_indices_sombra(cursor_local, tabela)
+
+    cursor_local.execute(f"DROP TABLE IF EXISTS {antiga}")
+    conn_local.commit()
+
+    inicio = time.perf_counter()
+    cursor_local.execute("BEGIN IMMEDIATE")
+    try:
+        cursor_local.execute(f"ALTER TABLE {tabela} RENAME TO {antiga}")
+        cursor_local.execute(f"ALTER TABLE {sombra} RENAME TO {tabela}")
+        if antes_de_confirmar:
+            antes_de_confirmar(cursor_local)
+        conn_local.commit()
+    except Exception:
+        conn_local.rollback()
+        raise
+    duracao_troca = time.perf_counter() - inicio
+
+    cursor_local.execute(f"DROP TABLE IF EXISTS {antiga}")
+    conn_local.commit()
+    logger.info(f"[SYNC][{tabela.upper()}] Nova geração ativada (troca em {duracao_troca * 1000:.1f} ms).")
+
+
+################### Upsert por hash ###################
+# As tabelas com chave natural podem ser sincronizadas por diferenças: cada linha leva um hash do seu conteúdo
+# e só as linhas novas, alteradas ou desaparecidas são escritas na tabela real.
+
+# Hash curto e estável do conteúdo de uma linha (usado para detetar alterações)
+def hash_linha(valores):
+    return hashlib.blake2b(repr(tuple(valores)).encode("utf-8"), digest_size=8).hexdigest()
+
+# Sincroniza uma tabela por diferenças com a extração atual, comparando row_hash linha a linha pela chave.
+# As linhas extraídas são carregadas numa tabela temporária (só visível nesta ligação) e as diferenças são
+# aplicadas à tabela real numa única transação: apaga as chaves que desapareceram, substitui as linhas cujo
+# hash mudou e insere as chaves novas. Cada alteração fica registada em tabela_alteracoes (change feed),
+# com as colunas colunas_feed. colunas tem de incluir a chave e row_hash; colunas_feed tem de estar em colunas.
+# Se cursos vier preenchido, a extração só cobre esses cursos e só neles se apagam as chaves desaparecidas.
+# antes_de_confirmar(cursor) permite gravar dados relacionados na mesma transação.
+# Devolve (contagens, ignorados), com contagens = {inseridos, atualizados, inalterados, apagados}.
+def sincronizar_por_hash(cursor_local, tabela, chave, colunas, linhas, tabela_alteracoes, colunas_feed, now,
+                         cursos=None, antes_de_confirmar=None):
+    conn_local = cursor_local.connection
+    temporaria = f"temp.{tabela}__extracao"
+
+    ambito = ""
+    if cursos is not None:
+        cursor_local.execute(f"CREATE TEMP TABLE IF NOT EXISTS {tabela}__cursos (course_id INTEGER PRIMARY KEY)")
+        cursor_local.execute(f"DELETE FROM temp.{tabela}__cursos")
+        cursor_local.executemany(f"INSERT INTO temp.{tabela}__cursos VALUES (?)", [(c,) for c in cursos])
+        ambito = f"AND course_id IN (SELECT course_id FROM temp.{tabela}__cursos)"
+
+    cursor_local.execute(f"DROP TABLE IF EXISTS {temporaria}")
+    cursor_local.execute(f"CREATE TEMP TABLE {tabela}__extracao AS SELECT {', '.join(colunas)} FROM {tabela} WHERE 0")
+    _, ignorados = carregar_em_lote(cursor_local, temporaria, colunas, linhas)
+    cursor_local.execute(f"CREATE INDEX temp.idx_{tabela}__extracao_chave ON {tabela}__extracao({', '.join(chave)})")
+    conn_local.commit()
+
+    def mesma_chave(a, b):
+        return " AND ".join(f"{a}.{c} = {b}.{c}" for c in chave)
+
+    feed = ", ".join(colunas_feed)
+    lista_colunas = ", ".join(colunas)
+    inicio = time.perf_counter()
+
+    cursor_local.execute("BEGIN IMMEDIATE")
+    try:
+        # Chaves que deixaram de existir na origem
+        cursor_local.execute(f"""
+            INSERT INTO {tabela_alteracoes} ({feed}, change_type, changed_at)
+            SELECT {feed}, 'delete', ? FROM {tabela} g
+            WHERE NOT EXISTS (SELECT 1 FROM {temporaria} t WHERE {mesma_chave('t', 'g')}) {ambito}
+        """, (now,))
+        apagados = cursor_local.rowcount
+        cursor_local.execute(f"""
+            DELETE FROM {tabela}
+            WHERE NOT EXISTS (SELECT 1 FROM {temporaria} t WHERE {mesma_chave('t', tabela)}) {ambito}
+        """)
+
+        # Linhas cujo conteúdo mudou e chaves novas
+        cursor_local.execute(f"""
+            INSERT INTO {tabela_alteracoes} ({feed}, change_type, changed_at)
+            SELECT {', '.join(f't.{c}' for c in colunas_feed)}, 'update', ? FROM {temporaria} t
+            JOIN {tabela} g ON {mesma_chave('t', 'g')}
+            WHERE g.row_hash IS NOT t.row_hash
+        """, (now,))
+        atualizados = cursor_local.rowcount
+        cursor_local.execute(f"""
+            INSERT INTO {tabela_alteracoes} ({feed}, change_type, changed_at)
+            SELECT {feed}, 'insert', ? FROM {temporaria} t
+            WHERE NOT EXISTS (SELECT 1 FROM {tabela} g WHERE {mesma_chave('t', 'g')})
+        """, (now,))
+        inseridos = cursor_local.rowcount
+
+        # A versão antiga das linhas alteradas é apagada; depois inserem-se todas as linhas que faltam
+        cursor_local.execute(f"""
+            DELETE FROM {tabela}
+            WHERE EXISTS (
+                SELECT 1 FROM {temporaria} t
+                WHERE {mesma_chave('t', tabela)} AND {tabela}.row_hash IS NOT t.row_hash
+            )
+        """)
+        cursor_local.execute(f"""
+            INSERT INTO {tabela} ({lista_colunas}, time_updated)
+            SELECT {lista_colunas}, ? FROM {temporaria} t
+            WHERE NOT EXISTS (SELECT 1 FROM {tabela} g WHERE {mesma_chave('t', 'g')})
+        """, (now,))
+
+        if antes_de_confirmar:
+            antes_de_confirmar(cursor_local)
+        conn_local.commit()
+    except Exception:
+        conn_local.rollback()
+        raise
+    finally:
+        cursor_local.execute(f"DROP TABLE IF EXISTS {temporaria}")
+
+    # Só se contam as linhas dos cursos sincronizados (as dos restantes cursos não foram comparadas)
+    cursor_local.execute(f"SELECT COUNT(*) FROM {tabela} WHERE 1 {ambito}")
+    inalterados = cursor_local.fetchone()[0] - inseridos - atualizados
+
+    logger.info(
+        f"[SYNC][{tabela.upper()}] Diferenças aplicadas em {(time.perf_counter() - inicio) * 1000:.1f} ms: "
+        f"{inseridos} inseridos, {atualizados} atualizados, {inalterados} inalterados, {apagados} apagados."
+    )
+    contagens = {"inseridos": inseridos, "atualizados": atualizados, "inalterados": inalterados, "apagados": apagados}
+    return contagens, ignorados
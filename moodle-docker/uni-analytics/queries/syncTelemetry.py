@@ -0,0 +1,258 @@
+import time
+import uuid
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from db.uniAnalytics import connect_to_uni_analytics_db
+from utils.logger import logger
+
+# Execução de sync em curso (partilhada pelas threads de extração do modo paralelo).
+# descartar_vazios: não gravar os syncs sem linhas lidas nem a execução se nada for gravado (micro-lotes)
+# falhas: syncs da execução que terminaram em erro (as funções de sync registam o erro e não o propagam)
+_execucao = {"run_id": None, "descartar_vazios": False, "falhas": 0}
+
+# Tempos de extração medidos fora da função de sync (modo paralelo), por tabela
+_extracao_previa = {}
+_lock = threading.Lock()
+
+################### Memória ###################
+# Repõe o pico de memória residente do processo (VmHWM), para medir o pico de cada tabela em separado.
+# Só funciona em Linux; noutros sistemas o pico passa a ser o do processo desde o arranque.
+def _repor_pico_memoria():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+# Devolve o pico de memória residente do processo em KB
+def _pico_memoria_kb():
+    try:
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+################### Registo ###################
+def _agora():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+# Grava uma linha em sync_runs (table_name NULL representa a execução completa)
+def _gravar(registo):
+    conn = connect_to_uni_analytics_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO sync_runs (
+                run_id, table_name, started_at, finished_at, extract_seconds, load_seconds,
+                rows_read, rows_inserted, rows_ignored, rows_updated, rows_unchanged, rows_deleted,
+                peak_memory_kb, status, error
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            registo["run_id"], registo["table_name"], registo["started_at"], registo["finished_at"],
+            registo["extract_seconds"], registo["load_seconds"], registo["rows_read"],
+            registo["rows_inserted"], registo["rows_ignored"], registo.get("rows_updated", 0),
+            registo.get("rows_unchanged", 0), registo.get("rows_deleted", 0), registo["peak_memory_kb"],
+            registo["status"], registo["error"]
+        ))
+        conn.commit()
+    finally:
+        conn.close()
+
+# Identificador da execução em curso (um sync chamado isoladamente, fora de executar_todos_os_syncs, tem o seu próprio)
+def _run_id():
+    return _execucao["run_id"] or uuid.uuid4().hex
+
+# Envolve um iterável de extração, contando as linhas lidas e o tempo passado à espera do Moodle
+def medir_extracao(dados, metricas):
+    iterador = iter(dados)
+    while True:
+        inicio = time.perf_counter()
+        try:
+            row = next(iterador)
+        except StopIteration:
+            metricas["extract_seconds"] += time.perf_counter() - inicio
+            return
+        metricas["extract_seconds"] += time.perf_counter() - inicio
+        metricas["rows_read"] += 1
+        yield row
+
+# Obtém os dados a sincronizar (chamando extrair(*args) se ainda não vierem extraídos) e mede a extração.
+# Com em_streaming=False (ex.: DataFrame) não envolve o resultado; a função de sync preenche rows_read.
+def extrair_medido(metricas, dados, extrair, *args, em_streaming=True):
+    inicio = time.perf_counter()
+    if dados is None:
+        dados = extrair(*args)
+    metricas["extract_seconds"] += time.perf_counter() - inicio
+    return medir_extracao(dados, metricas) if em_streaming else dados
+
+# Regista o tempo de uma extração feita antes da chamada à função de sync (modo paralelo)
+def registar_extracao_previa(tabela, segundos):
+    with _lock:
+        _extracao_previa[tabela] = segundos
+
+# Grava a falha de uma extração feita fora da função de sync (modo paralelo), que assim nunca chega a correr
+def registar_falha_extracao(tabela, erro):
+    with _lock:
+        extracao_previa = _extracao_previa.pop(tabela, 0.0)
+        _execucao["falhas"] += 1
+    agora = _agora()
+    try:
+        _gravar({
+            "run_id": _run_id(),
+            "table_name": tabela,
+            "started_at": agora,
+            "finished_at": agora,
+            "extract_seconds": extracao_previa,
+            "load_seconds": 0.0,
+            "rows_read": 0,
+            "rows_inserted": 0,
+            "rows_ignored": 0,
+            "peak_memory_kb": _pico_memoria_kb(),
+            "status": "erro",
+            "error": str(erro),
+        })
+    except Exception:
+        logger.exception(f"[SYNC] Erro ao gravar a telemetria do sync de {tabela}.")
+
+# Número de syncs da execução em curso que terminaram em erro
+def falhas_execucao():
+    return _execucao["falhas"]
+
+# Context manager que mede o sync de uma tabela e o grava em sync_runs.
+# A função de sync preenche rows_inserted/rows_ignored (e, nos syncs por diferenças, rows_updated/
+# rows_unchanged/rows_deleted) e envolve os dados com medir_extracao;
+# o tempo de carga é o tempo total menos o tempo passado à espera da extração.
+@contextmanager
+def telemetria_sync(tabela):
+    with _lock:
+        extracao_previa = _extracao_previa.pop(tabela, 0.0)
+
+    metricas = {
+        "extract_seconds": 0.0, "rows_read": 0, "rows_inserted": 0, "rows_ignored": 0,
+        "rows_updated": 0, "rows_unchanged": 0, "rows_deleted": 0
+    }
+    started_at = _agora()
+    inicio = time.perf_counter()
+    _repor_pico_memoria()
+    status, erro = "ok", None
+    try:
+        yield metricas
+    except Exception as e:
+        status, erro = "erro", str(e)
+        with _lock:
+            _execucao["falhas"] += 1
+        raise
+    finally:
+        duracao = time.perf_counter() - inicio
+        vazio = _execucao["descartar_vazios"] and status == "ok" and metricas["rows_read"] == 0
+        try:
+            if not vazio:
+                _gravar({
+                    "run_id": _run_id(),
+                    "table_name": tabela,
+                    "started_at": started_at,
+                    "finished_at": _agora(),
+                    "extract_seconds": metricas["extract_seconds"] + extracao_previa,
+                    "load_seconds": max(duracao - metricas["extract_seconds"], 0.0),
+                    "rows_read": metricas["rows_read"],
+                    "rows_inserted": metricas["rows_inserted"],
+                    "rows_ignored": metricas["rows_ignored"],
+                    "rows_updated": metricas["rows_updated"],
+                    "rows_unchanged": metricas["rows_unchanged"],
+                    "rows_deleted": metricas["rows_deleted"],
+                    "peak_memory_kb": _pico_memoria_kb(),
+                    "status": status,
+                    "error": erro,
+                })
+        except Exception:
+            logger.exception(f"[SYNC] Erro ao gravar a telemetria do sync de {tabela}.")
+
+# Context manager que agrupa os syncs de uma execução de executar_todos_os_syncs e grava o seu resumo.
+# Com descartar_vazios=True (micro-lotes, a cada poucos minutos) só ficam registados os syncs que leram linhas.
+@contextmanager
+def telemetria_execucao(descartar_vazios=False):
+    _execucao["run_id"] = uuid.uuid4().hex
+    _execucao["descartar_vazios"] = descartar_vazios
+    _execucao["falhas"] = 0
+    started_at = _agora()
+    inicio = time.perf_counter()
+    status, erro = "ok", None
+    try:
+        yield _execucao["run_id"]
+    except Exception as e:
+        status, erro = "erro", str(e)
+        raise
+    finally:
+        try:
+            conn = connect_to_uni_analytics_db()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COALESCE(SUM(extract_seconds), 0), COALESCE(SUM(load_seconds), 0),
+                       COALESCE(SUM(rows_read), 0), COALESCE(SUM(rows_inserted), 0),
+                       COALESCE(SUM(rows_ignored), 0), COALESCE(SUM(rows_updated), 0),
+                       COALESCE(SUM(rows_unchanged), 0), COALESCE(SUM(rows_deleted), 0), MAX(peak_memory_kb),
+                       SUM(status <> 'ok'), COUNT(*)
+                FROM sync_runs
+                WHERE run_id = ? AND table_name IS NOT NULL
+            """, (_execucao["run_id"],))
+            extract_s, load_s, lidas, inseridas, ignoradas, atualizadas, inalteradas, apagadas, pico, falhas, syncs = cursor.fetchone()
+            conn.close()
+
+            if descartar_vazios and status == "ok" and not syncs:
+                logger.debug("[SYNC] Execução sem linhas lidas: telemetria não gravada.")
+            else:
+                if status == "ok" and falhas:
+                    status = "parcial"
+
+                _gravar({
+                    "run_id": _execucao["run_id"],
+                    "table_name": None,
+                    "started_at": started_at,
+                    "finished_at": _agora(),
+                    "extract_seconds": extract_s,
+                    "load_seconds": load_s,
+                    "rows_read": lidas,
+                    "rows_inserted": inseridas,
+                    "rows_ignored": ignoradas,
+                    "rows_updated": atualizadas,
+                    "rows_unchanged": inalteradas,
+                    "rows_deleted": apagadas,
+                    "peak_memory_kb": pico,
+                    "status": status,
+                    "error": erro,
+                })
+                logger.info(f"[SYNC] Execução {_execucao['run_id']} terminou em {time.perf_counter() - inicio:.1f} s ({status}).")
+        except Exception:
+            logger.exception("[SYNC] Erro ao gravar a telemetria da execução.")
+        finally:
+            _execucao["run_id"] = None
+            _execucao["descartar_vazios"] = False
+
+################### Local Queries ###################
+# Função para obter o histórico de execuções de sync (mais recentes primeiro)
+def fetch_sync_runs_local(limite=2000):
+    conn = connect_to_uni_analytics_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT run_id, table_name, started_at, finished_at, extract_seconds, load_seconds,
+               rows_read, rows_inserted, rows_ignored, rows_updated, rows_unchanged, rows_deleted,
+               peak_memory_kb, status, error
+        FROM sync_runs
+        ORDER BY id DESC
+        LIMIT ?
+    """, (limite,))
+    rows = cursor.fetchall()
+    conn.close()
+
+    colunas = [
+        "run_id", "table_name", "started_at", "finished_at", "extract_seconds", "load_seconds",
+        "rows_read", "rows_inserted", "rows_ignored", "rows_updated", "rows_unchanged", "rows_deleted",
+        "peak_memory_kb", "status", "error"
+    ]
+    return [dict(zip(colunas, row)) for row in rows]
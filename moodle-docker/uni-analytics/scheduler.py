@@ -1,126 +1,71 @@
 import os
-import time
-import schedule
-from datetime import datetime, timedelta
-from queries.syncData import executar_todos_os_syncs
+from queries.syncData import executar_todos_os_syncs, executar_micro_lote
 from utils.logger import logger
-from db.uniAnalytics import connect_to_uni_analytics_db
+from db.migrations import aplicar_migracoes
+from db.backup import BACKUP_MODE, criar_backup, criar_snapshot, limpar_backups_antigos, limpar_snapshots_antigos
+from utils.jobRunner import registar_job_diario, registar_job_intervalo, executar_jobs
 
 # Job que executa a sincronização dos dados de Moodle para a base de dados uniAnalytics
 def job_sync_all():
-    logger.info("[JOB] Início da sincronização geral.")
-    executar_todos_os_syncs()
+    # SYNC_FULL_REBUILD=1 força a reimportação completa das tabelas incrementais (ex.: interações)
+    reconstrucao_completa = os.getenv("SYNC_FULL_REBUILD", "0") == "1"
+    logger.info(f"[JOB] Início da sincronização geral (reconstrução completa: {reconstrucao_completa}).")
+    executar_todos_os_syncs(reconstrucao_completa)
     logger.info("[JOB] Sincronização completa.")
 
-# Job que actualiza disponibilização dos formulários de acordo com janela temporária
-def job_validar_formularios():
-    logger.info("[JOB] Início da verificação de disponibilidade de formulários.")
-    try:
-        conn = connect_to_uni_analytics_db()
-        cursor = conn.cursor()
-        hoje = datetime.now()
-
-        cursor.execute("SELECT item_id, start_date, end_date FROM efolios")
-        efolios = cursor.fetchall()
-
-        logger.debug(f"[JOB] {len(efolios)} e-fólios encontrados para validação.")
-
-        for item_id, start_str, end_str in efolios:
-            start_date = datetime.strptime(start_str, "%Y-%m-%d %H:%M:%S")
-            end_date = datetime.strptime(end_str, "%Y-%m-%d %H:%M:%S")
-
-            janela_pre_inicio = start_date - timedelta(days=7)
-            janela_pre_fim = start_date
-            available_pre = int(janela_pre_inicio <= hoje <= janela_pre_fim)
-
-            janela_pos_inicio = end_date
-            janela_pos_fim = end_date + timedelta(days=7)
-            available_pos = int(janela_pos_inicio <= hoje <= janela_pos_fim)
-
-            logger.debug(
-                f"[JOB] E-fólio {item_id} — PRE: {available_pre} ({janela_pre_inicio} a {janela_pre_fim}), "
-                f"POS: {available_pos} ({janela_pos_inicio} a {janela_pos_fim})"
-            )
-
-            cursor.execute("""
-                UPDATE efolios
-                SET available_pre = ?, available_pos = ?
-                WHERE item_id = ?
-            """, (available_pre, available_pos, item_id))
-            logger.debug(f"[JOB] Atualização feita para item_id={item_id}")
-
-        conn.commit()
-        conn.close()
-        logger.info("[JOB] Verificação de formulários concluída com sucesso.")
-
-    except Exception as e:
-        logger.exception("[JOB] Erro na verificação de disponibilidade de formulários.")
+# Job que aplica incrementalmente o que é novo no Moodle (logs, posts dos fóruns, conclusões e notas) entre
+# sincronizações completas, para que os dashboards fiquem atualizados com poucos minutos de atraso
+def job_sync_micro():
+    logger.info("[JOB] Início do micro-lote de sincronização.")
+    executar_micro_lote()
+    logger.info("[JOB] Micro-lote de sincronização concluído.")
 
 # Job de backup da base de dados
+# Usa a API de backup online do SQLite (cópia consistente por páginas, mesmo com um sync a escrever),
+# verifica a integridade da cópia e guarda-a como snapshot incremental ou ficheiro completo (ver db/backup.py)
 def job_backup_bd():
     try:
-        origem = "/app/db/uniAnalytics.db"
-        destino_dir = "/app/backups/local_db"
-        os.makedirs(destino_dir, exist_ok=True)
-
-        # Criar nome com timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        destino = os.path.join(destino_dir, f"backup_{timestamp}.db")
-
-        # Copiar o ficheiro
-        with open(origem, "rb") as src, open(destino, "wb") as dst:
-            dst.write(src.read())
-        logger.info(f"[JOB] Backup criado: {destino}")
-
-        # Apagar backups antigos
-        dias_reter = int(os.getenv("BACKUP_RETENTION_DAYS", "7"))
-        limite_data = datetime.now() - timedelta(days=dias_reter)
-        apagados = 0
-
-        for ficheiro in os.listdir(destino_dir):
-            if ficheiro.startswith("backup_") and ficheiro.endswith(".db"):
-                caminho = os.path.join(destino_dir, ficheiro)
-                mtime = datetime.fromtimestamp(os.path.getmtime(caminho))
-                if mtime < limite_data:
-                    os.remove(caminho)
-                    apagados += 1
-                    logger.info(f"[JOB] Backup antigo removido: {ficheiro}")
-
+        if BACKUP_MODE == "completo":
+            criar_backup()
+        else:
+            criar_snapshot()
+        apagados = limpar_backups_antigos()
+        limpar_snapshots_antigos()
         logger.info(f"[JOB] Limpeza concluída. {apagados} ficheiros removidos.")
 
     except Exception as e:
         logger.exception("[JOB] Erro ao criar ou limpar backups")
+        raise
 
-# Agendamento do job de sincronização (hora configurável)
+# Configuração comum dos jobs: jitter (segundos aleatórios somados à hora marcada) e timeouts (minutos)
+job_jitter = int(os.getenv("JOB_JITTER_SECONDS", "60"))
+sync_timeout = int(os.getenv("SYNC_TIMEOUT_MINUTES", "240"))
+micro_timeout = int(os.getenv("SYNC_MICRO_TIMEOUT_MINUTES", "30"))
+backup_timeout = int(os.getenv("BACKUP_TIMEOUT_MINUTES", "60"))
+
+# Garante que existem as tabelas usadas pelos jobs (incluindo o histórico job_runs) e aplica as migrações pendentes
+aplicar_migracoes()
+
+# Agendamento do job de sincronização (hora configurável).
+# Partilha o lock "sync" com os micro-lotes, para que nunca escrevam nas mesmas tabelas em simultâneo.
 sync_hour = os.getenv("SYNC_HOUR", "00")
 sync_minute = os.getenv("SYNC_MINUTE", "00")
-schedule.every().day.at(f"{sync_hour}:{sync_minute}").do(job_sync_all)
-logger.info(f"[JOB] Sincronização agendada para {sync_hour}:{sync_minute} todos os dias.")
+registar_job_diario("sync", job_sync_all, sync_hour, sync_minute,
+                    timeout_minutos=sync_timeout, jitter_segundos=job_jitter, lock="sync")
 
-# Agendamento do job de verificação de formulários (hora configurável)
-validation_hour = os.getenv("VALIDATION_HOUR", "01")
-validation_minute = os.getenv("VALIDATION_MINUTE", "00")
-schedule.every().day.at(f"{validation_hour}:{validation_minute}").do(job_validar_formularios)
-logger.info(f"[JOB] Validação de formulários agendada para {validation_hour}:{validation_minute} todos os dias.")
+# Agendamento dos micro-lotes de sincronização (intervalo em minutos configurável; 0 desativa)
+micro_interval = int(os.getenv("SYNC_MICRO_INTERVAL_MINUTES", "0"))
+if micro_interval > 0:
+    registar_job_intervalo("sync_micro", job_sync_micro, micro_interval,
+                           timeout_minutos=micro_timeout, jitter_segundos=min(job_jitter, micro_interval * 6), lock="sync")
 
-# Agendamento do job de backup da base de dados (hora configurável)
+# Agendamento do job de backup da base de dados (hora configurável).
+# Espera pela sincronização em curso, para copiar sempre um estado completo.
 backup_hour = os.getenv("BACKUP_HOUR", "02")
 backup_minute = os.getenv("BACKUP_MINUTE", "00")
-schedule.every().day.at(f"{backup_hour}:{backup_minute}").do(job_backup_bd)
-logger.info(f"[JOB] Backup agendado para {backup_hour}:{backup_minute} todos os dias.")
-
-# Executar ambos imediatamente ao iniciar 
-# A ordem é importante para garantir que a sincronização e validação estejam completas antes do backup
-logger.info("[JOB] Execução imediata de sincronização ao iniciar o scheduler.")
-job_sync_all()
-
-logger.info("[JOB] Execução de validação de formulários após sincronização inicial.")
-job_validar_formularios()
-
-logger.info("[JOB] Execução de backup após validação inicial.")
-job_backup_bd()
+registar_job_diario("backup", job_backup_bd, backup_hour, backup_minute,
+                    timeout_minutos=backup_timeout, jitter_segundos=job_jitter, apos=["sync"])
 
-# Loop de execução contínua
-while True:
-    schedule.run_pending()
-    time.sleep(60)
\ No newline at end of file
+# Ciclo de execução contínua. Ao arrancar, os jobs cuja última marcação não chegou a correr (ex.: o contentor
+# estava parado) são recuperados logo, pela ordem sincronização → backup.
+executar_jobs()
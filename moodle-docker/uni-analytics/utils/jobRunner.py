@@ -0,0 +1,228 @@
+import os
+import sys
+import time
+import fcntl
+import random
+import signal
+import multiprocessing
+from datetime import datetime, timedelta
+from db.uniAnalytics import connect_to_uni_analytics_db
+from utils.logger import logger
+
+# Configuração do executor de jobs (variáveis de ambiente)
+JOB_LOCK_DIR = os.getenv("JOB_LOCK_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "db", "locks"))  # Locks dos jobs (volume de dados)
+JOB_TICK_SECONDS = float(os.getenv("JOB_TICK_SECONDS", "5"))  # Intervalo entre verificações dos jobs pendentes
+JOB_KILL_GRACE_SECONDS = float(os.getenv("JOB_KILL_GRACE_SECONDS", "10"))  # Espera entre o SIGTERM e o SIGKILL de um job
+
+# Cada job corre num processo filho (fork), para poder ser interrompido ao fim do seu timeout e para que um job
+# demorado não atrase os restantes. Um lock de ficheiro (fcntl) impede que o mesmo job corra em simultâneo,
+# mesmo com o scheduler duplicado. O histórico fica em job_runs, que serve também para recuperar execuções
+# perdidas (ex.: o contentor estava parado à hora marcada).
+_jobs = []
+_contexto = multiprocessing.get_context("fork")
+_estado = {"a_terminar": False}
+
+def _agora_str(momento):
+    return momento.strftime('%Y-%m-%d %H:%M:%S')
+
+def _registar_job(nome, funcao, timeout_minutos, jitter_segundos, apos, lock, **agendamento):
+    _jobs.append({
+        "nome": nome,
+        "funcao": funcao,
+        "timeout": timeout_minutos * 60 if timeout_minutos else None,
+        "jitter": jitter_segundos,
+        "apos": list(apos),
+        "lock": lock or nome,
+        "marcacao": None,
+        "arranque": None,
+        "processo": None,
+        **agendamento,
+    })
+
+# Regista um job diário à hora:minuto indicada.
+# apos: jobs que têm de terminar antes deste arrancar (se estiverem a correr ou pendentes, este espera).
+# lock: nome do lock do job (jobs com o mesmo lock nunca correm em simultâneo; por omissão o nome do job).
+def registar_job_diario(nome, funcao, hora, minuto, timeout_minutos=None, jitter_segundos=0, apos=(), lock=None):
+    _registar_job(nome, funcao, timeout_minutos, jitter_segundos, apos, lock, tipo="diario", hora=int(hora), minuto=int(minuto))
+
+# Regista um job que corre a cada minutos minutos (contados a partir do início da execução anterior)
+def registar_job_intervalo(nome, funcao, minutos, timeout_minutos=None, jitter_segundos=0, apos=(), lock=None):
+    _registar_job(nome, funcao, timeout_minutos, jitter_segundos, apos, lock, tipo="intervalo", minutos=int(minutos))
+
+################### Histórico (job_runs) ###################
+# Marcação (hora prevista) da última execução de um job, sem contar as interrompidas (que voltam a ser tentadas)
+def _ultima_marcacao(nome):
+    conn = connect_to_uni_analytics_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT MAX(scheduled_for) FROM job_runs
+        WHERE job_name = ? AND status <> 'interrompido'
+    """, (nome,))
+    (ultima,) = cursor.fetchone()
+    conn.close()
+    return datetime.strptime(ultima, '%Y-%m-%d %H:%M:%S') if ultima else None
+
+def _registar_inicio(job, pid):
+    conn = connect_to_uni_analytics_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO job_runs (job_name, scheduled_for, started_at, status, pid)
+        VALUES (?, ?, ?, 'em_curso', ?)
+    """, (job["nome"], _agora_str(job["marcacao"]), _agora_str(datetime.now()), pid))
+    run_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return run_id
+
+def _registar_fim(job, status, erro=None):
+    conn = connect_to_uni_analytics_db()
+    conn.execute("""
+        UPDATE job_runs
+        SET finished_at = ?, duration_seconds = ?, status = ?, error = ?
+        WHERE id = ?
+    """, (_agora_str(datetime.now()), time.monotonic() - job["inicio"], status, erro, job["run_id"]))
+    conn.commit()
+    conn.close()
+
+# Marca como interrompidas as execuções deixadas 'em_curso' por um scheduler que terminou a meio.
+# Só é chamada com o lock do job obtido, pelo que nenhuma dessas execuções pode estar realmente a correr.
+def _marcar_interrompidas(nomes):
+    conn = connect_to_uni_analytics_db()
+    conn.execute(f"""
+        UPDATE job_runs SET status = 'interrompido', finished_at = ?
+        WHERE status = 'em_curso' AND job_name IN ({', '.join('?' for _ in nomes)})
+    """, (_agora_str(datetime.now()), *nomes))
+    conn.commit()
+    conn.close()
+
+################### Agendamento ###################
+# Devolve a marcação em atraso de um job (datetime) ou None se ainda não for altura de correr.
+# Nos jobs diários é a última ocorrência de hora:minuto, se ainda não houver execução para ela (recuperação de
+# execuções perdidas: várias marcações perdidas dão uma única execução). Nos jobs de intervalo é o momento atual,
+# se já passaram minutos minutos desde a última execução.
+def _marcacao_pendente(job, agora):
+    ultima = _ultima_marcacao(job["nome"])
+    if job["tipo"] == "diario":
+        marcacao = agora.replace(hour=job["hora"], minute=job["minuto"], second=0, microsecond=0)
+        if marcacao > agora:
+            marcacao -= timedelta(days=1)
+        return marcacao if ultima is None or ultima < marcacao else None
+    if ultima is None or ultima + timedelta(minutes=job["minutos"]) <= agora:
+        return agora.replace(microsecond=0)
+    return None
+
+# Um job espera enquanto algum dos jobs de que depende (apos) estiver a correr ou pendente,
+# ou enquanto outro job com o mesmo lock estiver a correr neste processo
+def _bloqueado(job):
+    return any(
+        (outro["nome"] in job["apos"] and (outro["processo"] is not None or outro["marcacao"] is not None))
+        or (outro["lock"] == job["lock"] and outro["processo"] is not None)
+        for outro in _jobs if outro is not job
+    )
+
+# Corpo do processo filho: corre o job e termina com código 1 se houver uma exceção não tratada
+def _executar(nome, funcao):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        funcao()
+    except Exception:
+        logger.exception(f"[JOB] Erro não tratado no job {nome}.")
+        sys.exit(1)
+
+# Tenta arrancar um job: obtém o lock (sem esperar) e lança o processo filho. Devolve False se o lock estiver ocupado.
+def _arrancar(job):
+    os.makedirs(JOB_LOCK_DIR, exist_ok=True)
+    ficheiro_lock = open(os.path.join(JOB_LOCK_DIR, f"{job['lock']}.lock"), "w")
+    try:
+        fcntl.flock(ficheiro_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        ficheiro_lock.close()
+        return False
+
+    _marcar_interrompidas([outro["nome"] for outro in _jobs if outro["lock"] == job["lock"]])
+    processo = _contexto.Process(target=_executar, args=(job["nome"], job["funcao"]), name=f"job-{job['nome']}")
+    processo.start()
+    job.update(processo=processo, ficheiro_lock=ficheiro_lock, inicio=time.monotonic())
+    job["run_id"] = _registar_inicio(job, processo.pid)
+    logger.info(f"[JOB] Job {job['nome']} iniciado (pid {processo.pid}, marcado para {_agora_str(job['marcacao'])}).")
+    return True
+
+# Regista o fim de um job, liberta o lock e deixa-o pronto para a próxima marcação
+def _concluir(job, status, erro=None):
+    _registar_fim(job, status, erro)
+    fcntl.flock(job["ficheiro_lock"], fcntl.LOCK_UN)
+    job["ficheiro_lock"].close()
+    duracao = time.monotonic() - job["inicio"]
+    logger.info(f"[JOB] Job {job['nome']} terminou em {duracao:.1f} s ({status}).")
+    job.update(processo=None, ficheiro_lock=None, marcacao=None, arranque=None)
+
+# Termina o processo de um job (SIGTERM e, se não terminar a tempo, SIGKILL)
+def _parar(job):
+    processo = job["processo"]
+    processo.terminate()
+    processo.join(JOB_KILL_GRACE_SECONDS)
+    if processo.is_alive():
+        processo.kill()
+        processo.join()
+
+# Acompanha um job em curso: deteta o fim do processo ou o fim do timeout
+def _acompanhar(job):
+    processo = job["processo"]
+    if processo.is_alive():
+        if job["timeout"] and time.monotonic() - job["inicio"] > job["timeout"]:
+            logger.error(f"[JOB] Job {job['nome']} excedeu o timeout de {job['timeout'] / 60:.0f} minutos e vai ser terminado.")
+            _parar(job)
+            _concluir(job, "timeout", f"Timeout de {job['timeout'] / 60:.0f} minutos excedido.")
+        return
+    if processo.exitcode == 0:
+        _concluir(job, "ok")
+    else:
+        _concluir(job, "erro", f"Processo terminou com código {processo.exitcode}.")
+
+# Uma volta do executor: acompanha os jobs em curso e arranca os que estão em atraso
+def _verificar_jobs():
+    agora = datetime.now()
+    for job in _jobs:
+        if job["processo"] is not None:
+            _acompanhar(job)
+            continue
+
+        if job["marcacao"] is None:
+            marcacao = _marcacao_pendente(job, agora)
+            if marcacao is None:
+                continue
+            # O jitter espalha o arranque dos jobs marcados para a mesma hora
+            job["marcacao"] = marcacao
+            job["arranque"] = time.monotonic() + random.uniform(0, job["jitter"])
+
+        if time.monotonic() < job["arranque"] or _bloqueado(job):
+            continue
+        if not _arrancar(job):
+            logger.debug(f"[JOB] Job {job['nome']} adiado: lock '{job['lock']}' ocupado por outra execução.")
+            # A outra execução pode ser de outro processo: volta a verificar-se se o job continua em atraso
+            job["marcacao"] = None
+
+def _pedir_fim(signum, frame):
+    _estado["a_terminar"] = True
+
+# Ciclo principal do executor (não retorna até o processo receber SIGTERM/SIGINT).
+# Ao terminar, os jobs em curso são parados e ficam registados como interrompidos (voltam a correr no arranque).
+def executar_jobs():
+    signal.signal(signal.SIGTERM, _pedir_fim)
+    signal.signal(signal.SIGINT, _pedir_fim)
+    for job in _jobs:
+        agendamento = f"todos os dias às {job['hora']:02d}:{job['minuto']:02d}" if job["tipo"] == "diario" else f"a cada {job['minutos']} minutos"
+        logger.info(f"[JOB] Job {job['nome']} agendado {agendamento} (timeout: {job['timeout'] or 'nenhum'} s, jitter: {job['jitter']} s).")
+
+    while not _estado["a_terminar"]:
+        try:
+            _verificar_jobs()
+        except Exception:
+            logger.exception("[JOB] Erro no executor de jobs.")
+        time.sleep(JOB_TICK_SECONDS)
+
+    for job in _jobs:
+        if job["processo"] is not None:
+            logger.warning(f"[JOB] Scheduler a terminar: job {job['nome']} interrompido.")
+            _parar(job)
+            _concluir(job, "interrompido", "Scheduler terminado durante a execução.")
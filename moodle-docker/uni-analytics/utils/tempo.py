@@ -0,0 +1,38 @@
+import time
+import pandas as pd
+from datetime import datetime
+from dateutil import tz
+
+# As colunas temporais das tabelas sincronizadas guardam epochs unix (segundos, inteiros), como o Moodle.
+# As conversões para datas legíveis são feitas só na apresentação, com o fuso horário local do servidor
+# (o mesmo usado pelo SQLite com o modificador 'localtime').
+_FUSO_LOCAL = tz.tzlocal()
+
+# Epoch do momento atual
+def epoch_agora():
+    return int(time.time())
+
+# Converte um valor temporal (epoch, datetime, date ou texto ISO "AAAA-MM-DD[ HH:MM:SS]" em hora local) para epoch.
+# Uma data sem hora corresponde à meia-noite local. None mantém-se None.
+def para_epoch(valor):
+    if valor is None:
+        return None
+    if isinstance(valor, (int, float)):
+        return int(valor)
+    if isinstance(valor, str):
+        valor = datetime.fromisoformat(valor)
+    if not isinstance(valor, datetime):
+        valor = datetime(valor.year, valor.month, valor.day)
+    return int(valor.timestamp())
+
+# Converte um epoch para datetime na hora local (None se não houver valor)
+def de_epoch(epoch):
+    return datetime.fromtimestamp(epoch) if epoch is not None else None
+
+# Formata um epoch na hora local (valor_vazio se não houver valor)
+def formatar_epoch(epoch, formato="%d/%m/%Y %H:%M", valor_vazio="—"):
+    return datetime.fromtimestamp(epoch).strftime(formato) if epoch is not None else valor_vazio
+
+# Converte uma coluna de epochs (Series) para datetimes locais sem fuso, de forma vetorizada
+def epochs_para_datetime(serie):
+    return pd.to_datetime(serie, unit="s", utc=True).dt.tz_convert(_FUSO_LOCAL).dt.tz_localize(None)